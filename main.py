@@ -3,268 +3,237 @@
 
 import sys
 import os
-import math
+import time
 import platform
-from PIL import Image, ImageFont, ImageDraw, ImageEnhance, ImageChops, ImageOps
+import threading
+from PIL import Image
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                              QLabel, QLineEdit, QPushButton, QFileDialog, QSpinBox, 
                              QDoubleSpinBox, QComboBox, QGroupBox, QCheckBox, QProgressBar,
-                             QMessageBox, QTextEdit, QSlider, QColorDialog, QTabWidget,
+                             QMessageBox, QPlainTextEdit, QSlider, QColorDialog, QTabWidget,
                              QRadioButton, QButtonGroup)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
-from PyQt5.QtGui import QFont, QColor, QPalette
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal
+from PyQt5.QtGui import QFont, QColor, QPalette, QImage, QPixmap
+
+from watermark import (WatermarkRenderer, BatchExecutor, BackgroundScanner, Manifest,
+                       OverlayCache, overlay_cache, scan_images, skip_current)
+from watermark.timing import StageTimer
+from watermark.progress import LogSink
+from watermark.encode import output_extension
+from watermark.rendition import parse_renditions
+from watermark.stamps import StampCache
+from watermark.dedup import Deduplicator, deduplicate
+from watermark.archive import ArchiveWriter, OutputCapture, is_archive, scan_archive
+from watermark.preview import PREVIEW_SIZE, load_proxy, render_preview, first_image
+
 
 class WatermarkThread(QThread):
     progress = pyqtSignal(int)
+    status = pyqtSignal(str)
     log = pyqtSignal(str)
     finished = pyqtSignal()
 
-    def __init__(self, file_paths, mark_type, text_mark, image_mark_path, output_dir, 
-                 color, space, angle, font_family, font_height_crop, size, opacity, 
-                 quality, image_scale, image_opacity):
+    def __init__(self, file_paths, mark_type, text_mark, image_mark_path, output_dir,
+                 color, space, angle, font_family, font_height_crop, size, opacity,
+                 quality, image_scale, image_opacity, cache_mb=256, workers=1,
+                 backend='thread', render_mode='visible', stream_mp=100, stream_memory_mb=64,
+                 incremental=True, verify_hash=False, input_dir=None, timing=False,
+                 timing_memory=False, log_path=None, profile='balanced', output_format=None,
+                 keep_metadata=True, renditions=None, shared_palette=False,
+                 memory_budget_mb=0, stamp_cache=None, dedup=False, archive=False):
         super().__init__()
         self.file_paths = file_paths
-        self.mark_type = mark_type  # 'text' 或 'image'
-        self.text_mark = text_mark
-        self.image_mark_path = image_mark_path
+        self.log_path = log_path
         self.output_dir = output_dir
-        self.color = color
-        self.space = space
-        self.angle = angle
-        self.font_family = font_family
-        self.font_height_crop = font_height_crop
-        self.size = size
-        self.opacity = opacity
-        self.quality = quality
-        self.image_scale = image_scale
-        self.image_opacity = image_opacity
-        self._is_running = True
+        self.incremental = incremental
+        self.verify_hash = verify_hash
+        self.dedup = dedup
+        self.archive = archive  # 输入或输出为压缩包，不记录处理记录
+        self.stopped = False
+        self.renderer = WatermarkRenderer(mark_type, text_mark, image_mark_path, output_dir,
+                                          color, space, angle, font_family, font_height_crop,
+                                          size, opacity, quality, image_scale, image_opacity,
+                                          cache_mb=cache_mb, render_mode=render_mode,
+                                          stream_mp=stream_mp, stream_memory_mb=stream_memory_mb,
+                                          input_dir=input_dir, log=self.log.emit,
+                                          profile=profile, output_format=output_format,
+                                          keep_metadata=keep_metadata, renditions=renditions,
+                                          shared_palette=shared_palette,
+                                          stamp_cache=stamp_cache)
+        if timing:
+            self.renderer.timer = StageTimer(track_memory=timing_memory)
+        if is_archive(output_dir):
+            self.renderer.capture = OutputCapture()
+        self.executor = BatchExecutor(self.renderer, workers=workers, backend=backend,
+                                      memory_budget_mb=memory_budget_mb)
 
     def stop(self):
-        self._is_running = False
+        self.stopped = True
+        self.executor.stop()
+        if isinstance(self.file_paths, BackgroundScanner):
+            self.file_paths.stop()
+
+    def total_found(self):
+        """输入总数，后台扫描尚未结束时返回 None"""
+        if isinstance(self.file_paths, BackgroundScanner):
+            return self.file_paths.found if self.file_paths.finished else None
+        return len(self.file_paths)
+
+    def emit_progress(self, percent, status):
+        if percent is not None:
+            self.progress.emit(percent)
+        self.status.emit(status)
 
     def run(self):
+        # 日志和进度按间隔合并后再发给界面，界面开销与图片数量无关
+        sink = LogSink(self.log.emit, self.emit_progress, log_path=self.log_path)
+        self.renderer.log = sink.write
+        completed = False
         try:
-            if self.mark_type == 'text':
-                mark_func = self.gen_text_mark()
+            # 先在当前线程生成一次水印，校验参数并输出字体警告
+            mark_func = self.renderer.build_mark()
+
+            skipped = []
+            manifest = None
+            if not self.archive:
+                manifest = Manifest(self.output_dir, self.renderer.params_hash(),
+                                    use_hash=self.verify_hash, input_dir=self.renderer.input_dir)
+            if manifest and self.incremental:
+                file_paths = skip_current(manifest, self.renderer, self.file_paths, skipped)
             else:
-                mark_func = self.gen_image_mark()
-                
-            total = len(self.file_paths)
-            
-            for i, image_path in enumerate(self.file_paths):
-                if not self._is_running:
-                    break
-                    
-                try:
-                    self.process_image(image_path, mark_func)
-                    progress = int((i + 1) / total * 100)
-                    self.progress.emit(progress)
-                except Exception as e:
-                    self.log.emit(f"错误: {os.path.basename(image_path)} - {str(e)}")
-            
-            self.log.emit("处理完成！")
-            self.finished.emit()
-            
-        except Exception as e:
-            self.log.emit(f"处理过程中发生错误: {str(e)}")
-            self.finished.emit()
+                file_paths = self.file_paths
+            writer = ArchiveWriter(self.output_dir) if self.renderer.capture else None
 
-    def process_image(self, imagePath, mark):
-        im = Image.open(imagePath)
-        im = ImageOps.exif_transpose(im)
-
-        image = mark(im)
-        name = os.path.basename(imagePath)
-        if image:
-            if not os.path.exists(self.output_dir):
-                os.makedirs(self.output_dir)
-
-            new_name = os.path.join(self.output_dir, name)
-            if os.path.splitext(new_name)[1] != '.png':
-                image = image.convert('RGB')
-            image.save(new_name, quality=self.quality)
-            self.log.emit(f"✓ {name} - 成功")
-        else:
-            self.log.emit(f"✗ {name} - 失败")
-
-    def set_opacity(self, im, opacity):
-        assert opacity >= 0 and opacity <= 1
-        if im.mode != 'RGBA':
-            im = im.convert('RGBA')
-        alpha = im.split()[3]
-        alpha = ImageEnhance.Brightness(alpha).enhance(opacity)
-        im.putalpha(alpha)
-        return im
-
-    def crop_image(self, im):
-        bg = Image.new(mode='RGBA', size=im.size)
-        diff = ImageChops.difference(im, bg)
-        del bg
-        bbox = diff.getbbox()
-        if bbox:
-            return im.crop(bbox)
-        return im
-
-    def get_default_font(self):
-        """获取系统默认字体"""
-        system = platform.system()
-        if system == "Darwin":  # macOS
-            mac_fonts = [
-                "/System/Library/Fonts/PingFang.ttc",
-                "/System/Library/Fonts/Arial.ttf",
-                "/System/Library/Fonts/Helvetica.ttc",
-                "/Library/Fonts/Arial.ttf"
-            ]
-            for font_path in mac_fonts:
-                if os.path.exists(font_path):
-                    return font_path
-        elif system == "Windows":
-            win_fonts = [
-                "C:/Windows/Fonts/simhei.ttf",
-                "C:/Windows/Fonts/msyh.ttc",
-                "C:/Windows/Fonts/arial.ttf"
-            ]
-            for font_path in win_fonts:
-                if os.path.exists(font_path):
-                    return font_path
-        else:
-            linux_fonts = [
-                "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-                "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf"
-            ]
-            for font_path in linux_fonts:
-                if os.path.exists(font_path):
-                    return font_path
-        return None
-
-    def gen_text_mark(self):
-        """生成文字水印"""
-        is_height_crop_float = '.' in self.font_height_crop
-        width = len(self.text_mark) * self.size
-        if is_height_crop_float:
-            height = round(self.size * float(self.font_height_crop))
-        else:
-            height = int(self.font_height_crop)
+            dedup = Deduplicator(self.renderer) if self.dedup else None
+            if dedup:
+                results = deduplicate(self.executor, self.renderer, file_paths, mark_func, dedup)
+            else:
+                results = self.executor.run(file_paths, mark_func)
 
-        mark = Image.new(mode='RGBA', size=(width, height))
-        draw_table = ImageDraw.Draw(im=mark)
-        
-        # 字体处理
-        font = None
-        if self.font_family and os.path.exists(self.font_family):
-            try:
-                font = ImageFont.truetype(self.font_family, size=self.size)
-            except:
-                self.log.emit(f"警告: 无法加载字体 {self.font_family}，使用系统默认字体")
-        
-        if font is None:
-            default_font = self.get_default_font()
-            if default_font and os.path.exists(default_font):
-                try:
-                    font = ImageFont.truetype(default_font, size=self.size)
-                except:
-                    pass
-        
-        if font is None:
             try:
-                font = ImageFont.load_default()
-            except:
-                self.log.emit("警告: 使用默认字体失败")
-
-        draw_table.text(xy=(0, 0),
-                        text=self.text_mark,
-                        fill=self.color,
-                        font=font)
-        del draw_table
-
-        mark = self.crop_image(mark)
-        mark = self.set_opacity(mark, self.opacity)
-
-        def mark_im(im):
-            c = int(math.sqrt(im.size[0] * im.size[0] + im.size[1] * im.size[1]))
-            mark2 = Image.new(mode='RGBA', size=(c, c))
-
-            y, idx = 0, 0
-            while y < c:
-                x = -int((mark.size[0] + self.space) * 0.5 * idx)
-                idx = (idx + 1) % 2
-
-                while x < c:
-                    mark2.paste(mark, (x, y))
-                    x = x + mark.size[0] + self.space
-                y = y + mark.size[1] + self.space
-
-            mark2 = mark2.rotate(self.angle)
-
-            if im.mode != 'RGBA':
-                im = im.convert('RGBA')
-            im.paste(mark2, 
-                    (int((im.size[0] - c) / 2), int((im.size[1] - c) / 2)),
-                    mask=mark2.split()[3])
-            del mark2
-            return im
-
-        return mark_im
-
-    def gen_image_mark(self):
-        """生成图片水印"""
-        if not self.image_mark_path or not os.path.exists(self.image_mark_path):
-            raise Exception("图片水印文件不存在")
-        
-        # 加载水印图片
-        mark_img = Image.open(self.image_mark_path)
-        
-        # 转换为RGBA模式
-        if mark_img.mode != 'RGBA':
-            mark_img = mark_img.convert('RGBA')
-        
-        # 调整图片大小
-        base_size = 100  # 基准大小
-        scale_factor = self.image_scale / 100.0
-        new_width = int(mark_img.width * scale_factor)
-        new_height = int(mark_img.height * scale_factor)
-        mark_img = mark_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        
-        # 设置透明度
-        mark_img = self.set_opacity(mark_img, self.image_opacity / 100.0)
+                for i, (image_path, ok, message) in enumerate(results):
+                    if writer:
+                        for output, data in self.renderer.capture.pop(image_path):
+                            if ok:
+                                writer.write(os.path.relpath(output, self.output_dir), data)
+                    if ok and manifest:
+                        manifest.record(image_path, self.renderer.output_path(image_path))
+                    sink.write(message)
+                    # 扫描结束、总数确定后才能计算进度和剩余时间
+                    total = self.total_found()
+                    sink.progress(i + 1, total - len(skipped) if total else None)
+                completed = not self.stopped
+            finally:
+                if isinstance(self.file_paths, BackgroundScanner):
+                    self.file_paths.stop()
+                if manifest:
+                    manifest.close()
+                if writer:
+                    # 中途停止时不留下不完整的压缩包
+                    writer.close(keep=completed)
+
+            if skipped:
+                sink.write(f"跳过 {len(skipped)} 个已是最新的图片")
+            if not self.total_found():
+                sink.write("未找到图片文件")
+
+            if self.executor.backend != 'process':
+                stats = overlay_cache.stats()
+                sink.write(f"水印层缓存: 命中 {stats['hits']}, 未命中 {stats['misses']}, "
+                           f"淘汰 {stats['evictions']}, 占用 {stats['bytes'] / 1024 / 1024:.1f} MB")
+            if self.executor.stage_report():
+                sink.write(self.executor.stage_report())
+            if self.executor.admission_report():
+                sink.write(self.executor.admission_report())
+            if dedup and dedup.duplicates:
+                sink.write(dedup.report())
+            if self.renderer.timer is not None:
+                sink.write(self.renderer.timer.report())
+            if completed:
+                sink.write(f"处理完成！平均 {sink.meter.status()}")
+            else:
+                sink.write(f"处理已停止，平均 {sink.meter.status()}")
 
-        def mark_im(im):
-            c = int(math.sqrt(im.size[0] * im.size[0] + im.size[1] * im.size[1]))
-            mark2 = Image.new(mode='RGBA', size=(c, c))
+        except Exception as e:
+            sink.write(f"处理过程中发生错误: {str(e)}")
+        finally:
+            sink.close()
+            # 停止或出错时进度条停在实际位置，不显示为已完成
+            if completed:
+                self.progress.emit(100)
+            self.finished.emit()
 
-            y, idx = 0, 0
-            while y < c:
-                x = -int((mark_img.size[0] + self.space) * 0.5 * idx)
-                idx = (idx + 1) % 2
 
-                while x < c:
-                    mark2.paste(mark_img, (x, y))
-                    x = x + mark_img.size[0] + self.space
-                y = y + mark_img.size[1] + self.space
+class PreviewThread(QThread):
+    """后台渲染预览，只处理最新的一次请求"""
+    rendered = pyqtSignal(QImage, str)
+    failed = pyqtSignal(str)
 
-            mark2 = mark2.rotate(self.angle)
+    def __init__(self):
+        super().__init__()
+        self._request = None
+        self._samples = {}  # 输入路径 -> 样图路径，调整参数时不必重新扫描
+        self._proxy = (None, None, None)  # (路径, 样图, 缩放比例)，调整参数时不必重新解码
+        # 预览的水印层单独缓存，不挤占正在运行的批处理的 overlay_cache
+        self.layer_cache = OverlayCache(32 * 1024 * 1024)
+        self._cond = threading.Condition()
+        self._is_running = True
 
-            if im.mode != 'RGBA':
-                im = im.convert('RGBA')
-            im.paste(mark2, 
-                    (int((im.size[0] - c) / 2), int((im.size[1] - c) / 2)),
-                    mask=mark2.split()[3])
-            del mark2
-            return im
+    def request(self, input_path, renderer):
+        with self._cond:
+            self._request = (input_path, renderer)
+            self._cond.notify()
 
-        return mark_im
+    def stop(self):
+        with self._cond:
+            self._is_running = False
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while self._request is None and self._is_running:
+                    self._cond.wait()
+                if not self._is_running:
+                    return
+                input_path, renderer = self._request
+                self._request = None
+
+            try:
+                start = time.perf_counter()
+                # 扫描文件夹可能很慢（如网络存储），在后台线程中进行，每个输入只扫描一次；
+                # 没有找到图片时不记录，输入路径（如正在输入的路径）之后可能出现图片
+                path = self._samples.get(input_path)
+                if path is None:
+                    path = first_image(input_path)
+                    if path is None:
+                        self.failed.emit("输入中没有找到图片")
+                        continue
+                    self._samples[input_path] = path
+                if self._proxy[0] != path:
+                    self._proxy = (path,) + load_proxy(path, PREVIEW_SIZE)
+                _, proxy, scale = self._proxy
+                image = render_preview(renderer, path, proxy, scale).convert('RGBA')
+                qimage = QImage(image.tobytes(), image.width, image.height, image.width * 4,
+                                QImage.Format_RGBA8888).copy()
+                elapsed = (time.perf_counter() - start) * 1000
+                self.rendered.emit(qimage, f"{os.path.basename(path)} - 缩放 {scale:.2f}, "
+                                           f"渲染 {elapsed:.0f}ms")
+            except Exception as e:
+                self.failed.emit(f"预览失败: {str(e)}")
 
 
 class WatermarkApp(QMainWindow):
+    LOG_MAX_LINES = 5000  # 界面上只保留最近的日志，完整日志可保存到文件
     def __init__(self):
         super().__init__()
         self.init_ui()
         self.watermark_thread = None
+        self.setup_preview()
 
     def init_ui(self):
         self.setWindowTitle("图片水印添加工具 - 支持文字和图片水印")
-        self.setFixedSize(750, 850)
+        self.setFixedSize(1180, 850)
 
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -275,9 +244,12 @@ class WatermarkApp(QMainWindow):
         system_info.setStyleSheet("color: gray; font-size: 10px;")
         layout.addWidget(system_info)
 
-        # 创建标签页
+        # 创建标签页，右侧为预览
+        top_layout = QHBoxLayout()
+        layout.addLayout(top_layout)
         tabs = QTabWidget()
-        layout.addWidget(tabs)
+        top_layout.addWidget(tabs)
+        self.setup_preview_pane(top_layout)
 
         # 基本设置标签页
         basic_tab = QWidget()
@@ -320,6 +292,21 @@ class WatermarkApp(QMainWindow):
         output_layout.addWidget(self.output_btn)
         file_layout.addLayout(output_layout)
 
+        # 扫描选项
+        scan_layout = QHBoxLayout()
+        self.recursive_check = QCheckBox("包含子文件夹")
+        self.recursive_check.setChecked(True)
+        scan_layout.addWidget(self.recursive_check)
+        scan_layout.addWidget(QLabel("包含:"))
+        self.include_edit = QLineEdit()
+        self.include_edit.setPlaceholderText("例如 *.jpg, 2024/*")
+        scan_layout.addWidget(self.include_edit)
+        scan_layout.addWidget(QLabel("排除:"))
+        self.exclude_edit = QLineEdit()
+        self.exclude_edit.setPlaceholderText("例如 thumbs, *_raw.*")
+        scan_layout.addWidget(self.exclude_edit)
+        file_layout.addLayout(scan_layout)
+
         layout.addWidget(file_group)
 
         # 水印类型选择
@@ -516,8 +503,212 @@ class WatermarkApp(QMainWindow):
         quality_layout.addWidget(self.quality_spin)
         style_layout.addLayout(quality_layout)
 
+        # 输出编码
+        encode_layout = QHBoxLayout()
+        encode_layout.addWidget(QLabel("编码档位:"))
+        self.profile_combo = QComboBox()
+        self.profile_combo.addItem("均衡", 'balanced')
+        self.profile_combo.addItem("最快（文件较大）", 'fast')
+        self.profile_combo.addItem("最小（编码较慢）", 'smallest')
+        encode_layout.addWidget(self.profile_combo)
+        encode_layout.addWidget(QLabel("输出格式:"))
+        self.format_combo = QComboBox()
+        self.format_combo.addItem("与输入相同", None)
+        self.format_combo.addItem("WebP", 'webp')
+        self.format_combo.addItem("AVIF", 'avif')
+        self.format_combo.addItem("JPEG", 'jpeg')
+        self.format_combo.addItem("PNG", 'png')
+        encode_layout.addWidget(self.format_combo)
+        self.metadata_check = QCheckBox("保留EXIF/ICC")
+        self.metadata_check.setChecked(True)
+        encode_layout.addWidget(self.metadata_check)
+        self.palette_check = QCheckBox("GIF共用调色板")
+        self.palette_check.setToolTip("动画 GIF 所有帧共用一个调色板，帧数多时保存快得多，颜色略有损失")
+        encode_layout.addWidget(self.palette_check)
+        encode_layout.addStretch()
+        style_layout.addLayout(encode_layout)
+
+        # 多尺寸输出
+        rendition_layout = QHBoxLayout()
+        rendition_layout.addWidget(QLabel("输出尺寸:"))
+        self.rendition_edit = QLineEdit()
+        self.rendition_edit.setPlaceholderText("留空只输出原图；例如 full, 2048, 1024, 320:webp:70")
+        self.rendition_edit.setToolTip("最长边[:格式[:质量[:后缀]]]，多个尺寸用逗号分隔，后缀默认为 _最长边")
+        rendition_layout.addWidget(self.rendition_edit)
+        style_layout.addLayout(rendition_layout)
+
+        # 水印层缓存上限
+        cache_layout = QHBoxLayout()
+        cache_layout.addWidget(QLabel("水印缓存上限:"))
+        self.cache_spin = QSpinBox()
+        self.cache_spin.setRange(0, 8192)
+        self.cache_spin.setValue(256)
+        self.cache_spin.setSuffix(" MB")
+        cache_layout.addWidget(self.cache_spin)
+        style_layout.addLayout(cache_layout)
+
+        # 水印层渲染方式
+        render_layout = QHBoxLayout()
+        render_layout.addWidget(QLabel("渲染方式:"))
+        self.render_combo = QComboBox()
+        self.render_combo.addItem("仅可见区域（省内存）", 'visible')
+        self.render_combo.addItem("对角线画布（旧版）", 'canvas')
+        render_layout.addWidget(self.render_combo)
+        render_layout.addStretch()
+        style_layout.addLayout(render_layout)
+
+        # 超大图片分带流式处理（PNG/TIFF）
+        stream_layout = QHBoxLayout()
+        stream_layout.addWidget(QLabel("流式处理阈值:"))
+        self.stream_spin = QSpinBox()
+        self.stream_spin.setRange(0, 100000)
+        self.stream_spin.setValue(100)
+        self.stream_spin.setSuffix(" 百万像素")
+        self.stream_spin.setSpecialValueText("关闭")
+        stream_layout.addWidget(self.stream_spin)
+        stream_layout.addWidget(QLabel("内存上限:"))
+        self.stream_memory_spin = QSpinBox()
+        self.stream_memory_spin.setRange(8, 4096)
+        self.stream_memory_spin.setValue(64)
+        self.stream_memory_spin.setSuffix(" MB")
+        stream_layout.addWidget(self.stream_memory_spin)
+        style_layout.addLayout(stream_layout)
+
         layout.addWidget(style_group)
 
+        # 并行处理
+        parallel_group = QGroupBox("并行处理")
+        parallel_layout = QVBoxLayout(parallel_group)
+
+        workers_layout = QHBoxLayout()
+        workers_layout.addWidget(QLabel("工作线程/进程数:"))
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, 256)
+        self.workers_spin.setValue(os.cpu_count() or 1)
+        workers_layout.addWidget(self.workers_spin)
+        workers_layout.addStretch()
+        parallel_layout.addLayout(workers_layout)
+
+        backend_layout = QHBoxLayout()
+        backend_layout.addWidget(QLabel("执行方式:"))
+        self.backend_combo = QComboBox()
+        self.backend_combo.addItem("进程池（适合CPU密集合成）", 'process')
+        self.backend_combo.addItem("线程池（编解码时释放GIL）", 'thread')
+        self.backend_combo.addItem("流水线（读取/合成/写入分阶段并行）", 'pipeline')
+        backend_layout.addWidget(self.backend_combo)
+        backend_layout.addStretch()
+        parallel_layout.addLayout(backend_layout)
+
+        budget_layout = QHBoxLayout()
+        budget_layout.addWidget(QLabel("内存预算(MB):"))
+        self.memory_budget_spin = QSpinBox()
+        self.memory_budget_spin.setRange(0, 1024 * 1024)
+        self.memory_budget_spin.setSingleStep(256)
+        self.memory_budget_spin.setSpecialValueText("不限")
+        self.memory_budget_spin.setToolTip("按文件头估计每张图片的峰值内存，同时处理的图片估计值之和不超过该值；"
+                                           "大图放不下时先处理小图")
+        budget_layout.addWidget(self.memory_budget_spin)
+        budget_layout.addStretch()
+        parallel_layout.addLayout(budget_layout)
+
+        layout.addWidget(parallel_group)
+
+        # 增量处理
+        incremental_group = QGroupBox("增量处理")
+        incremental_layout = QVBoxLayout(incremental_group)
+        self.incremental_check = QCheckBox("跳过已处理且未改变的图片（中断后可继续处理）")
+        self.incremental_check.setChecked(True)
+        incremental_layout.addWidget(self.incremental_check)
+        self.hash_check = QCheckBox("记录文件内容哈希（修改时间变化但内容相同时也跳过）")
+        incremental_layout.addWidget(self.hash_check)
+        self.dedup_check = QCheckBox("内容相同的图片只处理一次（其余输出为硬链接或副本）")
+        incremental_layout.addWidget(self.dedup_check)
+        layout.addWidget(incremental_group)
+
+        # 耗时统计
+        timing_group = QGroupBox("耗时统计")
+        timing_layout = QHBoxLayout(timing_group)
+        self.timing_check = QCheckBox("记录各阶段耗时")
+        timing_layout.addWidget(self.timing_check)
+        self.timing_memory_check = QCheckBox("同时记录内存变化")
+        timing_layout.addWidget(self.timing_memory_check)
+        self.timing_export_btn = QPushButton("导出统计")
+        self.timing_export_btn.setEnabled(False)
+        self.timing_export_btn.clicked.connect(self.export_timing)
+        timing_layout.addWidget(self.timing_export_btn)
+        timing_layout.addStretch()
+        layout.addWidget(timing_group)
+
+        # 日志文件
+        self.log_file_check = QCheckBox("把完整日志保存到输出目录的 watermark.log")
+        layout.addWidget(self.log_file_check)
+
+    def setup_preview_pane(self, layout):
+        preview_group = QGroupBox("效果预览")
+        preview_layout = QVBoxLayout(preview_group)
+        self.preview_label = QLabel("选择输入图片并输入水印后显示预览")
+        self.preview_label.setFixedSize(PREVIEW_SIZE[0], PREVIEW_SIZE[1])
+        self.preview_label.setAlignment(Qt.AlignCenter)
+        self.preview_label.setStyleSheet("border: 1px solid gray;")
+        preview_layout.addWidget(self.preview_label)
+        self.preview_info = QLabel("")
+        self.preview_info.setStyleSheet("color: gray; font-size: 10px;")
+        preview_layout.addWidget(self.preview_info)
+        preview_layout.addStretch()
+        layout.addWidget(preview_group)
+
+    def setup_preview(self):
+        """参数变化后稍作等待再渲染，连续拖动滑块时只渲染最后一次"""
+        self.preview_thread = PreviewThread()
+        self.preview_thread.rendered.connect(self.show_preview)
+        self.preview_thread.failed.connect(self.preview_info.setText)
+        self.preview_thread.start()
+
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(30)
+        self.preview_timer.timeout.connect(self.request_preview)
+
+        for signal in (self.input_path.textChanged, self.mark_text.textChanged,
+                       self.color_edit.textChanged, self.text_radio.toggled,
+                       self.image_mark_path.textChanged, self.image_scale_slider.valueChanged,
+                       self.image_opacity_slider.valueChanged, self.font_path.textChanged,
+                       self.font_size.valueChanged, self.opacity_slider.valueChanged,
+                       self.angle_spin.valueChanged, self.space_spin.valueChanged,
+                       self.render_combo.currentIndexChanged):
+            signal.connect(self.preview_timer.start)
+
+    def request_preview(self):
+        input_path = self.input_path.text()
+        if self.text_radio.isChecked():
+            ready = bool(self.mark_text.text())
+        else:
+            ready = os.path.isfile(self.image_mark_path.text())
+        if not ready or not input_path:
+            self.preview_label.setText("选择输入图片并输入水印后显示预览")
+            self.preview_info.setText("")
+            return
+
+        renderer = WatermarkRenderer(
+            'text' if self.text_radio.isChecked() else 'image',
+            self.mark_text.text(), self.image_mark_path.text(), self.output_path.text(),
+            self.color_edit.text(), self.space_spin.value(), self.angle_spin.value(),
+            self.font_path.text(), "1.2", self.font_size.value(),
+            self.opacity_slider.value() / 100, self.quality_spin.value(),
+            self.image_scale_slider.value(), self.image_opacity_slider.value(),
+            render_mode=self.render_combo.currentData(),
+            layer_cache=self.preview_thread.layer_cache)
+        self.preview_thread.request(input_path, renderer)
+
+    def show_preview(self, qimage, info):
+        self.preview_label.setPixmap(QPixmap.fromImage(qimage))
+        self.preview_info.setText(info)
+
+    def closeEvent(self, event):
+        self.preview_thread.stop()
+        self.preview_thread.wait()
+        super().closeEvent(event)
+
     def setup_progress_log(self, layout):
         # 控制按钮
         btn_layout = QHBoxLayout()
@@ -534,15 +725,19 @@ class WatermarkApp(QMainWindow):
         btn_layout.addWidget(self.stop_btn)
         layout.addLayout(btn_layout)
 
-        # 进度条
+        # 进度条，下方显示处理速度和预计剩余时间
         self.progress_bar = QProgressBar()
         layout.addWidget(self.progress_bar)
+        self.status_label = QLabel("")
+        self.status_label.setStyleSheet("color: gray; font-size: 10px;")
+        layout.addWidget(self.status_label)
 
         # 日志输出
         log_group = QGroupBox("处理日志")
         log_layout = QVBoxLayout(log_group)
-        self.log_text = QTextEdit()
+        self.log_text = QPlainTextEdit()
         self.log_text.setReadOnly(True)
+        self.log_text.setMaximumBlockCount(self.LOG_MAX_LINES)
         log_layout.addWidget(self.log_text)
         layout.addWidget(log_group)
 
@@ -560,7 +755,8 @@ class WatermarkApp(QMainWindow):
     def select_input(self):
         options = QFileDialog.Options()
         file_path, _ = QFileDialog.getOpenFileName(self, "选择图片文件", "", 
-                                                 "图片文件 (*.jpg *.jpeg *.png *.bmp *.gif);;所有文件 (*)", 
+                                                 "图片文件 (*.jpg *.jpeg *.png *.bmp *.gif *.tif *.tiff);;"
+                                                 "压缩包 (*.zip *.tar *.tar.gz *.tgz *.tar.bz2 *.tar.xz);;所有文件 (*)", 
                                                  options=options)
         if file_path:
             self.input_path.setText(file_path)
@@ -631,32 +827,58 @@ class WatermarkApp(QMainWindow):
             mark_type = 'image'
             image_mark_path = self.image_mark_path.text()
 
-        # 获取文件列表
-        input_path = self.input_path.text()
-        if os.path.isfile(input_path):
-            file_paths = [input_path]
-        else:
-            file_paths = []
-            for file in os.listdir(input_path):
-                if file.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.gif')):
-                    file_paths.append(os.path.join(input_path, file))
+        # 检查 Pillow 是否支持所选的输出格式
+        if self.format_combo.currentData():
+            try:
+                output_extension(self.format_combo.currentData())
+            except ValueError as e:
+                QMessageBox.warning(self, "警告", str(e))
+                return
 
-        if not file_paths:
-            QMessageBox.warning(self, "警告", "未找到图片文件")
+        try:
+            renditions = parse_renditions(self.rendition_edit.text().split(',')) or None
+        except ValueError as e:
+            QMessageBox.warning(self, "警告", str(e))
             return
 
-        # 创建输出目录
+        # 创建输出目录；输出路径以 .zip/.tar 等结尾时写入压缩包
         output_dir = self.output_path.text()
         if not output_dir:
             output_dir = "./output"
-        if not os.path.exists(output_dir):
+        archive_out = is_archive(output_dir)
+        if archive_out and self.dedup_check.isChecked():
+            QMessageBox.warning(self, "警告", "去重需要输出到文件夹，不能与输出压缩包同时使用")
+            return
+        if not archive_out and not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
+        # 在处理线程中后台扫描文件，不阻塞界面
+        input_path = self.input_path.text()
+        include = self.split_patterns(self.include_edit.text())
+        exclude = self.split_patterns(self.exclude_edit.text())
+        archive_in = os.path.isfile(input_path) and is_archive(input_path)
+        if archive_in:
+            # 压缩包成员的数据随队列传递，队列不必长
+            file_paths = BackgroundScanner(scan_archive(input_path, include=include, exclude=exclude),
+                                           maxsize=max(2, self.workers_spin.value()))
+        else:
+            file_paths = BackgroundScanner(scan_images(
+                input_path,
+                recursive=self.recursive_check.isChecked(),
+                include=include,
+                exclude=exclude,
+                skip_dirs=[output_dir]))
+        if archive_out:
+            log_path = output_dir + '.log'
+        else:
+            log_path = os.path.join(output_dir, 'watermark.log')
+
         # 禁用开始按钮，启用停止按钮
         self.start_btn.setEnabled(False)
         self.stop_btn.setEnabled(True)
-        self.progress_bar.setValue(0)
+        self.progress_bar.setRange(0, 0)  # 扫描结束前总数未知
         self.log_text.clear()
+        self.status_label.setText("")
 
         # 启动处理线程
         self.watermark_thread = WatermarkThread(
@@ -674,28 +896,74 @@ class WatermarkApp(QMainWindow):
             opacity=self.opacity_slider.value() / 100,
             quality=self.quality_spin.value(),
             image_scale=self.image_scale_slider.value(),
-            image_opacity=self.image_opacity_slider.value()
+            image_opacity=self.image_opacity_slider.value(),
+            cache_mb=self.cache_spin.value(),
+            render_mode=self.render_combo.currentData(),
+            stream_mp=self.stream_spin.value(),
+            stream_memory_mb=self.stream_memory_spin.value(),
+            incremental=self.incremental_check.isChecked(),
+            verify_hash=self.hash_check.isChecked(),
+            dedup=self.dedup_check.isChecked(),
+            workers=self.workers_spin.value(),
+            backend=self.backend_combo.currentData(),
+            input_dir=input_path if os.path.isdir(input_path) or archive_in else None,
+            timing=self.timing_check.isChecked() or self.timing_memory_check.isChecked(),
+            timing_memory=self.timing_memory_check.isChecked(),
+            log_path=log_path if self.log_file_check.isChecked() else None,
+            profile=self.profile_combo.currentData(),
+            output_format=self.format_combo.currentData(),
+            keep_metadata=self.metadata_check.isChecked(),
+            renditions=renditions,
+            shared_palette=self.palette_check.isChecked(),
+            memory_budget_mb=self.memory_budget_spin.value(),
+            stamp_cache=StampCache(),
+            archive=archive_in or archive_out
         )
 
-        self.watermark_thread.progress.connect(self.progress_bar.setValue)
-        self.watermark_thread.log.connect(self.log_text.append)
+        self.watermark_thread.progress.connect(self.update_progress)
+        self.watermark_thread.log.connect(self.log_text.appendPlainText)
+        self.watermark_thread.status.connect(self.status_label.setText)
         self.watermark_thread.finished.connect(self.processing_finished)
         self.watermark_thread.start()
 
-        self.log_text.append("开始处理图片...")
-        self.log_text.append(f"找到 {len(file_paths)} 个图片文件")
-        self.log_text.append(f"使用{'文字' if mark_type == 'text' else '图片'}水印")
+        self.log_text.appendPlainText("开始处理图片...")
+        self.log_text.appendPlainText(f"使用{'文字' if mark_type == 'text' else '图片'}水印")
+
+    def split_patterns(self, text):
+        patterns = [p.strip() for p in text.replace(';', ',').split(',')]
+        return [p for p in patterns if p] or None
+
+    def update_progress(self, value):
+        if self.progress_bar.maximum() == 0:
+            self.progress_bar.setRange(0, 100)
+        self.progress_bar.setValue(value)
 
     def stop_processing(self):
         if self.watermark_thread and self.watermark_thread.isRunning():
             self.watermark_thread.stop()
             self.watermark_thread.wait()
-            self.log_text.append("处理已停止")
+
+    def export_timing(self):
+        timer = self.watermark_thread.renderer.timer if self.watermark_thread else None
+        if timer is None:
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "导出耗时统计", "watermark-timing.csv",
+                                              "CSV 文件 (*.csv);;JSON 文件 (*.json)")
+        if path:
+            try:
+                timer.export(path)
+                self.log_text.appendPlainText(f"耗时统计已导出: {path}")
+            except Exception as e:
+                QMessageBox.warning(self, "警告", f"导出失败: {str(e)}")
 
     def processing_finished(self):
+        self.timing_export_btn.setEnabled(self.watermark_thread.renderer.timer is not None)
+        self.progress_bar.setRange(0, 100)
         self.start_btn.setEnabled(True)
         self.stop_btn.setEnabled(False)
-        self.log_text.append("所有图片处理完成！")
+        if self.watermark_thread.stopped:
+            return
+        self.log_text.appendPlainText("所有图片处理完成！")
         QMessageBox.information(self, "完成", "所有图片处理完成！")
 
 def main():
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""命令行行为测试共用的输入文件夹和运行方式"""
+
+import os
+
+import pytest
+from PIL import Image
+
+from watermark import cli
+from watermark.cache import overlay_cache
+
+IMAGES = ('a/one.jpg', 'a/two.png', 'b/three.jpg', 'four.png')
+
+
+@pytest.fixture(autouse=True)
+def clear_overlay_cache():
+    yield
+    overlay_cache.clear()
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """输入文件夹（几张内容各不相同的小图片）和输出文件夹"""
+    src = tmp_path / 'in'
+    for seed, name in enumerate(IMAGES):
+        path = src / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        Image.new('RGB', (64, 48), (seed * 60, 100, 200 - seed * 40)).save(path)
+    return src, tmp_path / 'out'
+
+
+@pytest.fixture
+def run(capsys):
+    """运行命令行，返回 (退出码, 本次处理了的输入文件名)"""
+    def run(src, out, *extra):
+        code = cli.main([str(src), '-o', str(out), '-t', '版权所有', '--size', '12', '--space', '10',
+                         '--backend', 'thread', '-j', '2', '--no-stamp-cache', *extra])
+        lines = capsys.readouterr().out.splitlines()
+        processed = sorted(line.split(' ', 1)[1].split(' - ')[0]
+                           for line in lines if line.startswith('✓'))
+        return code, processed
+    return run
+
+
+def all_names():
+    return sorted(os.path.basename(name) for name in IMAGES)
+
+
+def outputs(out):
+    """输出文件夹中的图片（相对路径）"""
+    return sorted(os.path.relpath(os.path.join(root, name), out).replace(os.sep, '/')
+                  for root, _, names in os.walk(out) for name in names
+                  if not name.startswith('.watermark-'))
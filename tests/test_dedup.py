@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""按内容去重：相同的输入只处理一次，其余的输出硬链接到第一份"""
+
+import os
+import shutil
+
+import pytest
+
+from conftest import all_names
+
+
+@pytest.mark.parametrize('backend', ('thread', 'process'))
+def test_dedup_links_identical_inputs(run, tree, backend):
+    src, out = tree
+    shutil.copy(src / 'a/one.jpg', src / 'b/copy.jpg')
+    shutil.copy(src / 'a/one.jpg', src / 'copy2.jpg')
+    code, processed = run(src, out, '--dedup', '--backend', backend)
+    assert code == 0
+    assert processed == sorted(all_names() + ['copy.jpg', 'copy2.jpg'])
+
+    original = os.stat(out / 'a/one.jpg')
+    for name in ('b/copy.jpg', 'copy2.jpg'):
+        assert os.path.samefile(out / 'a/one.jpg', out / name)
+    assert original.st_nlink == 3
+    # 其它内容不同的文件各自处理
+    assert not os.path.samefile(out / 'a/one.jpg', out / 'b/three.jpg')
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""分块生成的水印层与整张画布旋转的可见部分逐像素一致"""
+
+import pytest
+from PIL import Image
+
+from watermark.layer import render_canvas_layer, render_visible_layer
+
+ANGLES = (0, 15, 30, 33.3, 45, 89, 90, 135, 180, 200, 270, 300, 359, -30)
+SIZES = ((3000, 2000), (777, 1333), (1024, 1024), (513, 97), (2, 3), (1, 1))
+
+
+@pytest.fixture(scope='module')
+def mark():
+    im = Image.new('RGBA', (57, 23), (200, 10, 10, 180))
+    for i in range(23):
+        im.putpixel((i, i), (0, 0, 255, 255))
+    return im
+
+
+def canvas_layer(mark, space, angle, size):
+    width, height = size
+    layer = render_canvas_layer(mark, space, angle, size)
+    c = layer.size[0]
+    left, top = -int((width - c) / 2), -int((height - c) / 2)
+    return layer.crop((left, top, left + width, top + height))
+
+
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('angle', ANGLES)
+def test_visible_layer_matches_canvas(mark, angle, size):
+    expected = canvas_layer(mark, 31, angle, size)
+    assert render_visible_layer(mark, 31, angle, size).tobytes() == expected.tobytes()
+
+
+@pytest.mark.parametrize('angle', (30, 200))
+@pytest.mark.parametrize('box', ((0, 0, 1500, 145), (0, 145, 1500, 290), (0, 700, 1500, 1024),
+                                 (300, 511, 1201, 513), (1499, 1023, 1500, 1024)))
+def test_visible_layer_box(mark, angle, box):
+    size = (1500, 1024)
+    expected = canvas_layer(mark, 0, angle, size).crop(box)
+    assert render_visible_layer(mark, 0, angle, size, box).tobytes() == expected.tobytes()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""增量处理：输入未变时跳过，输入、参数或输出有变化时重新处理"""
+
+import json
+import os
+import shutil
+
+from watermark.manifest import MANIFEST_NAME
+
+from conftest import IMAGES, all_names, outputs
+
+
+def test_unchanged_inputs_are_skipped(run, tree):
+    src, out = tree
+    assert run(src, out) == (0, all_names())
+    assert outputs(out) == sorted(IMAGES)
+    mtimes = {name: os.stat(out / name).st_mtime_ns for name in IMAGES}
+
+    assert run(src, out) == (0, [])
+    assert {name: os.stat(out / name).st_mtime_ns for name in IMAGES} == mtimes
+
+
+def test_touched_input_is_reprocessed(run, tree):
+    src, out = tree
+    run(src, out)
+    st = os.stat(src / 'a/one.jpg')
+    os.utime(src / 'a/one.jpg', ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert run(src, out) == (0, ['one.jpg'])
+    assert run(src, out) == (0, [])
+
+
+def test_touched_input_with_same_content_is_skipped_with_hash(run, tree):
+    src, out = tree
+    run(src, out, '--hash')
+    st = os.stat(src / 'a/one.jpg')
+    os.utime(src / 'a/one.jpg', ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert run(src, out, '--hash') == (0, [])
+
+
+def test_parameter_change_reprocesses_everything(run, tree):
+    src, out = tree
+    run(src, out)
+    assert run(src, out, '--opacity', '0.3') == (0, all_names())
+    assert run(src, out, '--opacity', '0.3') == (0, [])
+    assert run(src, out, '-f', '--opacity', '0.3') == (0, all_names())
+
+
+def test_missing_rendition_is_rebuilt(run, tree):
+    src, out = tree
+    renditions = ('--rendition', 'full', '--rendition', '32')
+    run(src, out, *renditions)
+    assert 'b/three_32.jpg' in outputs(out)
+    os.remove(out / 'b/three_32.jpg')
+    assert run(src, out, *renditions) == (0, ['three.jpg'])
+    assert 'b/three_32.jpg' in outputs(out)
+
+
+def test_manifest_sources_are_relative(run, tree):
+    src, out = tree
+    run(src, out)
+    with open(out / MANIFEST_NAME, encoding='utf-8') as fp:
+        sources = sorted(json.loads(line)['source'] for line in fp)
+    assert sources == sorted(IMAGES)
+
+    # 整体移动输入和输出后仍然有效
+    moved = src.parent / 'moved'
+    moved.mkdir()
+    shutil.move(str(src), str(moved / 'in'))
+    shutil.move(str(out), str(moved / 'out'))
+    assert run(moved / 'in', moved / 'out') == (0, [])
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""NumPy 与 Pillow 两种像素操作实现的结果逐像素一致"""
+
+import io
+import random
+
+import pytest
+from PIL import Image
+
+from watermark import ops
+from watermark.cache import overlay_cache
+from watermark.engine import WatermarkRenderer
+
+pytest.importorskip('numpy')
+
+MODES = ('RGB', 'RGBA', 'L', 'P')
+
+
+@pytest.fixture(autouse=True)
+def restore_backend():
+    yield
+    ops.use_numpy(True)
+    overlay_cache.clear()
+
+
+def random_image(mode, size, seed, border=0):
+    """随机像素的图片；border > 0 时四周留出完全透明的边，用于检验裁剪"""
+    rng = random.Random(seed)
+    width, height = size
+    im = Image.frombytes('RGBA', size, bytes(rng.randrange(256) for _ in range(width * height * 4)))
+    if border:
+        alpha = Image.new('L', size, 0)
+        box = (border, border, width - border, height - border)
+        alpha.paste(im.getchannel('A').crop(box), box)
+        im.putalpha(alpha)
+    if mode == 'P':
+        return im.convert('RGB').quantize(64)
+    return im.convert(mode)
+
+
+def both_backends(func, *args):
+    results = []
+    for enabled in (True, False):
+        ops.use_numpy(enabled)
+        assert ops.backend() == ('numpy' if enabled else 'pillow')
+        results.append(func(*args))
+    return results
+
+
+@pytest.mark.parametrize('mode', MODES)
+@pytest.mark.parametrize('opacity', (0.0, 0.15, 0.5, 0.999, 1.0))
+def test_set_opacity(mode, opacity):
+    for seed in range(20):
+        im = random_image(mode, (37, 23), seed)
+        fast, slow = both_backends(lambda: ops.set_opacity(im.copy(), opacity))
+        assert fast.mode == slow.mode == 'RGBA'
+        assert fast.tobytes() == slow.tobytes()
+
+
+@pytest.mark.parametrize('mode', MODES)
+@pytest.mark.parametrize('border', (0, 1, 7))
+def test_crop_image(mode, border):
+    for seed in range(20):
+        im = ops.set_opacity(random_image(mode, (41, 29), seed, border).convert('RGBA'), 0.8)
+        fast, slow = both_backends(lambda: ops.crop_image(im.copy()))
+        assert fast.size == slow.size
+        assert fast.tobytes() == slow.tobytes()
+
+
+def test_crop_image_transparent():
+    im = Image.new('RGBA', (16, 16))
+    fast, slow = both_backends(lambda: ops.crop_image(im.copy()))
+    assert fast.size == slow.size == (16, 16)
+
+
+def composite(renderer, data, ext):
+    overlay_cache.clear()
+    return Image.open(io.BytesIO(renderer.process_bytes(data, output_format=ext)))
+
+
+@pytest.mark.parametrize('stamp_mode', MODES)
+@pytest.mark.parametrize('mode', MODES)
+def test_composite_image_mark(tmp_path, stamp_mode, mode):
+    stamp_path = str(tmp_path / 'stamp.png')
+    random_image(stamp_mode, (30, 20), 1, border=2).save(stamp_path)
+    renderer = WatermarkRenderer('image', '', stamp_path, str(tmp_path), '#8B8B1B',
+                                 15, 30, '', '1.2', 50, 0.15, 80, 80, 40)
+    buf = io.BytesIO()
+    random_image(mode, (160, 120), 2).save(buf, format='PNG')
+    for ext in ('png', 'jpeg'):
+        fast, slow = both_backends(composite, renderer, buf.getvalue(), ext)
+        assert fast.mode == slow.mode
+        assert fast.tobytes() == slow.tobytes()
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_composite_text_mark(tmp_path, mode):
+    renderer = WatermarkRenderer('text', '版权所有 ©', None, str(tmp_path), '#8B8B1B',
+                                 20, 30, '', '1.2', 24, 0.4, 80, 100, 50)
+    buf = io.BytesIO()
+    random_image(mode, (200, 150), 3).save(buf, format='PNG')
+    fast, slow = both_backends(composite, renderer, buf.getvalue(), 'png')
+    assert fast.tobytes() == slow.tobytes()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""分片处理：合并时核对完整性，处理记录按相对路径合并"""
+
+import json
+import os
+
+import pytest
+
+from watermark.manifest import MANIFEST_NAME
+from watermark.shard import parse_shard
+
+from conftest import IMAGES, all_names
+
+
+def test_merge_rejects_incomplete_shards(run, tree):
+    src, out = tree
+    assert run(src, out, '--shard', '1/2')[0] == 0
+    assert run(src, out, '--merge-shards')[0] == 1
+
+    assert run(src, out, '--shard', '2/2')[0] == 0
+    assert run(src, out, '--merge-shards')[0] == 0
+
+    # 删除一个输出后合并不再完整
+    os.remove(out / 'four.png')
+    assert run(src, out, '--merge-shards')[0] == 1
+
+
+def test_merge_keys_on_relative_paths(run, tree, tmp_path):
+    src, out = tree
+    # 两个节点把同一个共享目录挂载在不同的路径
+    mount = tmp_path / 'mnt'
+    mount.mkdir()
+    os.symlink(src, mount / 'in')
+    processed = run(src, out, '--shard', '1/2')[1]
+    processed += run(mount / 'in', out, '--shard', '2/2')[1]
+    assert sorted(processed) == all_names()
+    assert run(src, out, '--merge-shards')[0] == 0
+
+    with open(out / MANIFEST_NAME, encoding='utf-8') as fp:
+        sources = sorted(json.loads(line)['source'] for line in fp)
+    assert sources == sorted(IMAGES)
+    # 合并后的处理记录供不分片的增量处理使用
+    assert run(mount / 'in', out) == (0, [])
+
+
+@pytest.mark.parametrize('spec', ('1/0', '0/2', '3/2', '1', 'a/b'))
+def test_parse_shard_rejects_invalid(spec):
+    with pytest.raises(ValueError):
+        parse_shard(spec)
+
+
+def test_parse_shard_count_message():
+    with pytest.raises(ValueError, match='分片数'):
+        parse_shard('1/0')
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""超大图片分带流式处理的输出与整张图片处理一致"""
+
+import random
+
+import pytest
+from PIL import Image
+
+from watermark.cache import overlay_cache
+from watermark.engine import WatermarkRenderer
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    yield
+    overlay_cache.clear()
+
+
+def make_renderer(output_dir, render_mode, stream_mp):
+    return WatermarkRenderer('text', '版权所有', None, str(output_dir), '#8B8B1B',
+                             20, 30, '', '1.2', 24, 0.4, 80, 100, 50, render_mode=render_mode,
+                             stream_mp=stream_mp, stream_memory_mb=1)
+
+
+def noise_image(mode, size, seed=0):
+    data = random.Random(seed).randbytes(size[0] * size[1] * 3)
+    return Image.frombytes('RGB', size, data).convert(mode)
+
+
+def process(renderer, path):
+    """处理一张图片，返回 (日志信息, 输出的模式, 输出的像素)"""
+    ok, message = renderer.process_image(path, renderer.build_mark())
+    assert ok, message
+    with Image.open(renderer.output_path(path)) as im:
+        return message, im.mode, im.tobytes()
+
+
+@pytest.mark.parametrize('render_mode', ('visible', 'canvas'))
+@pytest.mark.parametrize('ext', ('.png', '.tif'))
+def test_stream_matches_full(tmp_path, render_mode, ext):
+    path = str(tmp_path / f'big{ext}')
+    # 1 MB 预算下每个条带只有十几行
+    noise_image('RGB', (3000, 400)).save(path)
+    message, mode, data = process(make_renderer(tmp_path / 'stream', render_mode, 1), path)
+    assert message.endswith('（流式处理）')
+    overlay_cache.clear()
+    expected = process(make_renderer(tmp_path / 'full', render_mode, 0), path)
+    assert not expected[0].endswith('（流式处理）')
+    assert (mode, data) == expected[1:]
+
+
+def test_multipage_tiff_is_not_streamed(tmp_path):
+    path = str(tmp_path / 'pages.tif')
+    pages = [noise_image('RGB', (3000, 400), seed) for seed in range(3)]
+    pages[0].save(path, save_all=True, append_images=pages[1:])
+    renderer = make_renderer(tmp_path / 'out', 'visible', 1)
+    assert not renderer.can_stream(path)
+    ok, message = renderer.process_image(path, renderer.build_mark())
+    assert ok, message
+    assert not message.endswith('（流式处理）')
+    with Image.open(renderer.output_path(path)) as im:
+        assert im.n_frames == 3
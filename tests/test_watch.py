@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""监视文件夹：工作者预先全部启动；处理中被改写的文件在处理完成后再处理一次，排队中的不重复处理"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import time
+
+import pytest
+from PIL import Image
+
+from watermark.batch import _init_process_worker, _init_worker, warm_pool, worker_barrier
+from watermark.engine import WatermarkRenderer
+from watermark.manifest import Manifest
+from watermark.watch import WatchDaemon
+
+
+class ScriptedWatcher:
+    """每次轮询调用脚本中的下一个函数（最后一个重复调用），返回其报告的写入完成的文件 [(路径, 修改时间)]"""
+
+    mode = '测试'
+    waiting = 0
+
+    def __init__(self, root):
+        self.root = root
+        self.script = []
+
+    def start(self):
+        pass
+
+    def poll(self, timeout):
+        return (self.script.pop(0) if len(self.script) > 1 else self.script[0])()
+
+    def close(self):
+        pass
+
+
+class BlockingRenderer(WatermarkRenderer):
+    """记录每次处理；release 之前停在处理中"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+        self.overlapped = False
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self._active = set()
+
+    def safe_process_image(self, imagePath, mark):
+        self.calls.append(imagePath)
+        self.overlapped |= imagePath in self._active
+        self._active.add(imagePath)
+        self.started.set()
+        self.release.wait(10)
+        try:
+            return super().safe_process_image(imagePath, mark)
+        finally:
+            self._active.discard(imagePath)
+
+
+def make_daemon(tmp_path, workers=1):
+    (tmp_path / 'in').mkdir()
+    renderer = BlockingRenderer('text', '版权所有', None, str(tmp_path / 'out'), '#8B8B1B',
+                                10, 30, '', '1.2', 12, 0.4, 80, 100, 50,
+                                input_dir=str(tmp_path / 'in'))
+    manifest = Manifest(renderer.output_dir, renderer.params_hash(), input_dir=renderer.input_dir)
+    return WatchDaemon(renderer, ScriptedWatcher(renderer.input_dir), manifest, workers=workers,
+                       backend='thread', log=lambda message: None)
+
+
+def write(path, color, mtime):
+    Image.new('RGB', (32, 24), color).save(path)
+    os.utime(path, (mtime, mtime))
+    return [(path, os.stat(path).st_mtime)]
+
+
+def run_until(daemon, script, processed):
+    """依次执行脚本，之后等到处理完 processed 张（最多 10 秒）再停止"""
+    deadline = time.monotonic() + 10
+
+    def wait():
+        if ((daemon.processed >= processed and not daemon.running and not daemon.queued)
+                or time.monotonic() > deadline):
+            daemon.stop()
+        time.sleep(0.01)
+        return []
+    daemon.watcher.script = list(script) + [wait]
+    daemon.run()
+
+
+def test_modified_while_processing_is_reprocessed(tmp_path):
+    daemon = make_daemon(tmp_path, workers=2)
+    renderer = daemon.renderer
+    path = os.path.join(renderer.input_dir, 'a.png')
+
+    def rewrite():
+        # 第一次处理已经开始，又写入了新的内容
+        renderer.started.wait(10)
+        reported = write(path, (0, 0, 255), 2000000000)
+        renderer.release.set()
+        return reported
+
+    first = write(path, (255, 0, 0), 1900000000)
+    run_until(daemon, [lambda: first, rewrite], 2)
+    # 第二次处理在第一次完成后才开始，两个工作者不会同时写同一个输出
+    assert renderer.calls == [path, path]
+    assert not renderer.overlapped
+    with Image.open(renderer.output_path(path)) as im:
+        red, _, blue = im.convert('RGB').getpixel((0, 0))
+    assert blue > red
+    assert daemon.manifest.outputs_current(path, renderer.output_paths(path))
+
+
+def test_reported_again_while_queued_is_processed_once(tmp_path):
+    daemon = make_daemon(tmp_path)
+    renderer = daemon.renderer
+    paths = [os.path.join(renderer.input_dir, name) for name in ('a.png', 'b.png', 'c.png')]
+    reports = [write(path, (255, 0, 0), 1900000000)[0] for path in paths]
+
+    def report_again():
+        # 一个工作者最多同时提交两个任务，第三个还在排队
+        renderer.started.wait(10)
+        assert [job[0] for job in daemon.queued] == paths[2:]
+        renderer.release.set()
+        return reports[2:]
+
+    run_until(daemon, [lambda: reports, report_again], 3)
+    assert sorted(renderer.calls) == paths
+
+
+class SlowStartRenderer(WatermarkRenderer):
+    """各工作者生成水印的快慢不同，记录已完成初始化的工作者"""
+
+    initialized = []
+
+    def build_mark(self):
+        time.sleep(0.05 * int(threading.current_thread().name.rsplit('_', 1)[1]))
+        mark = super().build_mark()
+        self.initialized.append(threading.current_thread().name)
+        return mark
+
+
+def test_warm_pool_initializes_every_worker(tmp_path):
+    renderer = SlowStartRenderer('text', '版权所有', None, str(tmp_path), '#8B8B1B',
+                                 10, 30, '', '1.2', 12, 0.4, 80, 100, 50)
+    ready = worker_barrier('thread', 4)
+    with ThreadPoolExecutor(4, initializer=_init_worker, initargs=(renderer, ready)) as pool:
+        warm_pool(pool, 4, ready)
+        # 初始化最快的工作者不能替其它工作者把预热任务都接走
+        assert len(renderer.initialized) == 4
+
+
+def test_warm_process_pool(tmp_path):
+    renderer = WatermarkRenderer('text', '版权所有', None, str(tmp_path), '#8B8B1B',
+                                 10, 30, '', '1.2', 12, 0.4, 80, 100, 50)
+    ready = worker_barrier('process', 3)
+    with ProcessPoolExecutor(3, initializer=_init_process_worker, initargs=(renderer, ready)) as pool:
+        warm_pool(pool, 3, ready)
+        assert len(pool._processes) == 3
+
+
+class BrokenRenderer(WatermarkRenderer):
+    def build_mark(self):
+        if threading.current_thread().name.endswith('_1'):
+            raise RuntimeError('字体加载失败')
+        return super().build_mark()
+
+
+def test_warm_pool_reports_failed_worker(tmp_path):
+    renderer = BrokenRenderer('text', '版权所有', None, str(tmp_path), '#8B8B1B',
+                              10, 30, '', '1.2', 12, 0.4, 80, 100, 50)
+    ready = worker_barrier('thread', 3)
+    with ThreadPoolExecutor(3, initializer=_init_worker, initargs=(renderer, ready)) as pool:
+        # 其余工作者不会一直在屏障处等待
+        with pytest.raises(Exception):
+            warm_pool(pool, 3, ready)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""图片水印引擎，可脱离图形界面单独使用
+
+    from watermark import WatermarkRenderer, BatchExecutor, list_images
+
+    renderer = WatermarkRenderer('text', '版权所有', None, './output', '#8B8B1B',
+                                 75, 30, '', '1.2', 50, 0.15, 80, 100, 50)
+    for path, ok, message in BatchExecutor(renderer, workers=4).run(list_images('./input')):
+        print(message)
+"""
+
+from .cache import OverlayCache, overlay_cache
+from .engine import WatermarkRenderer
+from .batch import BatchExecutor
+from .scan import IMAGE_EXTENSIONS, BackgroundScanner, list_images, scan_images
+from .manifest import Manifest, skip_current
+from .rendition import Rendition, parse_renditions
+
+__all__ = [
+    'OverlayCache',
+    'overlay_cache',
+    'WatermarkRenderer',
+    'BatchExecutor',
+    'IMAGE_EXTENSIONS',
+    'BackgroundScanner',
+    'list_images',
+    'scan_images',
+    'Manifest',
+    'skip_current',
+    'Rendition',
+    'parse_renditions',
+]
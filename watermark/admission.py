@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""按内存预算准入任务
+
+解码后的图片加上合成时的水印层和模式转换，峰值内存可达压缩文件的十倍以上，几张大图同时处理就可能
+被系统杀掉。这里只读文件头（不解码）估计每张图片的峰值内存，已准入任务的估计值之和不超过预算时
+才开始新任务：排在前面的大图放不下时，向后查看的窗口中放得下的小图先处理；没有任务在运行时
+无论多大都单独准入，每张图片都能得到处理。
+"""
+
+import math
+import threading
+from collections import deque
+from PIL import Image
+
+from .animation import frame_count
+from .archive import open_source
+
+MB = 1024 * 1024
+
+
+def pixel_bytes(mode):
+    """Pillow 内部每个像素占用的字节数（RGB 等三通道模式也按 4 字节存储）"""
+    if mode in ('1', 'L', 'P'):
+        return 1
+    if mode.startswith('I;16'):
+        return 2
+    return 4
+
+
+def estimate_peak_bytes(renderer, path):
+    """不解码，按文件头中的尺寸、模式和帧数估计处理一张图片的峰值内存（字节）"""
+    try:
+        with Image.open(open_source(path)) as im:
+            width, height = im.size
+            mode = im.mode
+            frames = frame_count(im)
+            fmt = im.format
+    except Exception:
+        # 读不出文件头的文件很快就会失败，不占预算
+        return 0
+
+    pixels = width * height
+    if (fmt in ('PNG', 'TIFF') and renderer.can_stream(path)
+            and pixels >= renderer.stream_mp * 1000000):
+        # 分带流式处理：读取和写入各一个条带，canvas 模式下还有整张对角线画布
+        peak = renderer.stream_memory_mb * MB * 2
+        if renderer.render_mode == 'canvas':
+            c = int(math.sqrt(width * width + height * height))
+            peak += c * c * 4
+        return peak
+
+    decoded = pixels * pixel_bytes(mode)
+    converted = pixels * 4  # 转换为 RGB/RGBA 后合成
+    if renderer.render_mode == 'canvas':
+        # 对角线画布及旋转后的副本，再加蒙版
+        c = int(math.sqrt(width * width + height * height))
+        layer = c * c * 9
+    else:
+        layer = pixels * 5  # 水印层和蒙版
+    # 多帧图片的所有帧合成后一起保存
+    return decoded + layer + converted * frames
+
+
+class AdmissionScheduler:
+    """全局内存预算下的任务准入，可在多个线程中释放"""
+
+    def __init__(self, renderer, budget_mb, lookahead=16):
+        self.renderer = renderer
+        self.budget = budget_mb * MB
+        self.lookahead = max(1, lookahead)
+        self.used = 0
+        self.running = 0
+        self.peak = 0
+        self.admitted = 0
+        self.oversized = 0  # 估计值超过预算、单独处理的图片
+        self.overtaken = 0  # 被后面的小图先行处理的次数
+        self.waits = 0  # 因内存不足而等待的次数
+        self._stopped = False
+        self._cond = threading.Condition()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def release(self, cost):
+        """一个任务结束，归还其占用的预算"""
+        with self._cond:
+            self.used -= cost
+            self.running -= 1
+            self._cond.notify_all()
+
+    def admit(self, file_paths):
+        """依次产出可以开始的 (序号, 路径, 估计内存)，内存不足时阻塞；任务结束后需调用 release"""
+        paths = enumerate(file_paths)
+        waiting = deque()
+        exhausted = False
+        head = None  # 队首任务，以及它已被后面的任务超过的次数
+        skipped = 0
+        while True:
+            while not exhausted and len(waiting) < self.lookahead:
+                item = next(paths, None)
+                if item is None:
+                    exhausted = True
+                    break
+                seq, path = item
+                waiting.append((seq, path, estimate_peak_bytes(self.renderer, path)))
+            if not waiting:
+                return
+
+            if waiting[0][0] != head:
+                head, skipped = waiting[0][0], 0
+            with self._cond:
+                job = self._pick(waiting, skipped)
+                while job is None and not self._stopped:
+                    self.waits += 1
+                    self._cond.wait()
+                    job = self._pick(waiting, skipped)
+                if self._stopped:
+                    return
+                seq, path, cost = job
+                self.used += cost
+                self.running += 1
+                self.admitted += 1
+                self.peak = max(self.peak, self.used)
+                if job is not waiting[0]:
+                    skipped += 1
+                    self.overtaken += 1
+                elif cost > self.budget:
+                    self.oversized += 1
+            waiting.remove(job)
+            yield job
+
+    def _pick(self, waiting, skipped):
+        free = self.budget - self.used
+        if waiting[0][2] <= free or not self.running:
+            return waiting[0]
+        # 队首放不下：让窗口中放得下的小图先处理，但次数有限，保证队首最终能等到预算
+        if skipped < self.lookahead:
+            for job in waiting:
+                if job[2] <= free:
+                    return job
+        return None
+
+    def report(self):
+        return (f"内存预算: 估计峰值 {self.peak / MB:.0f}MB / {self.budget / MB:.0f}MB, "
+                f"小图先行 {self.overtaken} 次, 等待内存 {self.waits} 次, "
+                f"超出预算单独处理 {self.oversized} 张")
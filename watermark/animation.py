@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""多帧图片（动画 GIF/PNG/WebP、多页 TIFF）"""
+
+from PIL import Image
+
+# 支持多帧保存的格式
+ANIMATION_FORMATS = ('GIF', 'PNG', 'WEBP', 'AVIF', 'TIFF')
+# 有帧时长和循环次数的格式
+TIMED_FORMATS = ('GIF', 'PNG', 'WEBP', 'AVIF')
+
+PALETTE_SAMPLE_FRAMES = 8
+PALETTE_SAMPLE_SIZE = (128, 128)
+
+
+def frame_count(im):
+    return getattr(im, 'n_frames', 1)
+
+
+def animation_options(fmt, durations, disposals, loop):
+    """多帧保存时的帧时长、处理方式和循环次数参数"""
+    options = {}
+    if fmt in TIMED_FORMATS:
+        options['duration'] = durations
+        if loop is not None:
+            options['loop'] = loop
+    if fmt == 'GIF':
+        options['disposal'] = disposals
+    return options
+
+
+def quantize_frames(frames, colors=256):
+    """所有帧共用一个调色板量化，避免保存 GIF 时逐帧计算调色板
+
+    调色板取自均匀抽样的若干帧缩略图拼成的样图；不抖动，避免相邻帧之间出现闪烁的噪点。
+    """
+    count = min(len(frames), PALETTE_SAMPLE_FRAMES)
+    samples = []
+    for index in range(count):
+        sample = frames[index * (len(frames) - 1) // max(1, count - 1)].convert('RGB')
+        sample.thumbnail(PALETTE_SAMPLE_SIZE)
+        samples.append(sample)
+    mosaic = Image.new('RGB', (max(s.width for s in samples), sum(s.height for s in samples)))
+    y = 0
+    for sample in samples:
+        mosaic.paste(sample, (0, y))
+        y += sample.height
+    palette = mosaic.quantize(colors)
+    return [frame.convert('RGB').quantize(palette=palette, dither=Image.Dither.NONE)
+            for frame in frames]
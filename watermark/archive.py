@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""直接读写 ZIP/TAR 压缩包，不解压到磁盘
+
+输入压缩包中的图片按顺序读出，数据随任务交给工作者直接解码；输出压缩包由主线程按输入顺序
+逐个写入，工作者把编码结果留在内存中交回。同时在内存中的图片数量由执行器的任务窗口限制。
+输出内容与处理文件夹时逐字节相同，只是保存位置不同。
+"""
+
+import io
+import os
+import time
+import hashlib
+import tarfile
+import zipfile
+import threading
+
+from .scan import IMAGE_EXTENSIONS, _match
+from .output import temp_path
+from .manifest import file_digest
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+_TAR_WRITE_MODES = {'.gz': 'w:gz', '.tgz': 'w:gz', '.bz2': 'w:bz2', '.tbz2': 'w:bz2',
+                    '.xz': 'w:xz', '.txz': 'w:xz'}
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+class Member(str):
+    """压缩包中的一张图片，字符串值为 压缩包路径/成员名，数据随任务一起传给工作者"""
+
+    def __new__(cls, path, data):
+        member = super().__new__(cls, path)
+        member.data = data
+        return member
+
+    def __reduce__(self):
+        return Member, (str(self), self.data)
+
+
+def content_size(path):
+    return len(path.data) if isinstance(path, Member) else os.path.getsize(path)
+
+
+def content_digest(path):
+    if isinstance(path, Member):
+        return hashlib.sha256(path.data).hexdigest()
+    return file_digest(path)
+
+
+def open_source(path):
+    """Image.open 可以使用的输入：压缩包成员为内存中的文件对象"""
+    return io.BytesIO(path.data) if isinstance(path, Member) else path
+
+
+def _wanted(name, include, exclude):
+    if not name.lower().endswith(IMAGE_EXTENSIONS):
+        return False
+    # macOS 压缩时附带的资源文件
+    if name.startswith('__MACOSX/'):
+        return False
+    if exclude:
+        parts = name.split('/')
+        # 与扫描文件夹时一样，匹配到的文件夹中的文件都跳过
+        for i in range(1, len(parts) + 1):
+            if _match('/'.join(parts[:i]), exclude):
+                return False
+    return not include or _match(name, include)
+
+
+def scan_archive(archive_path, include=None, exclude=None):
+    """按压缩包中的顺序逐个产出图片成员（Member），TAR 以流方式读取，不需要随机访问"""
+    if archive_path.lower().endswith('.zip'):
+        with zipfile.ZipFile(archive_path) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and _wanted(info.filename, include, exclude):
+                    yield Member(os.path.join(archive_path, info.filename), zf.read(info))
+        return
+    with tarfile.open(archive_path, 'r|*') as tar:
+        for info in tar:
+            if info.isfile() and _wanted(info.name, include, exclude):
+                yield Member(os.path.join(archive_path, info.name), tar.extractfile(info).read())
+
+
+class OutputCapture:
+    """输出到压缩包时收集编码结果：输入路径 -> [(输出路径, 数据)]"""
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'_items': {}}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add(self, source, output, data):
+        with self._lock:
+            self._items.setdefault(source, []).append((output, data))
+
+    def pop(self, source):
+        with self._lock:
+            return self._items.pop(source, [])
+
+    def merge(self, source, items):
+        """合并工作进程交回的结果"""
+        with self._lock:
+            self._items.setdefault(source, []).extend(items)
+
+
+class ArchiveWriter:
+    """把输出依次写入 ZIP/TAR 压缩包；先写临时文件，close(True) 时才重命名为目标文件"""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._tmp = temp_path(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        lower = path.lower()
+        if lower.endswith('.zip'):
+            # 图片本身已经压缩，不再压缩一遍
+            self._zip = zipfile.ZipFile(self._tmp, 'w', zipfile.ZIP_STORED)
+            self._tar = None
+        else:
+            mode = _TAR_WRITE_MODES.get(os.path.splitext(lower)[1], 'w')
+            self._tar = tarfile.open(self._tmp, mode)
+            self._zip = None
+
+    def write(self, name, data):
+        name = name.replace(os.sep, '/')
+        if self._zip is not None:
+            self._zip.writestr(zipfile.ZipInfo(name, time.localtime()[:6]), data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self._tar.addfile(info, io.BytesIO(data))
+        self.count += 1
+
+    def close(self, keep=True):
+        (self._zip or self._tar).close()
+        if keep:
+            os.replace(self._tmp, self.path)
+        elif os.path.exists(self._tmp):
+            os.remove(self._tmp)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""批量处理执行器"""
+
+import os
+import signal
+import threading
+import multiprocessing
+from functools import partial
+from concurrent.futures import (FIRST_COMPLETED, FIRST_EXCEPTION, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+
+from .cache import overlay_cache
+from .pipeline import StagedPipeline
+from .admission import AdmissionScheduler
+
+
+# 工作者（线程或进程）各自持有的渲染器和水印生成函数
+_worker_state = threading.local()
+
+
+def _init_worker(renderer, ready=None):
+    overlay_cache.resize(renderer.cache_bytes)
+    _worker_state.renderer = renderer
+    _worker_state.mark = renderer.build_mark()
+    _worker_state.ready = ready
+
+
+def _init_process_worker(renderer, ready=None):
+    # Ctrl+C 发给整个进程组；由主进程取消剩余任务并关闭进程池，工作进程不各自抛出 KeyboardInterrupt
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _init_worker(renderer, ready)
+
+
+def _wait_ready():
+    # 预热任务：等到每个工作者都接到一个才返回，同一个工作者不会接两个
+    _worker_state.ready.wait()
+    return os.getpid()
+
+
+def worker_barrier(backend, workers):
+    """预热用的屏障，通过 initargs 交给工作者"""
+    if backend == 'process':
+        return multiprocessing.get_context().Barrier(workers)
+    return threading.Barrier(workers)
+
+
+def warm_pool(pool, workers, ready, task=_wait_ready):
+    """启动全部工作者并等它们初始化（生成水印）完成，第一个任务不必等待
+
+    预热任务在屏障处互相等待，全部工作者都接到一个之前没有空闲的工作者，每个任务只能由新的工作者接手。
+    """
+    futures = [pool.submit(task) for _ in range(workers)]
+    try:
+        # 有工作者初始化失败时其余的会一直在屏障处等待，看到第一个失败就结束
+        wait(futures, return_when=FIRST_EXCEPTION)
+        for future in futures:
+            if future.done():
+                future.result()
+    finally:
+        # 放开还在等待的工作者；全部成功时屏障已经用完
+        ready.abort()
+
+
+def _process_in_worker(image_path):
+    renderer = _worker_state.renderer
+    result = renderer.safe_process_image(image_path, _worker_state.mark)
+    # 工作进程中的耗时记录和输出到压缩包的数据随结果交回主进程
+    timings = renderer.timer.pop(image_path) if renderer.timer is not None else None
+    outputs = renderer.capture.pop(image_path) if renderer.capture is not None else None
+    return result, timings, outputs
+
+
+class BatchExecutor:
+    """按输入顺序返回结果的批处理执行器，支持线程池、进程池和分阶段流水线"""
+
+    BACKENDS = ('serial', 'thread', 'process', 'pipeline')
+
+    def __init__(self, renderer, workers=1, backend='thread', read_workers=2, write_workers=2,
+                 queue_depth=4, memory_budget_mb=0):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"未知的执行方式: {backend}")
+        self.renderer = renderer
+        self.workers = max(1, workers)
+        self.backend = 'serial' if self.workers == 1 and backend != 'pipeline' else backend
+        # 流水线: workers 为合成线程数，读取和写入阶段单独设置
+        self.read_workers = read_workers
+        self.write_workers = write_workers
+        self.queue_depth = queue_depth
+        self.pipeline = None
+        # 串行处理时同时只有一张图片，不需要内存预算
+        self.admission = None
+        if memory_budget_mb and self.backend != 'serial':
+            self.admission = AdmissionScheduler(renderer, memory_budget_mb,
+                                                lookahead=self.workers * 4)
+        self._is_running = True
+
+    def stop(self):
+        self._is_running = False
+        if self.admission:
+            self.admission.stop()
+        if self.pipeline:
+            self.pipeline.stop()
+
+    def stage_report(self):
+        """流水线各阶段的利用率，其它执行方式返回 None"""
+        if self.pipeline and self.pipeline.stages:
+            return self.pipeline.report()
+        return None
+
+    def admission_report(self):
+        """内存预算准入的统计，未设置预算时返回 None"""
+        if self.admission and self.admission.admitted:
+            return self.admission.report()
+        return None
+
+    def run(self, file_paths, mark=None):
+        """依次产出 (图片路径, 是否成功, 日志信息)，顺序与输入一致"""
+        if self.backend == 'serial':
+            if mark is None:
+                mark = self.renderer.build_mark()
+            for image_path in file_paths:
+                if not self._is_running:
+                    break
+                yield (image_path,) + self.renderer.safe_process_image(image_path, mark)
+            return
+
+        if self.backend == 'pipeline':
+            if mark is None:
+                mark = self.renderer.build_mark()
+            self.pipeline = StagedPipeline(self.renderer, mark, self.read_workers, self.workers,
+                                           self.write_workers, self.queue_depth, self.admission)
+            if not self._is_running:
+                self.pipeline.stop()
+            yield from self.pipeline.run(file_paths)
+            return
+
+        if self.backend == 'process':
+            pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_process_worker,
+                                       initargs=(self.renderer,))
+        else:
+            pool = ThreadPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                      initargs=(self.renderer,))
+
+        # 只保留有限数量的待处理任务，停止时可以很快取消剩余任务
+        if self.admission:
+            jobs = self.admission.admit(file_paths)
+        else:
+            jobs = ((seq, path, 0) for seq, path in enumerate(file_paths))
+        running = {}  # future -> (序号, 路径)
+        done = {}  # 按内存预算准入时后面的图片可能先完成，等待前面的图片
+        next_seq = 0
+        window = self.workers * 2
+        try:
+            while self._is_running:
+                while self._is_running and len(running) < window:
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+                    seq, image_path, cost = job
+                    future = pool.submit(_process_in_worker, image_path)
+                    if self.admission:
+                        future.add_done_callback(partial(self._release, cost))
+                    running[future] = (seq, image_path)
+                if not running or not self._is_running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    seq, image_path = running.pop(future)
+                    result, timings, outputs = future.result()
+                    if timings:
+                        self.renderer.timer.merge(image_path, timings)
+                    if outputs:
+                        self.renderer.capture.merge(image_path, outputs)
+                    done[seq] = (image_path, result)
+                while next_seq in done:
+                    image_path, result = done.pop(next_seq)
+                    next_seq += 1
+                    yield (image_path,) + result
+        finally:
+            for future in running:
+                future.cancel()
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _release(self, cost, future):
+        self.admission.release(cost)
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""性能基准: python -m watermark.bench
+
+用固定随机种子生成测试图片（JPEG、PNG、RGBA、调色板、带 EXIF 旋转），在 space/angle/size、编码档位和
+输出格式的参数组合上分别测量文字水印和图片水印，输出 JSON：每秒处理张数、单张耗时分位数、编码耗时、
+输出文件大小和峰值内存。
+每个测试用例在独立的子进程中运行，峰值 RSS 互不影响。
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import platform
+import itertools
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import PIL
+from PIL import Image, ImageDraw
+
+from . import ops
+from .cache import overlay_cache
+from .engine import WatermarkRenderer
+from .encode import PROFILES
+from .timing import StageTimer, percentile
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+KINDS = {
+    # 名称: (扩展名, 模式, EXIF 方向)
+    'jpeg': ('.jpg', 'RGB', 1),
+    'png': ('.png', 'RGB', 1),
+    'rgba': ('.png', 'RGBA', 1),
+    'palette': ('.png', 'P', 1),
+    'exif': ('.jpg', 'RGB', 6),
+}
+
+
+def peak_rss_mb():
+    """当前进程的峰值内存 MB，不支持的平台返回 None"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 单位是字节，Linux 是 KB
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+
+def image_size(mp):
+    width = round(math.sqrt(mp * 1000000 * 4 / 3))
+    return width, round(width * 3 / 4)
+
+
+def synth_image(size, mode, seed):
+    """确定性的测试图片：渐变背景加随机色块，避免纯色图片的编码过于理想"""
+    rng = random.Random(seed)
+    width, height = size
+    bands = [Image.linear_gradient('L').resize(size),
+             Image.linear_gradient('L').rotate(90).resize(size),
+             Image.radial_gradient('L').resize(size)]
+    im = Image.merge('RGB', bands)
+    draw = ImageDraw.Draw(im)
+    for _ in range(48):
+        x, y = rng.randrange(width), rng.randrange(height)
+        w, h = rng.randrange(1, width // 4 + 2), rng.randrange(1, height // 4 + 2)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.rectangle((x, y, x + w, y + h), fill=color)
+        else:
+            draw.ellipse((x, y, x + w, y + h), fill=color)
+    del draw
+    if mode == 'RGBA':
+        alpha = Image.linear_gradient('L').rotate(45).resize(size).point(lambda v: 64 + v * 3 // 4)
+        im.putalpha(alpha)
+    elif mode == 'P':
+        im = im.quantize(64)
+    return im
+
+
+def make_inputs(data_dir, kinds, sizes, seed=0):
+    """生成（或复用已生成的）测试图片，返回 [(名称, 百万像素, 路径)]"""
+    os.makedirs(data_dir, exist_ok=True)
+    inputs = []
+    for mp in sizes:
+        for kind in kinds:
+            ext, mode, orientation = KINDS[kind]
+            path = os.path.join(data_dir, f"{kind}-{mp:g}mp-{seed}{ext}")
+            if not os.path.exists(path):
+                size = image_size(mp)
+                if orientation in (5, 6, 7, 8):
+                    size = size[::-1]
+                im = synth_image(size, mode, seed)
+                tmp = path + '.tmp' + ext
+                if orientation != 1:
+                    exif = Image.Exif()
+                    exif[0x0112] = orientation
+                    im.save(tmp, quality=90, exif=exif)
+                elif ext == '.jpg':
+                    im.save(tmp, quality=90)
+                else:
+                    im.save(tmp)
+                os.replace(tmp, path)
+            inputs.append((kind, mp, path))
+    return inputs
+
+
+def make_logo(data_dir, seed=0):
+    path = os.path.join(data_dir, f"logo-{seed}.png")
+    if not os.path.exists(path):
+        im = synth_image((240, 80), 'RGBA', seed + 1)
+        im.save(path)
+    return path
+
+
+def run_case(case):
+    """在子进程中运行一个测试用例"""
+    ops.use_numpy(case['numpy'])
+    overlay_cache.clear()
+    renderer = WatermarkRenderer(case['mark_type'], '版权所有 Copyright', case['logo'],
+                                 case['output_dir'], '#8B8B1B', case['space'], case['angle'],
+                                 case['font'], '1.2', case['size'], 0.15, 80,
+                                 case['size'] * 2, 50, profile=case['profile'],
+                                 output_format=case['output_format'], timer=StageTimer())
+
+    start = time.perf_counter()
+    mark = renderer.build_mark()
+    mark_ms = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    errors = 0
+    for _ in range(case['repeat']):
+        start = time.perf_counter()
+        ok, message = renderer.safe_process_image(case['path'], mark)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if not ok:
+            errors += 1
+
+    total = sum(latencies) / 1000
+    encode = renderer.timer.totals().get('save', {})
+    output = renderer.output_path(case['path'])
+    return {
+        'kind': case['kind'],
+        'mp': case['mp'],
+        'mark_type': case['mark_type'],
+        'space': case['space'],
+        'angle': case['angle'],
+        'size': case['size'],
+        'profile': case['profile'],
+        'output_format': case['output_format'] or 'keep',
+        'images': len(latencies),
+        'errors': errors,
+        'images_per_s': len(latencies) / total if total else None,
+        'mark_ms': mark_ms,
+        'encode_ms': encode.get('avg_ms'),
+        'output_bytes': os.path.getsize(output) if os.path.exists(output) else None,
+        'latency_ms': {
+            'first': latencies[0],
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies),
+        },
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def case_key(result):
+    key = '/'.join(str(result[k]) for k in ('kind', 'mp', 'mark_type', 'space', 'angle', 'size'))
+    # 早期的结果没有编码档位和输出格式，视为默认值
+    return f"{key}/{result.get('profile', 'balanced')}/{result.get('output_format', 'keep')}"
+
+
+def compare(results, baseline, threshold):
+    """与基线逐项比较，返回 (比较结果列表, 是否有退化)"""
+    base = {case_key(r): r for r in baseline['results']}
+    rows = []
+    regressed = False
+    for result in results:
+        old = base.get(case_key(result))
+        if old is None or not old['images_per_s'] or not result['images_per_s']:
+            continue
+        speed = result['images_per_s'] / old['images_per_s']
+        p50 = result['latency_ms']['p50'] / old['latency_ms']['p50']
+        rss = None
+        if result['peak_rss_mb'] and old['peak_rss_mb']:
+            rss = result['peak_rss_mb'] / old['peak_rss_mb']
+        slower = speed < 1 - threshold or (rss is not None and rss > 1 + threshold)
+        regressed = regressed or slower
+        rows.append({'case': case_key(result), 'speed_ratio': speed, 'p50_ratio': p50,
+                     'rss_ratio': rss, 'regression': slower})
+    return rows, regressed
+
+
+def parse_list(text, cast):
+    return [cast(v) for v in text.split(',') if v.strip()]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m watermark.bench',
+                                     description='水印引擎性能基准，结果以 JSON 输出')
+    parser.add_argument('--kinds', default=','.join(KINDS),
+                        help=f"输入类型，逗号分隔 (默认: {','.join(KINDS)})")
+    parser.add_argument('--sizes', default='0.3,2,12',
+                        help='图片大小(百万像素)，逗号分隔，例如 0.3,2,12,100 (默认: 0.3,2,12)')
+    parser.add_argument('--marks', default='text,image', help='水印类型 (默认: text,image)')
+    parser.add_argument('--space', default='75', help='水印间距，逗号分隔 (默认: 75)')
+    parser.add_argument('--angle', default='0,30', help='旋转角度，逗号分隔 (默认: 0,30)')
+    parser.add_argument('--size', default='50', help='字体大小，逗号分隔；图片水印缩放为其 2 倍%% (默认: 50)')
+    parser.add_argument('--profiles', default='balanced',
+                        help=f"编码档位，逗号分隔，可选 {','.join(PROFILES)} (默认: balanced)")
+    parser.add_argument('--formats', default='keep',
+                        help='输出格式，逗号分隔，keep 表示与输入相同，例如 keep,webp,avif (默认: keep)')
+    parser.add_argument('--repeat', type=int, default=3, help='每个用例处理次数 (默认: 3)')
+    parser.add_argument('--seed', type=int, default=0, help='生成测试图片的随机种子 (默认: 0)')
+    parser.add_argument('--font', default='', help='字体文件路径，留空使用系统默认字体')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'watermark-bench'),
+                        help='测试图片目录，已生成的图片会复用')
+    parser.add_argument('--no-numpy', action='store_true', help='不使用 NumPy')
+    parser.add_argument('-o', '--output', help='结果写入该 JSON 文件（默认输出到标准输出）')
+    parser.add_argument('--baseline', help='与之前保存的结果比较')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='速度下降或内存增加超过该比例视为退化 (默认: 0.1)')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.no_numpy:
+        ops.use_numpy(False)
+    kinds = parse_list(args.kinds, str)
+    unknown = [k for k in kinds if k not in KINDS]
+    if unknown:
+        print(f"未知的输入类型: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    inputs = make_inputs(args.data_dir, kinds, parse_list(args.sizes, float), args.seed)
+    logo = make_logo(args.data_dir, args.seed)
+    output_dir = tempfile.mkdtemp(prefix='watermark-bench-out-')
+
+    spawn = multiprocessing.get_context('spawn')
+    results = []
+    matrix = itertools.product(inputs, parse_list(args.marks, str), parse_list(args.space, int),
+                               parse_list(args.angle, int), parse_list(args.size, int),
+                               parse_list(args.profiles, str), parse_list(args.formats, str))
+    for (kind, mp, path), mark_type, space, angle, size, profile, output_format in matrix:
+        case = {'kind': kind, 'mp': mp, 'path': path, 'mark_type': mark_type, 'space': space,
+                'angle': angle, 'size': size, 'profile': profile,
+                'output_format': None if output_format == 'keep' else output_format,
+                'repeat': args.repeat, 'logo': logo,
+                'font': args.font, 'output_dir': output_dir, 'numpy': ops.backend() == 'numpy'}
+        # 每个用例一个新进程（spawn，不继承父进程的内存），峰值 RSS 只反映该用例
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+            result = pool.submit(run_case, case).result()
+        results.append(result)
+        rate = result['images_per_s']
+        rate = 'n/a' if rate is None else f"{rate:.2f}"
+        print(f"{case_key(result)}: {rate} 张/秒, "
+              f"p50 {result['latency_ms']['p50']:.0f}ms, 编码 {result['encode_ms'] or 0:.0f}ms, "
+              f"{(result['output_bytes'] or 0) / 1024:.0f} KB", file=sys.stderr)
+
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'ops_backend': ops.backend(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'args': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+        'results': results,
+    }
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+    regressed = False
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            report['comparison'], regressed = compare(results, json.load(f), args.threshold)
+        for row in report['comparison']:
+            flag = ' 退化' if row['regression'] else ''
+            print(f"{row['case']}: 速度 x{row['speed_ratio']:.2f}, p50 x{row['p50_ratio']:.2f}{flag}",
+                  file=sys.stderr)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
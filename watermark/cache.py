@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""旋转水印层缓存"""
+
+import threading
+from collections import OrderedDict
+
+
+class OverlayCache:
+    """旋转水印层的LRU缓存，按字节数限制内存占用"""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # 传给工作进程时不复制已缓存的水印层
+        state = self.__dict__.copy()
+        state['_entries'] = OrderedDict()
+        state['_bytes'] = 0
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def entry_bytes(entry):
+        # 水印层(RGBA/RGB等) + 预先拆分的alpha蒙版(L)
+        layer, mask = entry
+        return layer.width * layer.height * len(layer.getbands()) + mask.width * mask.height
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        nbytes = self.entry_bytes(entry)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = entry
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= self.entry_bytes(old)
+                self.evictions += 1
+
+    def resize(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self._entries and self._bytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= self.entry_bytes(old)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+# 进程内共享，多次处理之间复用已生成的水印层
+overlay_cache = OverlayCache()
@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+"""命令行入口: python -m watermark"""
+
+import os
+import sys
+import signal
+import argparse
+from functools import partial
+
+from . import ops
+from .cache import overlay_cache
+from .engine import WatermarkRenderer
+from .batch import BatchExecutor
+from .scan import BackgroundScanner, scan_images
+from .manifest import Manifest, skip_current
+from .timing import StageTimer
+from .progress import ProgressMeter
+from .encode import PROFILES, OUTPUT_FORMATS
+from .rendition import parse_renditions
+from .stamps import StampCache
+from .dedup import Deduplicator, deduplicate
+from .archive import ArchiveWriter, OutputCapture, is_archive, scan_archive
+from .watch import FolderWatcher, WatchDaemon
+from .shard import Shard, ShardRun, merge_shards, parse_shard
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m watermark',
+                                     description='批量为图片添加文字或图片水印（无需图形界面）')
+    parser.add_argument('input', help='输入图片文件、文件夹或 ZIP/TAR 压缩包；'
+                                      '为 - 时从标准输入读取一张图片，结果写到标准输出')
+    parser.add_argument('-o', '--output', default='./output',
+                        help='输出目录，以 .zip/.tar/.tar.gz 等结尾时写入压缩包 (默认: ./output)')
+
+    scan_group = parser.add_argument_group('扫描')
+    scan_group.add_argument('--no-recursive', dest='recursive', action='store_false',
+                            help='不处理子文件夹（默认会递归处理，并在输出目录中保留目录结构）')
+    scan_group.add_argument('--include', action='append', metavar='PATTERN',
+                            help='只处理匹配的文件，通配符匹配相对路径或文件名，可重复指定')
+    scan_group.add_argument('--exclude', action='append', metavar='PATTERN',
+                            help='跳过匹配的文件或文件夹，可重复指定')
+
+    mark_group = parser.add_mutually_exclusive_group(required=True)
+    mark_group.add_argument('-t', '--text', help='文字水印内容')
+    mark_group.add_argument('-i', '--image', help='水印图片路径')
+
+    text_group = parser.add_argument_group('文字水印')
+    text_group.add_argument('--color', default='#8B8B1B', help='文字颜色 (默认: #8B8B1B)')
+    text_group.add_argument('--font', default='', help='字体文件路径，留空使用系统默认字体')
+    text_group.add_argument('--font-height-crop', default='1.2',
+                            help='字体高度，带小数点时为字体大小的倍数 (默认: 1.2)')
+    text_group.add_argument('--size', type=int, default=50, help='字体大小 px (默认: 50)')
+    text_group.add_argument('--opacity', type=float, default=0.15, help='文字透明度 0-1 (默认: 0.15)')
+
+    image_group = parser.add_argument_group('图片水印')
+    image_group.add_argument('--image-scale', type=int, default=100, help='图片缩放 %% (默认: 100)')
+    image_group.add_argument('--image-opacity', type=int, default=50,
+                             help='图片透明度 1-100 (默认: 50)')
+
+    style_group = parser.add_argument_group('水印样式')
+    style_group.add_argument('--space', type=int, default=75, help='水印间距 px (默认: 75)')
+    style_group.add_argument('--angle', type=int, default=30, help='旋转角度 (默认: 30)')
+    style_group.add_argument('--quality', type=int, default=80, help='输出质量 1-100 (默认: 80)')
+    style_group.add_argument('--render-mode', choices=('visible', 'canvas'), default='visible',
+                             help='visible: 只在图片范围内渲染水印层; canvas: 旧版对角线画布 (默认: visible)')
+    style_group.add_argument('--stream-mp', type=float, default=100,
+                             help='PNG/TIFF 超过该像素数(百万)时分带流式处理，0 表示关闭 (默认: 100)')
+    style_group.add_argument('--stream-memory-mb', type=int, default=64,
+                             help='流式处理每个条带的内存预算 MB (默认: 64)')
+    style_group.add_argument('--cache-mb', type=int, default=256, help='水印缓存上限 MB (默认: 256)')
+    style_group.add_argument('--stamp-cache', metavar='DIR',
+                             help='跨运行复用生成好的水印图案的缓存目录 (默认: ~/.cache/watermark/stamps)')
+    style_group.add_argument('--stamp-cache-mb', type=int, default=64,
+                             help='水印图案缓存目录的大小上限 MB (默认: 64)')
+    style_group.add_argument('--no-stamp-cache', action='store_true',
+                             help='不使用磁盘上的水印图案缓存，每次重新加载字体并生成水印')
+
+    output_group = parser.add_argument_group('输出编码')
+    output_group.add_argument('--profile', choices=PROFILES, default='balanced',
+                              help='编码档位: fast 压缩快、文件大; smallest 文件小、压缩慢 (默认: balanced)')
+    output_group.add_argument('--format', dest='output_format', choices=tuple(OUTPUT_FORMATS),
+                              help='把输出转换为该格式，默认与输入相同')
+    output_group.add_argument('--strip-metadata', action='store_true',
+                              help='不保留原图的 EXIF 和 ICC 配置文件')
+    output_group.add_argument('--rendition', action='append', metavar='SPEC',
+                              help='输出多个尺寸，可重复指定。格式为 最长边[:格式[:质量[:后缀]]]，'
+                                   '最长边为 full 表示原图，后缀默认 _最长边，例如 '
+                                   '--rendition full --rendition 2048 --rendition 320:webp:70')
+    output_group.add_argument('--shared-palette', action='store_true',
+                              help='动画 GIF 所有帧共用一个调色板，帧数多时保存快得多，颜色略有损失')
+
+    parallel_group = parser.add_argument_group('并行处理')
+    parallel_group.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1,
+                                help='工作线程/进程数，pipeline 方式下为合成线程数 (默认: CPU核数)')
+    parallel_group.add_argument('--backend', choices=('process', 'thread', 'pipeline'),
+                                default='process',
+                                help='执行方式，pipeline 为读取/合成/写入分阶段流水线 (默认: process)')
+    parallel_group.add_argument('--read-workers', type=int, default=2,
+                                help='pipeline 方式的读取(解码)线程数 (默认: 2)')
+    parallel_group.add_argument('--write-workers', type=int, default=2,
+                                help='pipeline 方式的写入(编码)线程数 (默认: 2)')
+    parallel_group.add_argument('--queue-depth', type=int, default=4,
+                                help='pipeline 方式各阶段之间的队列长度，决定内存上限 (默认: 4)')
+    parallel_group.add_argument('--memory-budget-mb', type=int, default=0,
+                                help='同时处理的图片的估计峰值内存之和上限 MB，按文件头估计，'
+                                     '大图放不下时先处理小图，0 表示不限 (默认: 0)')
+    incremental_group = parser.add_argument_group('增量处理')
+    incremental_group.add_argument('-f', '--force', action='store_true',
+                                   help='忽略处理记录，重新处理所有图片')
+    incremental_group.add_argument('--hash', action='store_true',
+                                   help='在处理记录中保存输入文件的内容哈希，修改时间变化但内容相同的文件也会跳过')
+    incremental_group.add_argument('--dedup', action='store_true',
+                                   help='内容完全相同的输入只处理一次，其余的输出硬链接（不能链接时复制）到第一份的结果')
+    watch_group = parser.add_argument_group('监视文件夹')
+    watch_group.add_argument('--watch', action='store_true',
+                             help='持续监视输入文件夹，新图片写入完成后立即处理，按 Ctrl+C 结束')
+    watch_group.add_argument('--settle', type=float, default=0.3,
+                             help='文件大小和修改时间保持不变多少秒后视为写入完成 (默认: 0.3)')
+    watch_group.add_argument('--poll-interval', type=float, default=0.25,
+                             help='无法使用 inotify 时的轮询间隔秒数 (默认: 0.25)')
+    watch_group.add_argument('--no-inotify', dest='inotify', action='store_false',
+                             help='不使用 inotify，始终轮询（例如网络文件系统上）')
+    watch_group.add_argument('--status-interval', type=float, default=10,
+                             help='输出排队数量和延迟的间隔秒数 (默认: 10)')
+    shard_group = parser.add_argument_group('分片处理')
+    shard_group.add_argument('--shard', metavar='I/N',
+                             help='多台机器共同处理时只处理第 I 个分片（共 N 个，I 从 1 开始），'
+                                  '按相对路径的哈希分配')
+    shard_group.add_argument('--merge-shards', action='store_true',
+                             help='所有分片完成后运行：核对每张图片的输出，合并处理记录并汇总吞吐量')
+    timing_group = parser.add_argument_group('耗时统计')
+    timing_group.add_argument('--timing', action='store_true',
+                              help='记录每个文件各阶段（解码、合成、保存等）的耗时，结束时输出汇总')
+    timing_group.add_argument('--timing-memory', action='store_true',
+                              help='同时记录各阶段的内存变化（串行或进程池方式下准确）')
+    timing_group.add_argument('--timing-export', metavar='FILE',
+                              help='把耗时记录导出为 CSV 或 JSON（按扩展名）')
+    parser.add_argument('--no-numpy', action='store_true', help='不使用 NumPy，只用 Pillow 处理像素')
+    parser.add_argument('--log-file', help='把每张图片的处理结果追加写入该文件（安静模式下也写入）')
+    parser.add_argument('-q', '--quiet', action='store_true', help='只输出错误信息')
+    return parser
+
+
+def build_renderer(args, log=print):
+    """按命令行参数创建渲染器，参数无效时抛出 ValueError"""
+    mark_type = 'text' if args.text else 'image'
+    return WatermarkRenderer(mark_type, args.text or '', args.image, args.output,
+                             args.color, args.space, args.angle, args.font,
+                             args.font_height_crop, args.size, args.opacity, args.quality,
+                             args.image_scale, args.image_opacity,
+                             cache_mb=args.cache_mb, render_mode=args.render_mode,
+                             stream_mp=args.stream_mp, stream_memory_mb=args.stream_memory_mb,
+                             input_dir=args.input if os.path.isdir(args.input) or is_archive(args.input)
+                             else None,
+                             log=log, profile=args.profile, output_format=args.output_format,
+                             keep_metadata=not args.strip_metadata,
+                             renditions=parse_renditions(args.rendition or ()) or None,
+                             shared_palette=args.shared_palette,
+                             stamp_cache=None if args.no_stamp_cache else
+                             StampCache(args.stamp_cache, args.stamp_cache_mb))
+
+
+def run_stdio(renderer):
+    """从标准输入读取一张图片，加水印后写到标准输出，不经过文件系统"""
+    try:
+        data = sys.stdin.buffer.read()
+        if not data:
+            print("标准输入没有数据", file=sys.stderr)
+            return 1
+        result = renderer.process_bytes(data)
+    except Exception as e:
+        print(f"错误: {str(e)}", file=sys.stderr)
+        return 1
+    sys.stdout.buffer.write(result)
+    sys.stdout.buffer.flush()
+    return 0
+
+
+def run_watch(args, renderer):
+    """监视输入文件夹，直到按 Ctrl+C 或收到 SIGTERM"""
+    if not os.path.isdir(args.input) or is_archive(args.output):
+        print("--watch 需要输入和输出都是文件夹")
+        return 2
+    if args.timing or args.timing_memory or args.timing_export:
+        renderer.timer = StageTimer(track_memory=args.timing_memory)
+    try:
+        renderer.build_mark()
+    except Exception as e:
+        print(f"生成水印失败: {str(e)}")
+        return 2
+
+    watcher = FolderWatcher(args.input, recursive=args.recursive, include=args.include,
+                            exclude=args.exclude, skip_dirs=[args.output], settle=args.settle,
+                            poll_interval=args.poll_interval, use_inotify=args.inotify)
+    manifest = Manifest(args.output, renderer.params_hash(), use_hash=args.hash,
+                        input_dir=renderer.input_dir)
+    if args.force:
+        manifest.entries.clear()
+    # 安静模式下只输出错误和定期的状态
+    log = print if not args.quiet else lambda message: message.startswith('✓') or print(message)
+    backend = 'thread' if args.backend == 'thread' else 'process'
+    daemon = WatchDaemon(renderer, watcher, manifest, workers=args.workers, backend=backend,
+                         log=log, status_interval=args.status_interval)
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        manifest.close()
+    print(daemon.status())
+    if renderer.timer is not None:
+        print(renderer.timer.report())
+    return 0
+
+
+def run_merge(args, renderer):
+    """合并各分片的处理结果，全部完整时返回 0"""
+    file_paths = scan_images(args.input, recursive=args.recursive, include=args.include,
+                             exclude=args.exclude, skip_dirs=[args.output])
+    return 0 if merge_shards(renderer, file_paths, args.input) else 1
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.no_numpy:
+        ops.use_numpy(False)
+
+    # 标准输入输出模式下，标准输出只用于图片数据，提示信息都写到标准错误
+    stdio = args.input == '-'
+    log = partial(print, file=sys.stderr) if stdio else print
+
+    if not stdio and not os.path.exists(args.input):
+        print(f"输入路径不存在: {args.input}")
+        return 2
+    if args.image and not os.path.exists(args.image):
+        log(f"水印图片不存在: {args.image}")
+        return 2
+    archive_in = not stdio and os.path.isfile(args.input) and is_archive(args.input)
+    archive_out = is_archive(args.output)
+    if archive_out and args.dedup:
+        print("--dedup 需要输出到文件夹，不能与输出压缩包同时使用")
+        return 2
+    shard = None
+    if args.shard or args.merge_shards:
+        if stdio or archive_in or archive_out or args.watch:
+            print("--shard 和 --merge-shards 需要输入和输出都是文件夹，且不能与 --watch 同时使用")
+            return 2
+        if args.shard:
+            try:
+                shard = Shard(*parse_shard(args.shard), root=args.input)
+            except ValueError as e:
+                print(str(e))
+                return 2
+
+    try:
+        renderer = build_renderer(args, log)
+    except ValueError as e:
+        log(str(e))
+        return 2
+    if stdio:
+        return run_stdio(renderer)
+    if args.watch:
+        return run_watch(args, renderer)
+    if args.merge_shards:
+        return run_merge(args, renderer)
+    if args.timing or args.timing_memory or args.timing_export:
+        renderer.timer = StageTimer(track_memory=args.timing_memory)
+    if archive_out:
+        renderer.capture = OutputCapture()
+    executor = BatchExecutor(renderer, workers=args.workers, backend=args.backend,
+                             read_workers=args.read_workers, write_workers=args.write_workers,
+                             queue_depth=args.queue_depth,
+                             memory_budget_mb=args.memory_budget_mb)
+
+    # 先在主进程生成一次水印，校验参数并输出字体警告
+    try:
+        mark = renderer.build_mark()
+    except Exception as e:
+        print(f"生成水印失败: {str(e)}")
+        return 2
+
+    # 后台线程扫描，找到第一个文件就开始处理
+    if archive_in:
+        # 压缩包成员的数据随队列传递，队列不必长
+        scanner = BackgroundScanner(scan_archive(args.input, include=args.include,
+                                                 exclude=args.exclude),
+                                    maxsize=max(2, args.workers))
+    else:
+        scanner = BackgroundScanner(scan_images(args.input, recursive=args.recursive,
+                                                include=args.include, exclude=args.exclude,
+                                                skip_dirs=[args.output]))
+    skipped = []
+    if archive_in or archive_out:
+        # 压缩包中的输入或输出没有可比较的修改时间，每次都全部处理
+        manifest = None
+        pending = scanner
+    else:
+        # 各分片写自己的处理记录，合并时再汇总
+        manifest = Manifest(args.output, renderer.params_hash(), use_hash=args.hash,
+                            input_dir=renderer.input_dir,
+                            **({'name': shard.manifest_name} if shard else {}))
+        pending = shard.select(scanner) if shard else scanner
+        if not args.force:
+            pending = skip_current(manifest, renderer, pending, skipped)
+    writer = ArchiveWriter(args.output) if archive_out else None
+
+    dedup = Deduplicator(renderer) if args.dedup else None
+    if dedup:
+        results = deduplicate(executor, renderer, pending, mark, dedup)
+    else:
+        results = executor.run(pending, mark)
+
+    processed = errors = 0
+    meter = ProgressMeter()
+    shard_run = ShardRun(shard, renderer, args.input) if shard else None
+    log_file = open(args.log_file, 'a', encoding='utf-8') if args.log_file else None
+    completed = False
+    try:
+        for image_path, ok, message in results:
+            processed += 1
+            meter.update(processed)
+            if log_file:
+                log_file.write(message + '\n')
+            if shard_run:
+                shard_run.record(image_path, ok)
+            if writer:
+                # 按输入顺序写入压缩包，写完即释放
+                for output, data in renderer.capture.pop(image_path):
+                    if ok:
+                        writer.write(os.path.relpath(output, renderer.output_dir), data)
+            if ok:
+                if manifest:
+                    manifest.record(image_path, renderer.output_path(image_path))
+            else:
+                errors += 1
+            if not ok or not args.quiet:
+                print(message)
+        completed = True
+    except KeyboardInterrupt:
+        executor.stop()
+        print("处理已停止")
+        return 130
+    finally:
+        scanner.stop()
+        if manifest:
+            manifest.close()
+        if writer:
+            # 中断时不留下不完整的压缩包
+            writer.close(keep=completed)
+        if log_file:
+            log_file.close()
+        if shard_run:
+            shard_run.save(skipped=len(skipped), completed=completed)
+
+    if not scanner.found:
+        print("未找到图片文件")
+        return 1
+    if not args.quiet:
+        if skipped:
+            print(f"跳过 {len(skipped)} 个已是最新的图片")
+        if executor.backend != 'process':
+            stats = overlay_cache.stats()
+            print(f"水印层缓存: 命中 {stats['hits']}, 未命中 {stats['misses']}, "
+                  f"淘汰 {stats['evictions']}")
+        if executor.stage_report():
+            print(executor.stage_report())
+        if executor.admission_report():
+            print(executor.admission_report())
+        if dedup and dedup.duplicates:
+            print(dedup.report())
+        if shard:
+            print(f"分片 {shard.index}/{shard.count}: 共 {scanner.found} 张，分到本分片 {shard.assigned} 张")
+        print(f"处理完成！共 {processed} 张，失败 {errors} 张，平均 {meter.status()}")
+    if renderer.timer is not None:
+        # 明确要求了统计，安静模式下也输出
+        print(renderer.timer.report())
+        if args.timing_export:
+            renderer.timer.export(args.timing_export)
+    return 1 if errors else 0
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""按内容去重：内容完全相同的输入只处理一次
+
+只有大小（和输出扩展名）与之前某个文件相同的文件才需要计算哈希，大多数文件只读一次大小。
+重复的文件不再解码、合成和编码，等第一份处理完成后，把它的输出硬链接（不能链接时复制）到
+重复文件的输出位置。
+"""
+
+import os
+import shutil
+import threading
+from collections import deque
+
+from .archive import content_digest, content_size
+from .output import temp_path
+
+
+def link_or_copy(source, dest):
+    """把 source 硬链接到 dest，跨文件系统等无法链接时复制；返回是否为硬链接"""
+    os.makedirs(os.path.dirname(dest) or '.', exist_ok=True)
+    tmp = temp_path(dest)
+    try:
+        os.link(source, tmp)
+        linked = True
+    except OSError:
+        shutil.copy2(source, tmp)
+        linked = False
+    try:
+        os.replace(tmp, dest)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return linked
+
+
+def _cpu_seconds():
+    # 包括已结束的工作进程
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class Deduplicator:
+    """过滤重复输入，并在原图处理完成后生成重复文件的输出
+
+    unique() 可以在其它线程中消费（如流水线的送入线程）；complete() 和 finish() 在产出结果的线程中调用。
+    """
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+        self._lock = threading.Lock()
+        self._sizes = {}  # (大小, 输出扩展名) -> 还没有计算哈希的第一个文件，已计算过时为 None
+        self._originals = {}  # (哈希, 输出扩展名) -> 第一次出现的文件
+        self._waiting = {}  # 原图 -> 等待其结果的重复文件
+        self._results = {}  # 已完成的原图 -> 是否成功
+        self._ready = deque()  # 发现时原图已经完成的重复文件
+        self.duplicates = 0
+        self.linked = 0
+        self.copied = 0
+        self.bytes_saved = 0  # 不必读取的输入和不必写入的输出
+        self.processed = 0
+        self._start = _cpu_seconds()
+
+    def unique(self, file_paths):
+        """依次产出需要处理的文件，重复的文件留到原图完成后生成输出"""
+        for path in file_paths:
+            try:
+                original = self._find_original(path)
+            except OSError:
+                original = None  # 读不了的文件交给正常处理流程报错
+            if original is None:
+                yield path
+                continue
+            with self._lock:
+                self.duplicates += 1
+                if original in self._results:
+                    self._ready.append((path, original))
+                else:
+                    self._waiting.setdefault(original, []).append(path)
+
+    def _find_original(self, path):
+        """返回内容相同、先出现的文件，没有时返回 None"""
+        ext = os.path.splitext(self.renderer.output_path(path))[1].lower()
+        size_key = (content_size(path), ext)
+        if size_key not in self._sizes:
+            # 第一个这个大小的文件，暂不计算哈希
+            self._sizes[size_key] = path
+            return None
+        first = self._sizes[size_key]
+        if first is not None:
+            # 出现第二个同样大小的文件时才补算第一个文件的哈希
+            self._originals.setdefault((content_digest(first), ext), first)
+            self._sizes[size_key] = None
+        key = (content_digest(path), ext)
+        original = self._originals.get(key)
+        if original is None:
+            self._originals[key] = path
+        return original
+
+    def complete(self, path, ok):
+        """path 处理完成，依次产出其重复文件（以及之前已就绪的重复文件）的 (路径, 是否成功, 日志信息)"""
+        with self._lock:
+            self.processed += 1
+            self._results[path] = ok
+            jobs = [(dup, path) for dup in self._waiting.pop(path, ())]
+            jobs += self._ready
+            self._ready.clear()
+        for dup, original in jobs:
+            yield self._materialize(dup, original)
+
+    def finish(self):
+        """全部结果产出后，产出剩余的重复文件；中途停止时原图未处理的重复文件不产出"""
+        with self._lock:
+            jobs = list(self._ready)
+            self._ready.clear()
+            for original, dups in self._waiting.items():
+                if original in self._results:
+                    jobs += [(dup, original) for dup in dups]
+            self._waiting.clear()
+        for dup, original in jobs:
+            yield self._materialize(dup, original)
+
+    def _materialize(self, dup, original):
+        name = os.path.basename(dup)
+        if not self._results.get(original):
+            return dup, False, f"错误: {name} - 与 {os.path.basename(original)} 内容相同，但其处理失败"
+        try:
+            for source, dest in zip(self.renderer.output_paths(original),
+                                    self.renderer.output_paths(dup)):
+                if link_or_copy(source, dest):
+                    self.linked += 1
+                else:
+                    self.copied += 1
+                self.bytes_saved += os.path.getsize(dest)
+            self.bytes_saved += content_size(dup)
+        except OSError as e:
+            return dup, False, f"错误: {name} - {str(e)}"
+        return dup, True, f"✓ {name} - 与 {os.path.basename(original)} 内容相同，已链接输出"
+
+    def report(self):
+        """节省的读写字节数和 CPU 时间（按已处理图片的平均 CPU 时间估计）"""
+        cpu = _cpu_seconds() - self._start
+        saved_cpu = cpu / self.processed * self.duplicates if self.processed else 0.0
+        return (f"去重: 重复 {self.duplicates} 张（硬链接 {self.linked}，复制 {self.copied}），"
+                f"节省读写 {self.bytes_saved / 1024 / 1024:.1f} MB，约节省 CPU {saved_cpu:.1f} 秒")
+
+
+def deduplicate(executor, renderer, file_paths, mark=None, dedup=None):
+    """在 executor.run 外层去重，依次产出 (图片路径, 是否成功, 日志信息)"""
+    dedup = dedup or Deduplicator(renderer)
+    for image_path, ok, message in executor.run(dedup.unique(file_paths), mark):
+        yield image_path, ok, message
+        yield from dedup.complete(image_path, ok)
+    yield from dedup.finish()
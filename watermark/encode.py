@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""输出编码档位和格式转换
+
+balanced 与原先的默认保存参数一致；fast 降低 PNG/WebP/AVIF 的压缩力度换取速度，
+smallest 用更慢的编码换取更小的文件。JPEG 的编码速度几乎不受参数影响，fast 与 balanced 相同。
+"""
+
+from PIL import Image, features
+
+PROFILES = ('fast', 'balanced', 'smallest')
+
+# 各格式在不同档位下的保存参数
+ENCODER_SETTINGS = {
+    'PNG': {
+        'fast': {'compress_level': 1},
+        'balanced': {'compress_level': 6},
+        'smallest': {'compress_level': 9, 'optimize': True},
+    },
+    'JPEG': {
+        'fast': {},
+        'balanced': {},
+        'smallest': {'optimize': True, 'progressive': True, 'subsampling': '4:2:0'},
+    },
+    'WEBP': {
+        'fast': {'method': 0},
+        'balanced': {'method': 4},
+        'smallest': {'method': 6},
+    },
+    'AVIF': {
+        'fast': {'speed': 10},
+        'balanced': {'speed': 6},
+        'smallest': {'speed': 4},
+    },
+    'TIFF': {
+        'fast': {},
+        'balanced': {},
+        'smallest': {'compression': 'tiff_adobe_deflate'},
+    },
+}
+
+# 使用 quality 参数的格式（TIFF 的 quality 只对 JPEG 压缩有效，其它压缩方式会报错）
+QUALITY_FORMATS = ('JPEG', 'WEBP', 'AVIF')
+EXIF_FORMATS = ('JPEG', 'PNG', 'WEBP', 'AVIF')
+ICC_FORMATS = ('JPEG', 'PNG', 'WEBP', 'AVIF', 'TIFF')
+
+# 可转换的输出格式: 名称 -> (扩展名, 需要的 Pillow 功能)
+OUTPUT_FORMATS = {
+    'webp': ('.webp', 'webp'),
+    'avif': ('.avif', 'avif'),
+    'jpeg': ('.jpg', None),
+    'png': ('.png', None),
+}
+
+# ICC 色彩空间与图片模式的对应，模式已转换（如 CMYK -> RGB）时原配置文件不再适用
+_ICC_MODES = {b'RGB ': ('RGB', 'RGBA'), b'GRAY': ('L', 'LA'), b'CMYK': ('CMYK',)}
+
+
+def image_format(ext):
+    return Image.registered_extensions().get(ext.lower())
+
+
+def output_extension(output_format):
+    """输出格式对应的扩展名，Pillow 不支持该格式时抛出异常"""
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"不支持的输出格式: {output_format}")
+    ext, feature = OUTPUT_FORMATS[output_format]
+    if feature and not features.check(feature):
+        raise ValueError(f"当前 Pillow 不支持 {output_format.upper()} 编码")
+    return ext
+
+
+def format_extension(fmt):
+    """Pillow 格式名对应的扩展名，无法保存的格式返回 None"""
+    if fmt == 'MPO':  # 部分相机的 JPEG 会被识别为 MPO
+        fmt = 'JPEG'
+    if fmt not in Image.SAVE:
+        return None
+    for ext, name in Image.registered_extensions().items():
+        if name == fmt:
+            return ext
+    return None
+
+
+def compress_level(profile):
+    return ENCODER_SETTINGS['PNG'][profile]['compress_level']
+
+
+def save_options(image, ext, profile='balanced', quality=80, keep_metadata=True):
+    """按输出格式和档位生成 image.save 的参数，保留 EXIF 和 ICC 配置文件"""
+    fmt = image_format(ext)
+    options = dict(ENCODER_SETTINGS.get(fmt, {}).get(profile, {}))
+    if fmt in QUALITY_FORMATS:
+        options['quality'] = quality
+    if keep_metadata:
+        exif = image.info.get('exif')
+        if exif and fmt in EXIF_FORMATS:
+            options['exif'] = exif
+        icc = image.info.get('icc_profile')
+        if icc and fmt in ICC_FORMATS and image.mode in _ICC_MODES.get(icc[16:20], (image.mode,)):
+            options['icc_profile'] = icc
+    return options
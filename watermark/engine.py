@@ -0,0 +1,572 @@
+# -*- coding: utf-8 -*-
+"""水印渲染引擎，只依赖Pillow"""
+
+import io
+import os
+import copy
+import json
+import math
+import hashlib
+import platform
+from functools import lru_cache
+from contextlib import contextmanager
+from PIL import Image, ImageFont, ImageDraw, ImageOps
+
+from . import ops
+from .cache import overlay_cache
+from .output import atomic_output
+from .layer import composite_mode, render_canvas_layer, render_visible_layer
+from .stream import open_reader, watermark_stream
+from .animation import ANIMATION_FORMATS, animation_options, frame_count, quantize_frames
+from .timing import NO_TIMING
+from .stamps import font_lock, load_font
+from .archive import Member
+from .encode import (compress_level, format_extension, image_format, output_extension,
+                     save_options)
+
+
+class WatermarkRenderer:
+    """水印渲染逻辑，不依赖Qt，可在线程池或进程池的工作者中使用"""
+
+    def __init__(self, mark_type, text_mark, image_mark_path, output_dir,
+                 color, space, angle, font_family, font_height_crop, size, opacity,
+                 quality, image_scale, image_opacity, cache_mb=256, render_mode='visible',
+                 stream_mp=100, stream_memory_mb=64, input_dir=None, log=None, timer=None,
+                 profile='balanced', output_format=None, keep_metadata=True, renditions=None,
+                 shared_palette=False, stamp_cache=None, layer_cache=None):
+        self.mark_type = mark_type  # 'text' 或 'image'
+        self.text_mark = text_mark
+        self.image_mark_path = image_mark_path
+        self.output_dir = output_dir
+        self.color = color
+        self.space = space
+        self.angle = angle
+        self.font_family = font_family
+        self.font_height_crop = font_height_crop
+        self.size = size
+        self.opacity = opacity
+        self.quality = quality
+        self.image_scale = image_scale
+        self.image_opacity = image_opacity
+        self.cache_bytes = cache_mb * 1024 * 1024
+        self.render_mode = render_mode  # 'visible' 只渲染可见区域, 'canvas' 对角线画布
+        self.stream_mp = stream_mp  # 超过该像素数(百万)的 PNG/TIFF 分带流式处理，0 表示关闭
+        self.stream_memory_mb = stream_memory_mb
+        self.input_dir = input_dir  # 设置后在输出目录中保留相对于它的子目录结构
+        self.log = log
+        self.timer = timer  # StageTimer，设置后记录每个文件各阶段的耗时
+        self.profile = profile  # 编码档位: 'fast', 'balanced', 'smallest'
+        self.output_format = output_format  # 转换输出格式，None 表示与输入相同
+        self.output_ext = output_extension(output_format) if output_format else None
+        self.keep_metadata = keep_metadata  # 保留 EXIF 和 ICC 配置文件
+        self.renditions = renditions  # Rendition 列表（从大到小），一次解码输出多个尺寸
+        self.shared_palette = shared_palette  # 多帧 GIF 所有帧共用一个调色板
+        self.stamp_cache = stamp_cache  # StampCache，设置后跨运行复用生成好的水印图案
+        self.capture = None  # OutputCapture，设置后输出留在内存中，由调用方写入压缩包
+        # 水印层缓存；为 None 时使用进程内共享的 overlay_cache 并按 cache_mb 调整其上限。
+        # 预览等使用自己的缓存，不影响正在运行的批处理
+        self.layer_cache = layer_cache
+        self._scaled_marks = {}
+        self._mark = None
+        if layer_cache is None:
+            overlay_cache.resize(self.cache_bytes)
+
+    def __getstate__(self):
+        # 日志回调（如Qt信号）无法跨进程传递
+        state = self.__dict__.copy()
+        state['log'] = None
+        state['_scaled_marks'] = {}  # 合成函数是闭包，无法序列化
+        state['_mark'] = None
+        return state
+
+    def _log(self, message):
+        if self.log:
+            self.log(message)
+
+    def _stage(self, imagePath, name):
+        if self.timer is None:
+            return NO_TIMING
+        return self.timer.stage(imagePath, name)
+
+    def default_mark(self):
+        """生成一次后重复使用的水印"""
+        if self._mark is None:
+            self._mark = self.build_mark()
+        return self._mark
+
+    def build_mark(self):
+        if self.mark_type == 'text':
+            return self.gen_text_mark()
+        return self.gen_image_mark()
+
+    def params_hash(self):
+        """所有影响输出结果的参数的哈希，用于增量处理"""
+        params = [self.mark_type, self.text_mark, self.color, self.space, self.angle,
+                  self.font_family, self.font_height_crop, self.size, self.opacity,
+                  self.quality, self.image_scale, self.image_opacity, self.render_mode,
+                  self.profile, self.output_format, self.keep_metadata,
+                  [r.key() for r in self.renditions or ()], self.shared_palette]
+        for path in (self.image_mark_path, self.font_family):
+            if path and os.path.exists(path):
+                st = os.stat(path)
+                params += [path, st.st_size, st.st_mtime_ns]
+        return hashlib.sha256(json.dumps(params, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def scaled(self, scale):
+        """按比例缩小字体、水印图片和间距的副本，用于在预览图和缩小的输出尺寸上绘制水印"""
+        renderer = copy.copy(self)
+        renderer.size = max(1, round(self.size * scale))
+        renderer.space = max(1, round(self.space * scale))
+        renderer.image_scale = self.image_scale * scale
+        if '.' not in self.font_height_crop:
+            renderer.font_height_crop = str(max(1, round(int(self.font_height_crop) * scale)))
+        return renderer
+
+    def output_path(self, imagePath):
+        """输出文件路径；输出多个尺寸时为第一个（最大的）尺寸的路径"""
+        if self.renditions:
+            return self.rendition_path(imagePath, self.renditions[0])
+        return self._mirror_path(imagePath)
+
+    def output_paths(self, imagePath):
+        """一张图片的所有输出文件路径"""
+        if self.renditions:
+            return [self.rendition_path(imagePath, r) for r in self.renditions]
+        return [self._mirror_path(imagePath)]
+
+    def rendition_path(self, imagePath, rendition):
+        base, ext = os.path.splitext(self._mirror_path(imagePath))
+        if rendition.output_format:
+            ext = output_extension(rendition.output_format)
+        return base + rendition.suffix + ext
+
+    def _mirror_path(self, imagePath):
+        rel_path = os.path.basename(imagePath)
+        if self.input_dir:
+            path = os.path.relpath(imagePath, self.input_dir)
+            if not path.startswith(os.pardir):
+                rel_path = path
+        if self.output_ext:
+            rel_path = os.path.splitext(rel_path)[0] + self.output_ext
+        return os.path.join(self.output_dir, rel_path)
+
+    def process_image(self, imagePath, mark):
+        """处理单张图片，返回 (是否成功, 日志信息)"""
+        im = self.read_image(imagePath)
+        if not isinstance(im, Image.Image):
+            return self.stream_image(imagePath, im, mark)
+        return self.process_decoded(imagePath, im, mark)
+
+    def process_decoded(self, imagePath, im, mark):
+        """合成并保存已解码的图片，返回 (是否成功, 日志信息)"""
+        if self.renditions:
+            return self.process_renditions(imagePath, im, mark)
+        if frame_count(im) > 1:
+            return self.process_frames(imagePath, im, mark)
+        image = self.composite_image(imagePath, im, mark)
+        return self.write_image(imagePath, image)
+
+    def read_image(self, imagePath):
+        """解码：返回解码后的图片；需要流式处理的超大图片返回条带读取器"""
+        if isinstance(imagePath, Member):
+            # 压缩包中的图片直接从内存解码
+            return self.decode_image(io.BytesIO(imagePath.data), imagePath)
+        if self.can_stream(imagePath):
+            reader = open_reader(imagePath)
+            if reader is not None:
+                if reader.size[0] * reader.size[1] >= self.stream_mp * 1000000:
+                    return reader
+                reader.close()
+
+        return self.decode_image(imagePath, imagePath)
+
+    def can_stream(self, imagePath):
+        """超大图片是否可以分带流式处理；流式处理只能输出 PNG/TIFF，且只读第一帧"""
+        output_ext = os.path.splitext(self.output_path(imagePath))[1].lower()
+        if not (self.stream_mp and not self.renditions and self.capture is None
+                and output_ext in ('.png', '.tif', '.tiff')):
+            return False
+        # 多页 TIFF 和 APNG 按帧处理，否则第一帧以后的都会丢掉
+        try:
+            with Image.open(imagePath) as im:
+                return frame_count(im) == 1
+        except Exception:
+            return False  # 打不开的文件交给正常的解码流程报错
+
+    def decode_image(self, source, label):
+        """打开并解码 source（路径或文件对象），按 EXIF 方向旋转"""
+        with self._stage(label, 'open'):
+            im = Image.open(source)
+        with self._stage(label, 'decode'):
+            im.load()
+        with self._stage(label, 'exif_transpose'):
+            # 原地旋转，无需旋转时不再复制整张图片
+            ImageOps.exif_transpose(im, in_place=True)
+        return im
+
+    def process_bytes(self, data, mark=None, output_format=None):
+        """处理内存中的图片（bytes、memoryview 或文件对象），返回编码后的 bytes
+
+        不经过文件系统；输出格式依次取 output_format、渲染器的输出格式和原图格式。
+        mark 为 None 时使用 default_mark()，多次调用共用同一个水印。
+        """
+        label = '<memory>'
+        fp = data if hasattr(data, 'read') else io.BytesIO(data)
+        im = self.decode_image(fp, label)
+        output_format = output_format or self.output_format
+        ext = output_extension(output_format) if output_format else format_extension(im.format)
+        if ext is None:
+            raise ValueError(f"无法以原格式 {im.format} 输出，请指定输出格式")
+
+        mark = mark or self.default_mark()
+        buf = io.BytesIO()
+        if frame_count(im) > 1 and image_format(ext) in ANIMATION_FORMATS:
+            # 动画与处理文件时一样逐帧添加水印
+            frames, durations, disposals, loop = self.read_frames(im)
+            frames = [mark(frame, composite_mode(frame, ext), label) for frame in frames]
+            self.save_frames(buf, ext, frames, durations, disposals, loop, label=label)
+            return buf.getvalue()
+        image = mark(im, composite_mode(im, ext), label)
+        options = save_options(image, ext, self.profile, self.quality, self.keep_metadata)
+        with self._stage(label, 'save'):
+            image.save(buf, format=image_format(ext), **options)
+        return buf.getvalue()
+
+    def composite_image(self, imagePath, im, mark):
+        """合成：把水印叠加到图片上"""
+        ext = os.path.splitext(self.output_path(imagePath))[1]
+        return mark(im, composite_mode(im, ext), imagePath)
+
+    def write_image(self, imagePath, image, output=None, quality=None):
+        """编码：保存到输出目录，返回 (是否成功, 日志信息)"""
+        name = os.path.basename(imagePath)
+        if image:
+            output = output or self.output_path(imagePath)
+            ext = os.path.splitext(output)[1]
+            options = save_options(image, ext, self.profile, quality or self.quality,
+                                   self.keep_metadata)
+            with self.output_file(imagePath, output) as target, self._stage(imagePath, 'save'):
+                image.save(target, format=image_format(ext), **options)
+            return True, f"✓ {name} - 成功"
+        return False, f"✗ {name} - 失败"
+
+    @contextmanager
+    def output_file(self, imagePath, output):
+        """保存输出的目标：输出到压缩包时为内存缓冲，否则为原子写入的临时文件"""
+        if self.capture is not None:
+            buf = io.BytesIO()
+            yield buf
+            self.capture.add(imagePath, output, buf.getvalue())
+            return
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with atomic_output(output) as new_name:
+            yield new_name
+
+    def process_frames(self, imagePath, im, mark):
+        """逐帧添加水印，保留每帧时长、处理方式和循环次数；同尺寸的帧共用缓存中的同一个水印层"""
+        name = os.path.basename(imagePath)
+        output = self.output_path(imagePath)
+        ext = os.path.splitext(output)[1]
+        fmt = image_format(ext)
+        if fmt not in ANIMATION_FORMATS:
+            # 输出格式不支持多帧，只处理第一帧
+            return self.write_image(imagePath, self.composite_image(imagePath, im, mark))
+
+        frames, durations, disposals, loop = self.read_frames(im)
+        for index, frame in enumerate(frames):
+            frames[index] = mark(frame, composite_mode(frame, ext), imagePath)
+        with self.output_file(imagePath, output) as target:
+            self.save_frames(target, ext, frames, durations, disposals, loop, label=imagePath)
+        return True, f"✓ {name} - 成功（{len(frames)} 帧）"
+
+    def read_frames(self, im):
+        """取出所有帧（TIFF 的所有页），返回 (帧列表, 每帧时长, 每帧处理方式, 循环次数)"""
+        frames, durations, disposals = [], [], []
+        loop = im.info.get('loop')
+        for index in range(frame_count(im)):
+            im.seek(index)
+            # 每帧可能有自己的方向，exif_transpose 同时复制出独立的帧
+            frames.append(ImageOps.exif_transpose(im))
+            durations.append(im.info.get('duration', 0))
+            disposals.append(getattr(im, 'disposal_method', 0))
+        return frames, durations, disposals, loop
+
+    def save_frames(self, target, ext, frames, durations, disposals, loop, quality=None, label=None):
+        """把已添加水印的帧保存为一个多帧文件"""
+        fmt = image_format(ext)
+        if fmt == 'GIF' and self.shared_palette:
+            with self._stage(label, 'quantize'):
+                frames = quantize_frames(frames)
+        options = save_options(frames[0], ext, self.profile, quality or self.quality,
+                               self.keep_metadata)
+        options.update(animation_options(fmt, durations, disposals, loop))
+        with self._stage(label, 'save'):
+            frames[0].save(target, format=fmt, save_all=True, append_images=frames[1:], **options)
+
+    def process_renditions(self, imagePath, im, mark):
+        """从一次解码输出所有尺寸
+
+        从大到小依次在上一个尺寸的基础上缩小，避免每个尺寸都从原图重采样；
+        每个尺寸按自己的缩放比例生成水印，水印的疏密与原图一致。
+        多帧图片的每个尺寸都保留所有帧，输出格式不支持多帧时与 process_frames 一样只输出第一帧。
+        """
+        if frame_count(im) > 1:
+            frames, durations, disposals, loop = self.read_frames(im)
+        else:
+            frames, durations, disposals, loop = [im], None, None, None
+        full_sizes = [frame.size for frame in frames]
+        for rendition in self.renditions:
+            output = self.rendition_path(imagePath, rendition)
+            ext = os.path.splitext(output)[1]
+            animated = len(frames) > 1 and image_format(ext) in ANIMATION_FORMATS
+            images = []
+            for index in range(len(frames) if animated else 1):
+                base, full_size = frames[index], full_sizes[index]
+                size = rendition.fit(full_size)
+                if size != base.size:
+                    if base.mode in ('1', 'P'):
+                        # 调色板图片只能最近邻缩放，先转换为真彩色
+                        base = base.convert('RGBA' if 'transparency' in base.info else 'RGB')
+                    with self._stage(imagePath, 'resize'):
+                        base = frames[index] = base.resize(size, Image.Resampling.LANCZOS)
+
+                mode = composite_mode(base, ext)
+                # 模式相同时水印会直接贴在 base 上，需要复制一份留给下一个尺寸缩放
+                target = base.copy() if base.mode == mode else base
+                scale = base.size[0] / full_size[0]
+                rendition_mark = mark if base.size == full_size else self.scaled_mark(scale)
+                images.append(rendition_mark(target, mode, imagePath))
+
+            if animated:
+                with self.output_file(imagePath, output) as target:
+                    self.save_frames(target, ext, images, durations, disposals, loop,
+                                     rendition.quality, imagePath)
+                continue
+            ok, message = self.write_image(imagePath, images[0], output, rendition.quality)
+            if not ok:
+                return ok, message
+        return True, f"✓ {os.path.basename(imagePath)} - 成功（{len(self.renditions)} 个尺寸）"
+
+    def scaled_mark(self, scale):
+        """缩小尺寸用的水印，按缩放后的参数缓存"""
+        renderer = self.scaled(scale)
+        key = (renderer.size, renderer.space, renderer.image_scale, renderer.font_height_crop)
+        mark = self._scaled_marks.get(key)
+        if mark is None:
+            if len(self._scaled_marks) >= 64:
+                self._scaled_marks.pop(next(iter(self._scaled_marks)))
+            mark = self._scaled_marks[key] = renderer.build_mark()
+        return mark
+
+    def stream_image(self, imagePath, reader, mark):
+        """分带流式处理超大图片"""
+        name = os.path.basename(imagePath)
+        output = self.output_path(imagePath)
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with atomic_output(output) as new_name, self._stage(imagePath, 'stream'):
+            watermark_stream(reader, new_name, mark.stamp,
+                             self.space, self.angle, self.stream_memory_mb * 1024 * 1024,
+                             compress_level=compress_level(self.profile),
+                             render_mode=self.render_mode)
+        return True, f"✓ {name} - 成功（流式处理）"
+
+    def safe_process_image(self, imagePath, mark):
+        try:
+            return self.process_image(imagePath, mark)
+        except Exception as e:
+            return self.error_result(imagePath, e)
+
+    def error_result(self, imagePath, e):
+        return False, f"错误: {os.path.basename(imagePath)} - {str(e)}"
+
+    def set_opacity(self, im, opacity):
+        return ops.set_opacity(im, opacity)
+
+    def crop_image(self, im):
+        return ops.crop_image(im)
+
+    def get_default_font(self):
+        """获取系统默认字体"""
+        return find_default_font()
+
+    def gen_text_mark(self):
+        """生成文字水印"""
+        key = None
+        mark = None
+        if self.stamp_cache is not None:
+            font_path = self.font_path()
+            key = self.stamp_cache.key('text', self.text_mark,
+                                       font_path and self.stamp_cache.digest(font_path),
+                                       self.size, self.font_height_crop, self.color, self.opacity)
+            mark = self.stamp_cache.get(key)
+        if mark is None:
+            mark = self.render_text_stamp()
+            if key is not None:
+                self.stamp_cache.put(key, mark)
+
+        mark_key = ('text', self.text_mark, self.color, self.font_family,
+                    self.font_height_crop, self.size, self.opacity)
+        return self.tile_mark(mark, mark_key)
+
+    def font_path(self):
+        """绘制文字使用的字体文件，没有可用的字体文件时返回 None"""
+        if self.font_family and os.path.exists(self.font_family):
+            return self.font_family
+        return self.get_default_font()
+
+    def render_text_stamp(self):
+        """绘制、裁剪文字并设置透明度，得到单个文字水印图案"""
+        is_height_crop_float = '.' in self.font_height_crop
+        width = len(self.text_mark) * self.size
+        if is_height_crop_float:
+            height = round(self.size * float(self.font_height_crop))
+        else:
+            height = int(self.font_height_crop)
+
+        mark = Image.new(mode='RGBA', size=(width, height))
+        draw_table = ImageDraw.Draw(im=mark)
+        
+        # 字体处理
+        font = None
+        if self.font_family and os.path.exists(self.font_family):
+            try:
+                font = load_font(self.font_family, self.size)
+            except:
+                self._log(f"警告: 无法加载字体 {self.font_family}，使用系统默认字体")
+        
+        if font is None:
+            default_font = self.get_default_font()
+            if default_font and os.path.exists(default_font):
+                try:
+                    font = load_font(default_font, self.size)
+                except:
+                    pass
+        
+        if font is None:
+            try:
+                font = ImageFont.load_default()
+            except:
+                self._log("警告: 使用默认字体失败")
+
+        # 字体对象在线程间共用
+        with font_lock:
+            draw_table.text(xy=(0, 0),
+                            text=self.text_mark,
+                            fill=self.color,
+                            font=font)
+        del draw_table
+
+        mark = self.crop_image(mark)
+        return self.set_opacity(mark, self.opacity)
+
+    def gen_image_mark(self):
+        """生成图片水印"""
+        if not self.image_mark_path or not os.path.exists(self.image_mark_path):
+            raise Exception("图片水印文件不存在")
+        
+        key = None
+        mark_img = None
+        if self.stamp_cache is not None:
+            key = self.stamp_cache.key('image', self.stamp_cache.digest(self.image_mark_path),
+                                       self.image_scale, self.image_opacity)
+            mark_img = self.stamp_cache.get(key)
+        if mark_img is None:
+            mark_img = self.render_image_stamp()
+            if key is not None:
+                self.stamp_cache.put(key, mark_img)
+
+        mark_key = ('image', self.image_mark_path, os.path.getmtime(self.image_mark_path),
+                    self.image_scale, self.image_opacity)
+        return self.tile_mark(mark_img, mark_key)
+
+    def render_image_stamp(self):
+        """缩放水印图片并设置透明度，得到单个图片水印图案"""
+        # 加载水印图片
+        mark_img = Image.open(self.image_mark_path)
+        
+        # 转换为RGBA模式
+        if mark_img.mode != 'RGBA':
+            mark_img = mark_img.convert('RGBA')
+        
+        # 调整图片大小
+        scale_factor = self.image_scale / 100.0
+        new_width = int(mark_img.width * scale_factor)
+        new_height = int(mark_img.height * scale_factor)
+        mark_img = mark_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        
+        # 设置透明度
+        return self.set_opacity(mark_img, self.image_opacity / 100.0)
+
+    def tile_mark(self, mark, mark_key):
+        """生成平铺旋转水印的合成函数，水印层按尺寸缓存"""
+        def mark_im(im, mode='RGBA', path=None):
+            if self.render_mode == 'canvas':
+                c = int(math.sqrt(im.size[0] * im.size[0] + im.size[1] * im.size[1]))
+                key = ('canvas', c, self.space, self.angle, mode) + mark_key
+                offset = (int((im.size[0] - c) / 2), int((im.size[1] - c) / 2))
+            else:
+                key = ('visible', im.size, self.space, self.angle, mode) + mark_key
+                offset = (0, 0)
+
+            cache = overlay_cache if self.layer_cache is None else self.layer_cache
+            entry = cache.get(key)
+            if entry is None:
+                with self._stage(path, 'layer'):
+                    entry = render(im.size, mode)
+                cache.put(key, entry)
+            mark2, mask = entry
+
+            if im.mode != mode:
+                with self._stage(path, 'convert'):
+                    im = im.convert(mode)
+            with self._stage(path, 'paste'):
+                im.paste(mark2, offset, mask=mask)
+            return im
+
+        def render(size, mode):
+            if self.render_mode == 'canvas':
+                mark2 = render_canvas_layer(mark, self.space, self.angle, size)
+            else:
+                mark2 = render_visible_layer(mark, self.space, self.angle, size)
+            mask = mark2.getchannel('A')
+            if mode != 'RGBA':
+                # 透明处由蒙版屏蔽，直接丢弃alpha即可在目标模式上合成
+                mark2 = mark2.convert(mode)
+            return mark2, mask
+
+        mark_im.stamp = mark
+        return mark_im
+
+
+@lru_cache(maxsize=None)
+def find_default_font():
+    """获取系统默认字体，同一进程中只查找一次"""
+    system = platform.system()
+    if system == "Darwin":  # macOS
+        mac_fonts = [
+            "/System/Library/Fonts/PingFang.ttc",
+            "/System/Library/Fonts/Arial.ttf",
+            "/System/Library/Fonts/Helvetica.ttc",
+            "/Library/Fonts/Arial.ttf"
+        ]
+        for font_path in mac_fonts:
+            if os.path.exists(font_path):
+                return font_path
+    elif system == "Windows":
+        win_fonts = [
+            "C:/Windows/Fonts/simhei.ttf",
+            "C:/Windows/Fonts/msyh.ttc",
+            "C:/Windows/Fonts/arial.ttf"
+        ]
+        for font_path in win_fonts:
+            if os.path.exists(font_path):
+                return font_path
+    else:
+        linux_fonts = [
+            "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+            "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf"
+        ]
+        for font_path in linux_fonts:
+            if os.path.exists(font_path):
+                return font_path
+    return None
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""平铺旋转水印层的生成"""
+
+import math
+from PIL import Image
+
+
+def composite_mode(im, ext):
+    """合成水印时使用的图片模式
+
+    PNG 输出保留 RGBA（与原先一样，水印处的 alpha 也参与混合）；其它格式最终都是 RGB，
+    直接在 RGB 上合成，省去 RGB -> RGBA -> RGB 的两次整图转换，输出像素不变。
+    """
+    if ext == '.png':
+        return 'RGBA'
+    if ext.lower() in ('.webp', '.avif') and (im.mode in ('RGBA', 'LA', 'PA')
+                                            or 'transparency' in im.info):
+        # 转换为 WebP/AVIF 时只有原图带透明信息才保留 alpha
+        return 'RGBA'
+    return 'RGB'
+
+
+# 可见区域模式下逐块生成水印层的块大小
+RENDER_BLOCK = 512
+
+
+def paste_tiles(dest, mark, space, c, left=0, top=0):
+    """把 c×c 平铺画布中与 dest 相交的水印贴到 dest 上，dest 左上角对应画布坐标 (left, top)"""
+    step_x = mark.size[0] + space
+    step_y = mark.size[1] + space
+    right = min(left + dest.size[0], c)
+    bottom = min(top + dest.size[1], c)
+
+    idx = max(0, (top - mark.size[1]) // step_y)
+    y = idx * step_y
+    while y < bottom:
+        x = -int(step_x * 0.5 * (idx % 2))
+        x += max(0, (left - mark.size[0] - x) // step_x) * step_x
+        while x < right:
+            dest.paste(mark, (x - left, y - top))
+            x = x + step_x
+        y = y + step_y
+        idx += 1
+
+
+def rotation_matrix(angle, c):
+    """与 Image.rotate 相同的仿射矩阵：输出坐标 -> c×c 画布坐标"""
+    angle = -math.radians(angle % 360.0)
+    matrix = [round(math.cos(angle), 15), round(math.sin(angle), 15), 0.0,
+              round(-math.sin(angle), 15), round(math.cos(angle), 15), 0.0]
+    center = c / 2
+    matrix[2] = matrix[0] * -center + matrix[1] * -center + center
+    matrix[5] = matrix[3] * -center + matrix[4] * -center + center
+    return matrix
+
+
+def render_canvas_layer(mark, space, angle, size):
+    """原始方式：生成边长为图片对角线的画布后整体旋转"""
+    c = int(math.sqrt(size[0] * size[0] + size[1] * size[1]))
+    mark2 = Image.new(mode='RGBA', size=(c, c))
+    paste_tiles(mark2, mark, space, c)
+    return mark2.rotate(angle)
+
+
+def _fixed(value):
+    """Pillow 最近邻仿射变换使用的 16.16 定点数"""
+    return math.floor(value * 65536.0 + 0.5)
+
+
+def _block_offset(origin, a, b):
+    """矩阵的平移项，使 Pillow 换算出的块起点定点数正好是 origin
+
+    整张画布旋转时各像素的坐标是从画布左上角按定点数逐个累加的，块的起点直接取累加到该处的值，
+    而不是由浮点数重新舍入，这样分块的结果与整体旋转逐像素一致。
+    """
+    offset = origin / 65536.0 - a * 0.5 - b * 0.5
+    while _fixed(offset + a * 0.5 + b * 0.5) < origin:
+        offset = math.nextafter(offset, math.inf)
+    while _fixed(offset + a * 0.5 + b * 0.5) > origin:
+        offset = math.nextafter(offset, -math.inf)
+    return offset
+
+
+def render_visible_layer(mark, space, angle, size, box=None):
+    """只在图片范围内生成旋转后的水印层，与 render_canvas_layer 的可见部分逐像素一致
+
+    按 RENDER_BLOCK 分块，每块只平铺其反向旋转后覆盖的画布区域再做一次仿射变换，
+    峰值内存约为图片本身大小，而不是对角线画布的数倍。对角线不超过 32767 像素时 Pillow 用定点数计算
+    仿射变换，逐像素一致；更大的图片 Pillow 改用浮点数逐个累加，边缘可能有个别像素不同。
+    box 为图片中的区域 (left, top, right, bottom)，只生成该区域的水印层。
+    """
+    width, height = size
+    left, top, right, bottom = box or (0, 0, width, height)
+    c = int(math.sqrt(width * width + height * height))
+    ox, oy = int((width - c) / 2), int((height - c) / 2)
+    a, b, c0, d, e, f0 = rotation_matrix(angle, c)
+    fa, fb, fd, fe = _fixed(a), _fixed(b), _fixed(d), _fixed(e)
+    x0, y0 = _fixed(c0 + a * 0.5 + b * 0.5), _fixed(f0 + d * 0.5 + e * 0.5)
+
+    layer = Image.new(mode='RGBA', size=(right - left, bottom - top))
+    for by in range(top - top % RENDER_BLOCK, bottom, RENDER_BLOCK):
+        for bx in range(left - left % RENDER_BLOCK, right, RENDER_BLOCK):
+            bw = min(RENDER_BLOCK, width - bx)
+            bh = min(RENDER_BLOCK, height - by)
+            u0, v0 = bx - ox, by - oy
+
+            # 该块在旋转前画布上对应的区域
+            xs, ys = [], []
+            for u, v in ((u0, v0), (u0 + bw, v0), (u0, v0 + bh), (u0 + bw, v0 + bh)):
+                xs.append(a * u + b * v + c0)
+                ys.append(d * u + e * v + f0)
+            sx0 = max(0, math.floor(min(xs)) - 1)
+            sy0 = max(0, math.floor(min(ys)) - 1)
+            sx1 = min(c, math.ceil(max(xs)) + 1)
+            sy1 = min(c, math.ceil(max(ys)) + 1)
+            if sx0 >= sx1 or sy0 >= sy1:
+                continue
+
+            src = Image.new(mode='RGBA', size=(sx1 - sx0, sy1 - sy0))
+            paste_tiles(src, mark, space, c, sx0, sy0)
+            block = src.transform((min(bx + bw, right) - bx, min(by + bh, bottom) - by),
+                                  Image.Transform.AFFINE,
+                                  (a, b, _block_offset(x0 + u0 * fa + v0 * fb - (sx0 << 16), a, b),
+                                   d, e, _block_offset(y0 + u0 * fd + v0 * fe - (sy0 << 16), d, e)),
+                                  Image.Resampling.NEAREST)
+            if bx < left or by < top:
+                block = block.crop((max(0, left - bx), max(0, top - by), block.size[0], block.size[1]))
+            layer.paste(block, (max(bx, left) - left, max(by, top) - top))
+    return layer
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""输出目录中的处理记录，用于增量处理和中断后继续
+
+记录文件为 JSON Lines，每处理完一张图片追加一行，被强制终止时最多丢失正在写的那一行；
+正常结束时去重后整体重写（临时文件 + 重命名）。输入为文件夹时按相对于它的路径记录，
+输入和输出文件夹整体移动、或在多台机器上挂载到不同路径时记录仍然有效。
+"""
+
+import os
+import json
+import hashlib
+
+from .output import atomic_output
+
+MANIFEST_NAME = '.watermark-manifest.jsonl'
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """记录每个输出对应的输入（大小、修改时间、可选的内容哈希）和水印参数哈希"""
+
+    def __init__(self, output_dir, params, use_hash=False, name=MANIFEST_NAME, input_dir=None):
+        self.output_dir = output_dir
+        self.input_dir = input_dir
+        self.path = os.path.join(output_dir, name)
+        self.params = params
+        self.use_hash = use_hash
+        self.entries = {}
+        self._fp = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as fp:
+            for line in fp:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # 被中断时写了一半的行
+                self.entries[entry['output']] = entry
+
+    def _key(self, output):
+        return os.path.relpath(output, self.output_dir).replace(os.sep, '/')
+
+    def _source(self, source):
+        if self.input_dir:
+            path = os.path.relpath(source, self.input_dir)
+            if not path.startswith(os.pardir):
+                return path.replace(os.sep, '/')
+        return os.path.abspath(source)
+
+    def is_current(self, source, output):
+        """输出存在，且输入和水印参数都与记录一致"""
+        entry = self.entries.get(self._key(output))
+        # 以前的记录中输入为绝对路径
+        if (entry is None or entry['params'] != self.params
+                or entry['source'] not in (self._source(source), os.path.abspath(source))
+                or not os.path.exists(output)):
+            return False
+        st = os.stat(source)
+        if entry['size'] != st.st_size:
+            return False
+        if entry['mtime'] == st.st_mtime_ns:
+            return True
+        # 只是修改时间变了（例如被复制或 touch），内容相同时仍视为最新
+        return self.use_hash and entry.get('sha256') == file_digest(source)
+
+    def outputs_current(self, source, outputs):
+        """一张图片的所有输出（多个尺寸时每个尺寸一个文件）都存在，且记录与输入一致"""
+        return (self.is_current(source, outputs[0])
+                and all(os.path.exists(output) for output in outputs[1:]))
+
+    def record(self, source, output):
+        st = os.stat(source)
+        entry = {
+            'output': self._key(output),
+            'source': self._source(source),
+            'size': st.st_size,
+            'mtime': st.st_mtime_ns,
+            'params': self.params,
+        }
+        if self.use_hash:
+            entry['sha256'] = file_digest(source)
+        self.entries[entry['output']] = entry
+
+        if self._fp is None:
+            os.makedirs(self.output_dir, exist_ok=True)
+            self._fp = open(self.path, 'a', encoding='utf-8')
+        self._fp.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._fp.flush()
+
+    def close(self):
+        """去重后重写记录文件"""
+        if self._fp is None:
+            return
+        self._fp.close()
+        self._fp = None
+        self.save()
+
+    def save(self):
+        """把当前记录整体写入记录文件"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        with atomic_output(self.path) as tmp:
+            with open(tmp, 'w', encoding='utf-8') as fp:
+                for entry in self.entries.values():
+                    fp.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+def skip_current(manifest, renderer, file_paths, skipped):
+    """逐个产出需要处理的输入，已是最新的追加到 skipped 中"""
+    for image_path in file_paths:
+        if manifest.outputs_current(image_path, renderer.output_paths(image_path)):
+            skipped.append(image_path)
+        else:
+            yield image_path
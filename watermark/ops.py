@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""水印图片的像素操作，安装了 NumPy 时自动使用数组实现
+
+两种实现的结果逐像素一致：
+    set_opacity  按比例缩放 alpha 通道（截断取整，与 ImageEnhance.Brightness 相同）
+    crop_image   按 alpha 通道的非零区域裁剪
+
+合成本身仍使用 Image.paste：它在图片自身的缓冲区上原地混合，
+而 NumPy 需要先把整幅图片复制成数组、算完再复制回 Image，实测反而更慢。
+"""
+
+import importlib.util
+from PIL import Image, ImageEnhance, ImageChops
+
+# 导入 NumPy 约需 90 ms，只在第一次生成水印时导入，不拖慢程序启动
+_has_numpy = importlib.util.find_spec('numpy') is not None
+_use_numpy = _has_numpy
+_numpy = None
+
+
+def _np():
+    global _numpy
+    if _numpy is None:
+        import numpy
+        _numpy = numpy
+    return _numpy
+
+
+def use_numpy(enabled=True):
+    """切换是否使用 NumPy 实现（未安装 NumPy 时始终使用 Pillow）"""
+    global _use_numpy
+    _use_numpy = bool(enabled) and _has_numpy
+
+
+def backend():
+    return 'numpy' if _use_numpy else 'pillow'
+
+
+def set_opacity(im, opacity):
+    assert opacity >= 0 and opacity <= 1
+    if im.mode != 'RGBA':
+        im = im.convert('RGBA')
+    if _use_numpy:
+        return _set_opacity_numpy(im, opacity)
+    alpha = im.split()[3]
+    alpha = ImageEnhance.Brightness(alpha).enhance(opacity)
+    im.putalpha(alpha)
+    return im
+
+
+def _set_opacity_numpy(im, opacity):
+    numpy = _np()
+    pixels = numpy.array(im)
+    alpha = pixels[..., 3]
+    # 与 Pillow 的 blend 一样用单精度相乘后截断
+    numpy.multiply(alpha, numpy.float32(opacity), out=alpha, casting='unsafe')
+    return Image.fromarray(pixels)
+
+
+def crop_image(im):
+    if _use_numpy and im.mode == 'RGBA':
+        return _crop_image_numpy(im)
+    bg = Image.new(mode='RGBA', size=im.size)
+    diff = ImageChops.difference(im, bg)
+    del bg
+    bbox = diff.getbbox()
+    if bbox:
+        return im.crop(bbox)
+    return im
+
+
+def _crop_image_numpy(im):
+    numpy = _np()
+    alpha = numpy.asarray(im)[..., 3]
+    rows = numpy.flatnonzero(alpha.any(axis=1))
+    if not rows.size:
+        return im
+    cols = numpy.flatnonzero(alpha.any(axis=0))
+    return im.crop((int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1))
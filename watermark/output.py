@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""输出文件的写入"""
+
+import os
+import threading
+from contextlib import contextmanager
+
+
+def temp_path(path):
+    """同一目录下的临时文件名，保留扩展名以便 Pillow 按格式保存"""
+    head, name = os.path.split(path)
+    base, ext = os.path.splitext(name)
+    return os.path.join(head, f".{base}.{os.getpid()}-{threading.get_ident()}.tmp{ext}")
+
+
+@contextmanager
+def atomic_output(path):
+    """先写到临时文件，成功后再重命名为 path，中途被终止也不会留下不完整的输出"""
+    tmp = temp_path(path)
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
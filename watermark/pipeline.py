@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""解码、合成、编码分阶段并行的流水线
+
+三个阶段各有自己的线程数，阶段之间用有界队列连接：磁盘读写和 CPU 合成可以同时进行，
+同时在流水线中的图片最多为 各阶段线程数 + 队列深度 × 3 张，内存占用由此封顶。
+Pillow 在解码、编码和粘贴时会释放 GIL，所以线程即可并行。
+"""
+
+import time
+import queue
+import threading
+from PIL import Image
+
+from .animation import frame_count
+
+_STOP = object()
+
+
+class Stage:
+    """流水线中的一个阶段，统计处理数量和忙碌时间"""
+
+    def __init__(self, name, func, workers, inbox, outbox, stopped):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.inbox = inbox
+        self.outbox = outbox
+        self.stopped = stopped
+        self.items = 0
+        self.busy = 0.0
+        self._alive = self.workers
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'watermark-{self.name}-{i}',
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            item = self.inbox.get()
+            if item is _STOP:
+                # 通知同一阶段的其它线程；最后一个退出的线程把结束标记传给下一阶段
+                self.inbox.put(_STOP)
+                with self._lock:
+                    self._alive -= 1
+                    last = not self._alive
+                if last:
+                    _put(self.outbox, _STOP, None)
+                return
+            if self.stopped.is_set():
+                continue
+            start = time.perf_counter()
+            item = self.func(item)
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.items += 1
+                self.busy += elapsed
+            _put(self.outbox, item, self.stopped)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def stats(self, wall):
+        return {
+            'workers': self.workers,
+            'items': self.items,
+            'busy': self.busy,
+            'utilization': self.busy / (wall * self.workers) if wall else 0.0,
+            'avg_ms': self.busy / self.items * 1000 if self.items else 0.0,
+        }
+
+
+def _put(q, item, stopped):
+    # 停止后不再等待已满的队列，避免阻塞在下游
+    while True:
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            if stopped is not None and stopped.is_set():
+                return
+
+
+class StagedPipeline:
+    """读取 -> 合成 -> 写入 三阶段流水线，结果按输入顺序产出"""
+
+    STAGE_NAMES = {'read': '读取', 'composite': '合成', 'write': '写入'}
+
+    def __init__(self, renderer, mark, read_workers=2, composite_workers=2, write_workers=2,
+                 queue_depth=4, admission=None):
+        self.renderer = renderer
+        self.mark = mark
+        self.workers = {'read': read_workers, 'composite': composite_workers,
+                        'write': write_workers}
+        self.queue_depth = max(1, queue_depth)
+        self.admission = admission  # AdmissionScheduler，设置后按内存预算送入图片
+        self._costs = {}
+        self.stages = []
+        self.wall = 0.0
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+        if self.admission:
+            self.admission.stop()
+
+    # 每个阶段处理 (序号, 路径, 数据)；data 为 tuple 时表示已经得到最终结果，直接传递
+    def _read(self, item):
+        seq, path, _ = item
+        try:
+            im = self.renderer.read_image(path)
+            if not isinstance(im, Image.Image):
+                return seq, path, self.renderer.stream_image(path, im, self.mark)
+            return seq, path, im
+        except Exception as e:
+            return seq, path, self.renderer.error_result(path, e)
+
+    def _composite(self, item):
+        seq, path, im = item
+        if isinstance(im, tuple):
+            return item
+        try:
+            if self.renderer.renditions or frame_count(im) > 1:
+                # 多个尺寸、多帧图片在合成阶段一起合成并保存
+                return seq, path, self.renderer.process_decoded(path, im, self.mark)
+            return seq, path, self.renderer.composite_image(path, im, self.mark)
+        except Exception as e:
+            return seq, path, self.renderer.error_result(path, e)
+
+    def _write(self, item):
+        seq, path, image = item
+        if isinstance(image, tuple):
+            return item
+        try:
+            return seq, path, self.renderer.write_image(path, image)
+        except Exception as e:
+            return seq, path, self.renderer.error_result(path, e)
+
+    def _feed(self, file_paths, inbox):
+        if self.admission:
+            jobs = self.admission.admit(file_paths)
+        else:
+            jobs = ((seq, path, 0) for seq, path in enumerate(file_paths))
+        try:
+            for seq, path, cost in jobs:
+                if self._stopped.is_set():
+                    break
+                self._costs[seq] = cost
+                _put(inbox, (seq, path, None), self._stopped)
+        finally:
+            _put(inbox, _STOP, None)
+
+    def run(self, file_paths):
+        """依次产出 (图片路径, 是否成功, 日志信息)，顺序与输入一致"""
+        queues = [queue.Queue(self.queue_depth) for _ in range(3)] + [queue.Queue()]
+        funcs = [('read', self._read), ('composite', self._composite), ('write', self._write)]
+        self.stages = [Stage(name, func, self.workers[name], queues[i], queues[i + 1],
+                             self._stopped) for i, (name, func) in enumerate(funcs)]
+        start = time.perf_counter()
+        for stage in self.stages:
+            stage.start()
+        feeder = threading.Thread(target=self._feed, args=(file_paths, queues[0]),
+                                  name='watermark-feed', daemon=True)
+        feeder.start()
+
+        # 只缓存日志结果（不含图片）等待前面的图片完成
+        waiting = {}
+        next_seq = 0
+        try:
+            while not self._stopped.is_set():
+                item = queues[-1].get()
+                if item is _STOP:
+                    break
+                seq, path, result = item
+                if self.admission:
+                    # 图片离开流水线后归还预算
+                    self.admission.release(self._costs.pop(seq))
+                waiting[seq] = (path, result)
+                while next_seq in waiting:
+                    path, (ok, message) = waiting.pop(next_seq)
+                    next_seq += 1
+                    yield path, ok, message
+        finally:
+            self.stop()
+            feeder.join()
+            for stage in self.stages:
+                stage.join()
+            self.wall = time.perf_counter() - start
+
+    def stats(self):
+        return {stage.name: stage.stats(self.wall) for stage in self.stages}
+
+    def report(self):
+        """各阶段的利用率，利用率最高的阶段就是瓶颈"""
+        parts = []
+        for name, stats in self.stats().items():
+            parts.append(f"{self.STAGE_NAMES[name]} {stats['utilization'] * 100:.0f}% "
+                         f"({stats['workers']}线程, 平均 {stats['avg_ms']:.0f}ms)")
+        return "阶段利用率: " + " | ".join(parts)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""实时预览：按屏幕尺寸快速解码样图，并用同一个渲染引擎按相同比例绘制水印（近似效果）"""
+
+import os
+from contextlib import closing
+from PIL import Image, ImageOps
+
+from .archive import is_archive, open_source, scan_archive
+from .scan import scan_images
+
+PREVIEW_SIZE = (400, 400)
+
+
+def load_proxy(path, max_size=PREVIEW_SIZE):
+    """解码缩小后的样图，返回 (样图, 相对原图的缩放比例)
+
+    JPEG 用 draft() 在解码时直接按 1/2、1/4、1/8 缩小，其它格式解码后用 reduce() 整数倍缩小，
+    最后再缩放到预览尺寸以内。
+    """
+    im = Image.open(open_source(path))
+    width, height = im.size
+    # 方向为 5-8 时 exif_transpose 会交换宽高
+    if im.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+        width, height = height, width
+
+    # 请求的尺寸取预览最大边的正方形，旋转前后都不会缩得比预览还小
+    edge = max(max_size)
+    if im.format == 'JPEG':
+        im.draft(im.mode, (edge, edge))
+    im = ImageOps.exif_transpose(im)
+    factor = min(im.size[0] // max_size[0], im.size[1] // max_size[1])
+    if factor > 1:
+        if im.mode in ('1', 'P'):
+            # reduce() 不支持调色板和二值图片，与缩放输出尺寸时一样先转换为真彩色
+            im = im.convert('RGBA' if 'transparency' in im.info else 'RGB')
+        im = im.reduce(factor)
+    if im.size[0] > max_size[0] or im.size[1] > max_size[1]:
+        im.thumbnail(max_size, Image.Resampling.LANCZOS)
+    return im, im.size[0] / width
+
+
+def render_preview(renderer, path, proxy, scale):
+    """把按比例缩小的水印合成到样图上，合成方式与批处理相同
+
+    字号、间距按比例缩小后取整再生成水印，旋转也在缩小后的尺寸上取整，疏密、角度和透明度与实际输出一致，
+    但水印的位置和边缘有几个像素的出入，是近似效果，不等于把输出图片缩小。
+    """
+    preview = renderer.scaled(scale)
+    mark = preview.build_mark()
+    return preview.composite_image(path, proxy.copy(), mark)
+
+
+def first_image(input_path):
+    """输入中的第一张图片作为样图：图片文件本身、文件夹中扫描到的第一张或压缩包中的第一张
+
+    文件夹和压缩包需要读取磁盘（可能是网络存储），应在后台线程中调用。
+    """
+    if os.path.isdir(input_path):
+        paths = scan_images(input_path)
+    elif os.path.isfile(input_path):
+        if not is_archive(input_path):
+            return input_path
+        paths = scan_archive(input_path)
+    else:
+        return None
+    # 找到第一张就关闭扫描，压缩包不必读完
+    with closing(paths):
+        return next(paths, None)
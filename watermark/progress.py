@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""批处理的日志和进度输出
+
+逐条输出日志在十万张图片的批次里会让界面事件循环成为瓶颈，这里把日志按时间间隔合并后一次输出，
+进度同样按间隔更新，并附带处理速度和预计剩余时间。完整日志可同时写入文件。
+"""
+
+import time
+import threading
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+class ProgressMeter:
+    """处理速度和预计剩余时间"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.done = 0
+
+    def update(self, done):
+        self.done = done
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self, total):
+        """剩余秒数，总数未知或还没有速度时返回 None"""
+        rate = self.rate()
+        if not total or not rate:
+            return None
+        return max(0, total - self.done) / rate
+
+    def status(self, total=None):
+        text = f"{self.rate():.1f} 张/秒"
+        eta = self.eta(total)
+        if eta is not None:
+            text += f", 剩余 {format_duration(eta)}"
+        return text
+
+
+class LogSink:
+    """按时间间隔合并日志和进度，输出次数与图片数量无关"""
+
+    def __init__(self, emit_log, emit_progress=None, interval=0.25, log_path=None):
+        self.emit_log = emit_log
+        self.emit_progress = emit_progress  # emit_progress(百分比或 None, 状态文字)
+        self.interval = interval
+        self.meter = ProgressMeter()
+        self._pending = []
+        self._total = None
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+        self._file = open(log_path, 'a', encoding='utf-8') if log_path else None
+
+    def write(self, message):
+        with self._lock:
+            self._pending.append(message)
+            if self._file:
+                self._file.write(message + '\n')
+        self._maybe_flush()
+
+    def progress(self, done, total=None):
+        """已完成 done 张；total 为 None 表示总数还未确定"""
+        self.meter.update(done)
+        with self._lock:
+            self._total = total
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if time.perf_counter() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = time.perf_counter()
+            lines, self._pending = self._pending, []
+            total = self._total
+        if lines:
+            self.emit_log("\n".join(lines))
+        if self.emit_progress:
+            percent = min(100, int(self.meter.done / total * 100)) if total else None
+            self.emit_progress(percent, self.meter.status(total))
+
+    def close(self):
+        self.flush()
+        if self._file:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""一次解码输出多个尺寸"""
+
+from .encode import output_extension
+
+
+class Rendition:
+    """一种输出尺寸：最长边、格式、质量和文件名后缀"""
+
+    def __init__(self, max_edge=None, output_format=None, quality=None, suffix=None):
+        self.max_edge = max_edge or None  # None 表示原图尺寸
+        self.output_format = output_format or None  # None 表示使用渲染器的输出格式
+        self.quality = quality
+        if suffix is None:
+            suffix = f"_{max_edge}" if max_edge else ''
+        self.suffix = suffix
+        if self.output_format:
+            output_extension(self.output_format)  # 校验格式是否可用
+
+    @classmethod
+    def parse(cls, spec):
+        """解析 "最长边[:格式[:质量[:后缀]]]"，最长边为 full 或 0 表示原图，例如 "1024:webp:75:_m" """
+        parts = spec.strip().split(':')
+        if len(parts) > 4 or not parts[0]:
+            raise ValueError(f"无效的输出尺寸: {spec}")
+        try:
+            max_edge = 0 if parts[0].lower() == 'full' else int(parts[0])
+            quality = int(parts[2]) if len(parts) > 2 and parts[2] else None
+        except ValueError:
+            raise ValueError(f"无效的输出尺寸: {spec}")
+        output_format = parts[1].lower() if len(parts) > 1 and parts[1] else None
+        suffix = parts[3] if len(parts) > 3 else None
+        return cls(max_edge, output_format, quality, suffix)
+
+    def key(self):
+        return (self.max_edge, self.output_format, self.quality, self.suffix)
+
+    def fit(self, size):
+        """缩放到最长边不超过 max_edge 后的尺寸，不放大"""
+        width, height = size
+        if not self.max_edge or max(size) <= self.max_edge:
+            return size
+        scale = self.max_edge / max(size)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def parse_renditions(specs):
+    """解析多个尺寸规格，按最长边从大到小排序（原图在前）"""
+    renditions = [Rendition.parse(spec) for spec in specs if spec.strip()]
+    suffixes = [(r.suffix, r.output_format) for r in renditions]
+    if len(set(suffixes)) != len(suffixes):
+        raise ValueError("多个输出尺寸的文件名后缀和格式相同，会互相覆盖")
+    return sorted(renditions, key=lambda r: -(r.max_edge or float('inf')))
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""输入图片的扫描"""
+
+import os
+import queue
+import fnmatch
+import threading
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff')
+
+
+def _match(rel_path, patterns):
+    rel_path = rel_path.lower()
+    name = rel_path.rsplit('/', 1)[-1]
+    for pattern in patterns:
+        pattern = pattern.lower()
+        if fnmatch.fnmatchcase(rel_path, pattern) or fnmatch.fnmatchcase(name, pattern):
+            return True
+    return False
+
+
+def scan_images(input_path, recursive=True, include=None, exclude=None, skip_dirs=()):
+    """用 os.scandir 逐个产出输入文件或文件夹中的图片路径
+
+    include/exclude 为 fnmatch 通配符，与相对路径（'/' 分隔）或文件名匹配即生效；
+    exclude 匹配到的文件夹不会再进入。skip_dirs 中的文件夹（例如位于输入目录内的输出目录）也会跳过。
+    """
+    if os.path.isfile(input_path):
+        yield input_path
+        return
+
+    skip_dirs = {os.path.realpath(path) for path in skip_dirs if path}
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            entries = os.scandir(os.path.join(input_path, rel_dir))
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if exclude and _match(rel_path, exclude):
+                    continue
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                if is_dir:
+                    if recursive and os.path.realpath(entry.path) not in skip_dirs:
+                        stack.append(rel_path)
+                    continue
+                if not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                if include and not _match(rel_path, include):
+                    continue
+                yield entry.path
+
+
+def list_images(input_path):
+    """返回输入文件或文件夹中（不含子文件夹）的图片路径列表"""
+    return list(scan_images(input_path, recursive=False))
+
+
+class BackgroundScanner:
+    """在后台线程中运行扫描，通过有界队列把找到的文件交给处理端
+
+    处理端迭代本对象即可，第一个文件被找到后马上就能开始处理；
+    队列满时扫描线程等待，内存占用与输入数量无关。
+    """
+
+    _DONE = object()
+
+    def __init__(self, paths, maxsize=1024):
+        self._paths = paths
+        self._queue = queue.Queue(maxsize)
+        self._stopped = threading.Event()
+        self._error = None
+        self.found = 0
+        self.finished = False
+
+    def _run(self):
+        try:
+            for path in self._paths:
+                self.found += 1
+                while not self._put(path):
+                    if self._stopped.is_set():
+                        return
+        except Exception as e:
+            self._error = e
+        finally:
+            self.finished = True
+            while not self._put(self._DONE) and not self._stopped.is_set():
+                pass
+
+    def _put(self, item):
+        try:
+            self._queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            return False
+
+    def __iter__(self):
+        thread = threading.Thread(target=self._run, name='watermark-scan', daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is self._DONE:
+                    break
+                yield item
+            if self._error is not None:
+                raise self._error
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""本地 HTTP 水印服务: python -m watermark.server
+
+工作者（进程或线程）常驻，启动时加载全部预设并生成水印，之后每个请求只需解码、合成和编码，
+各工作者中的水印层缓存一直有效。超过工作者数 + 队列长度的请求直接返回 503，而不是无限排队。
+
+    POST /watermark/<预设名>[?format=webp]   请求体为图片数据，返回加好水印的图片
+    GET  /presets                            预设列表
+    GET  /metrics                            请求数、排队情况、延迟分位数和缓存命中率
+    GET  /health
+
+预设使用与命令行相同的参数，例如:
+
+    python -m watermark.server --preset default="-t 版权所有" --preset logo="-i logo.png --image-scale 50"
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import signal
+import shlex
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from PIL import Image
+
+from .batch import warm_pool, worker_barrier
+from .cache import overlay_cache
+from .cli import build_parser, build_renderer
+from .encode import OUTPUT_FORMATS
+from .timing import percentile
+
+# 工作者中已加载的预设: 名称 -> (渲染器, 水印)
+_presets = {}
+_presets_lock = threading.Lock()
+# 预热用的屏障，见 WatermarkService.warm
+_ready = None
+
+
+def _init_worker(renderers, ready=None):
+    global _ready
+    _ready = ready
+    overlay_cache.resize(max(r.cache_bytes for r in renderers.values()))
+    with _presets_lock:
+        for name, renderer in renderers.items():
+            if name not in _presets:
+                _presets[name] = (renderer, renderer.build_mark())
+
+
+def _init_process_worker(renderers, ready=None):
+    # Ctrl+C 由主进程处理，工作进程不各自抛出 KeyboardInterrupt
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _init_worker(renderers, ready)
+
+
+def _wait_ready():
+    _ready.wait()
+    return os.getpid()
+
+
+def _render(name, data, output_format):
+    renderer, mark = _presets[name]
+    start = time.perf_counter()
+    result = renderer.process_bytes(data, mark, output_format)
+    return result, time.perf_counter() - start, os.getpid(), overlay_cache.stats()
+
+
+class ServiceBusy(Exception):
+    """排队的请求已满"""
+
+
+def load_presets(specs, presets_file=None):
+    """解析预设，返回 {名称: 渲染器}；参数无效时抛出 ValueError"""
+    items = []
+    if presets_file:
+        with open(presets_file, encoding='utf-8') as f:
+            items += list(json.load(f).items())
+    for spec in specs or ():
+        name, sep, value = spec.partition('=')
+        if not sep or not name:
+            raise ValueError(f"无效的预设: {spec}，格式为 名称=参数")
+        items.append((name, value))
+
+    parser = build_parser()
+    renderers = {}
+    for name, value in items:
+        argv = shlex.split(value) if isinstance(value, str) else list(value)
+        try:
+            args = parser.parse_args(['-'] + argv)
+        except SystemExit:
+            raise ValueError(f"预设 {name} 的参数无效: {value}")
+        if args.image and not os.path.exists(args.image):
+            raise ValueError(f"预设 {name} 的水印图片不存在: {args.image}")
+        renderers[name] = build_renderer(args, _preset_log(name))
+    return renderers
+
+
+def _preset_log(name):
+    return lambda message: print(f"[{name}] {message}", file=sys.stderr)
+
+
+class WatermarkService:
+    """常驻工作者池，限制排队数量并统计延迟和缓存命中率"""
+
+    def __init__(self, renderers, workers=1, backend='process', queue_size=16, window=1000):
+        self.renderers = renderers
+        self.workers = max(1, workers)
+        self.backend = backend
+        self.capacity = self.workers + max(0, queue_size)
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._ready = worker_barrier(backend, self.workers)
+        if backend == 'process':
+            self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                            initializer=_init_process_worker,
+                                            initargs=(renderers, self._ready))
+        else:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                           initargs=(renderers, self._ready))
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)  # 含排队时间
+        self._render_times = deque(maxlen=window)  # 工作者中的处理时间
+        self._cache_stats = {}  # 工作者 pid -> 最近一次的缓存统计
+        self.counts = {'requests': 0, 'ok': 0, 'errors': 0, 'rejected': 0}
+        self.preset_counts = {name: 0 for name in renderers}
+        self.in_flight = 0
+
+    def warm(self):
+        """启动全部工作者并加载预设，第一个请求不必等待"""
+        warm_pool(self.pool, self.workers, self._ready, _wait_ready)
+
+    def process(self, name, data, output_format=None):
+        """处理一张图片，返回编码后的 bytes；队列已满时抛出 ServiceBusy"""
+        with self._lock:
+            self.counts['requests'] += 1
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.counts['rejected'] += 1
+            raise ServiceBusy()
+
+        start = time.perf_counter()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            result, render_time, pid, stats = self.pool.submit(
+                _render, name, data, output_format).result()
+        except Exception:
+            with self._lock:
+                self.counts['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+        with self._lock:
+            self.counts['ok'] += 1
+            self.preset_counts[name] += 1
+            self._latencies.append((time.perf_counter() - start) * 1000)
+            self._render_times.append(render_time * 1000)
+            self._cache_stats[pid] = stats
+        return result
+
+    def metrics(self):
+        with self._lock:
+            latencies = list(self._latencies)
+            render_times = list(self._render_times)
+            cache_stats = list(self._cache_stats.values())
+            counts = dict(self.counts)
+            preset_counts = dict(self.preset_counts)
+            in_flight = self.in_flight
+
+        hits = sum(s['hits'] for s in cache_stats)
+        misses = sum(s['misses'] for s in cache_stats)
+        return dict(counts, **{
+            'uptime_s': round(time.time() - self.started, 1),
+            'workers': self.workers,
+            'backend': self.backend,
+            'capacity': self.capacity,
+            'in_flight': in_flight,
+            'queued': max(0, in_flight - self.workers),
+            'presets': preset_counts,
+            'latency_ms': _summary(latencies),
+            'render_ms': _summary(render_times),
+            'cache': {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else None,
+                'evictions': sum(s['evictions'] for s in cache_stats),
+                'entries': sum(s['entries'] for s in cache_stats),
+                'bytes': sum(s['bytes'] for s in cache_stats),
+            },
+        })
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _summary(values):
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else None,
+    }
+
+
+class WatermarkHandler(BaseHTTPRequestHandler):
+    server_version = 'watermark'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+        self.send_body(status, body, 'application/json; charset=utf-8', headers)
+
+    def send_error_json(self, status, message, headers=None):
+        self.send_json(status, {'error': message}, headers)
+
+    def do_GET(self):
+        service = self.server.service
+        path = urlsplit(self.path).path
+        if path == '/metrics':
+            self.send_json(200, service.metrics())
+        elif path == '/presets':
+            self.send_json(200, sorted(service.renderers))
+        elif path == '/health':
+            self.send_body(200, b'ok', 'text/plain')
+        else:
+            self.send_error_json(404, '未知的地址')
+
+    def do_POST(self):
+        service = self.server.service
+        url = urlsplit(self.path)
+        prefix = '/watermark/'
+        if not url.path.startswith(prefix):
+            self.send_error_json(404, '未知的地址')
+            return
+        name = unquote(url.path[len(prefix):])
+        if name not in service.renderers:
+            self.send_error_json(404, f"未知的预设: {name}")
+            return
+        output_format = parse_qs(url.query).get('format', [None])[0]
+        if output_format and output_format not in OUTPUT_FORMATS:
+            self.send_error_json(400, f"不支持的输出格式: {output_format}")
+            return
+
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self.send_error_json(411, '缺少 Content-Length')
+            return
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_error_json(400, f"Content-Length 无效: {self.headers.get('Content-Length')}")
+            return
+        if length > self.server.max_bytes:
+            self.send_error_json(413, '图片太大')
+            return
+        data = self.rfile.read(length)
+
+        try:
+            result = service.process(name, data, output_format)
+        except ServiceBusy:
+            self.send_error_json(503, '服务繁忙，请稍后重试', {'Retry-After': '1'})
+            return
+        except Exception as e:
+            self.send_error_json(400, f"处理失败: {str(e)}")
+            return
+
+        fmt = Image.open(io.BytesIO(result)).format
+        self.send_body(200, result, Image.MIME.get(fmt, 'application/octet-stream'))
+
+
+def build_server_parser():
+    parser = argparse.ArgumentParser(prog='python -m watermark.server',
+                                     description='本地 HTTP 水印服务，工作者常驻并预先加载水印')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址 (默认: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8000, help='端口 (默认: 8000)')
+    parser.add_argument('--preset', action='append', metavar='NAME=ARGS',
+                        help='水印预设，ARGS 与命令行参数相同，可重复指定')
+    parser.add_argument('--presets', metavar='FILE',
+                        help='JSON 预设文件: {"名称": "命令行参数"}')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1,
+                        help='工作者数 (默认: CPU核数)')
+    parser.add_argument('--backend', choices=('process', 'thread'), default='process',
+                        help='工作者类型 (默认: process)')
+    parser.add_argument('--queue-size', type=int, default=16,
+                        help='工作者都忙时最多排队的请求数，超过后返回 503 (默认: 16)')
+    parser.add_argument('--max-mb', type=int, default=50, help='单个请求的最大体积 MB (默认: 50)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='输出每个请求的访问日志')
+    return parser
+
+
+def main(argv=None):
+    args = build_server_parser().parse_args(argv)
+    try:
+        renderers = load_presets(args.preset, args.presets)
+    except (ValueError, OSError) as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    if not renderers:
+        print("至少需要一个预设，例如 --preset default=\"-t 版权所有\"", file=sys.stderr)
+        return 2
+
+    service = WatermarkService(renderers, args.workers, args.backend, args.queue_size)
+    try:
+        service.warm()
+    except Exception as e:
+        print(f"加载预设失败: {str(e)}", file=sys.stderr)
+        service.close()
+        return 2
+
+    server = ThreadingHTTPServer((args.host, args.port), WatermarkHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.verbose = args.verbose
+    server.max_bytes = args.max_mb * 1024 * 1024
+    print(f"水印服务已启动: http://{args.host}:{server.server_address[1]}  "
+          f"预设: {', '.join(sorted(renderers))}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""多台机器分片处理同一批图片
+
+每个输入按相对于输入根目录的路径计算稳定的哈希，分到 N 个分片之一，各节点只需指定 --shard i/N，
+不需要协调者；共享文件系统上各节点的挂载位置不同也不影响分配。每个分片在输出目录中写自己的
+处理记录和统计文件，互不冲突；全部完成后由合并步骤逐个核对输入的输出，合并处理记录并汇总吞吐量。
+"""
+
+import os
+import re
+import json
+import time
+import socket
+import hashlib
+
+from .archive import content_size
+from .dedup import _cpu_seconds
+from .manifest import Manifest
+from .output import atomic_output
+
+_STATS_PATTERN = re.compile(r'^\.watermark-shard-(\d+)-of-(\d+)\.json$')
+
+
+def parse_shard(spec):
+    """解析 'i/N'（i 从 1 开始），返回 (i, N)"""
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"分片格式应为 i/N，例如 1/4: {spec}")
+    if count < 1:
+        raise ValueError(f"分片数应至少为 1: {spec}")
+    if not 1 <= index <= count:
+        raise ValueError(f"分片序号应在 1 到 {count} 之间: {spec}")
+    return index, count
+
+
+def shard_index(key, count):
+    """相对路径所属的分片（从 1 开始）；不使用 hash()，各进程、各机器结果相同"""
+    digest = hashlib.sha256(key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count + 1
+
+
+def relative_key(path, root):
+    """分片使用的键：相对于输入文件夹（或压缩包）的路径，以 '/' 分隔"""
+    # 输入为单个文件时就是它自己
+    if root and str(path) != root:
+        rel = os.path.relpath(path, root)
+        if not rel.startswith(os.pardir):
+            return rel.replace(os.sep, '/')
+    return os.path.basename(path)
+
+
+def stats_name(index, count):
+    return f'.watermark-shard-{index}-of-{count}.json'
+
+
+def manifest_name(index, count):
+    return f'.watermark-manifest.shard-{index}-of-{count}.jsonl'
+
+
+class Shard:
+    """一个分片：从输入中挑出属于自己的文件"""
+
+    def __init__(self, index, count, root):
+        self.index = index
+        self.count = count
+        self.root = root
+        self.assigned = 0
+
+    def owns(self, path):
+        return shard_index(relative_key(path, self.root), self.count) == self.index
+
+    def select(self, file_paths):
+        for path in file_paths:
+            if self.owns(path):
+                self.assigned += 1
+                yield path
+
+    @property
+    def manifest_name(self):
+        return manifest_name(self.index, self.count)
+
+
+class ShardRun:
+    """一个分片一次运行的统计，结束（包括中断）时写入输出目录"""
+
+    def __init__(self, shard, renderer, input_path):
+        self.shard = shard
+        self.renderer = renderer
+        self.input_path = os.path.abspath(input_path)
+        self.started = time.time()
+        self._cpu = _cpu_seconds()
+        self.processed = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.failed = []
+
+    def record(self, image_path, ok):
+        self.processed += 1
+        if not ok:
+            self.errors += 1
+            self.failed.append(relative_key(image_path, self.shard.root))
+            return
+        try:
+            self.bytes_in += content_size(image_path)
+            self.bytes_out += sum(os.path.getsize(path)
+                                  for path in self.renderer.output_paths(image_path))
+        except OSError:
+            pass
+
+    def save(self, skipped=0, completed=False):
+        finished = time.time()
+        stats = {
+            'shard': self.shard.index,
+            'count': self.shard.count,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'input': self.input_path,
+            'params': self.renderer.params_hash(),
+            'started': self.started,
+            'finished': finished,
+            'elapsed': finished - self.started,
+            'cpu': _cpu_seconds() - self._cpu,
+            'assigned': self.shard.assigned,
+            'processed': self.processed,
+            'skipped': skipped,
+            'errors': self.errors,
+            'failed': self.failed,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'completed': completed,
+        }
+        output_dir = self.renderer.output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        with atomic_output(os.path.join(output_dir, stats_name(self.shard.index,
+                                                               self.shard.count))) as tmp:
+            with open(tmp, 'w', encoding='utf-8') as fp:
+                json.dump(stats, fp, ensure_ascii=False, indent=2)
+
+
+def load_stats(output_dir):
+    """读取输出目录中所有分片的统计：{(分片数, 序号): 统计}"""
+    found = {}
+    try:
+        names = os.listdir(output_dir)
+    except OSError:
+        return found
+    for name in names:
+        match = _STATS_PATTERN.match(name)
+        if not match:
+            continue
+        try:
+            with open(os.path.join(output_dir, name), encoding='utf-8') as fp:
+                stats = json.load(fp)
+        except (OSError, ValueError):
+            continue
+        found[int(match.group(2)), int(match.group(1))] = stats
+    return found
+
+
+def merge_shards(renderer, file_paths, root, log=print):
+    """核对每个输入都已由所属分片处理为最新，合并各分片的处理记录并汇总吞吐量；完整时返回 True"""
+    output_dir = renderer.output_dir
+    found = load_stats(output_dir)
+    counts = sorted({count for count, _ in found})
+    if not counts:
+        log("输出文件夹中没有分片统计，请先用 --shard i/N 处理")
+        return False
+    if len(counts) > 1:
+        log(f"输出文件夹中有不同分片数的统计: {', '.join(map(str, counts))}，请删除旧的统计文件")
+        return False
+    count = counts[0]
+    params = renderer.params_hash()
+    complete = True
+
+    shards = {}
+    for index in range(1, count + 1):
+        stats = found.get((count, index))
+        if stats is None:
+            log(f"分片 {index}/{count}: 没有统计文件，可能还没有运行")
+            complete = False
+            continue
+        shards[index] = stats
+        if stats['params'] != params:
+            log(f"分片 {index}/{count}: 水印参数与本次不同")
+            complete = False
+        elif not stats['completed']:
+            log(f"分片 {index}/{count}: 没有正常结束（{stats['host']}）")
+            complete = False
+        elif stats['errors']:
+            log(f"分片 {index}/{count}: 失败 {stats['errors']} 张，"
+                f"例如 {', '.join(stats['failed'][:3])}")
+            complete = False
+
+    manifests = {index: Manifest(output_dir, params, name=manifest_name(index, count),
+                                 input_dir=renderer.input_dir)
+                 for index in range(1, count + 1)}
+    total = 0
+    missing = {}
+    for path in file_paths:
+        total += 1
+        index = shard_index(relative_key(path, root), count)
+        if not manifests[index].outputs_current(path, renderer.output_paths(path)):
+            missing.setdefault(index, []).append(relative_key(path, root))
+    for index, paths in sorted(missing.items()):
+        log(f"分片 {index}/{count}: 缺少或过期 {len(paths)} 张，例如 {', '.join(paths[:3])}")
+        complete = False
+
+    # 合并后的处理记录供以后不分片的增量处理使用
+    merged = Manifest(output_dir, params, input_dir=renderer.input_dir)
+    for manifest in manifests.values():
+        merged.entries.update(manifest.entries)
+    merged.save()
+
+    if shards:
+        log(_throughput_report(shards, count))
+    state = "完整" if complete else "不完整"
+    log(f"合并{state}: 输入 {total} 张，缺少 {sum(map(len, missing.values()))} 张，"
+        f"处理记录 {len(merged.entries)} 条")
+    return complete
+
+
+def _throughput_report(shards, count):
+    lines = []
+    for index, stats in sorted(shards.items()):
+        rate = stats['processed'] / stats['elapsed'] if stats['elapsed'] else 0.0
+        lines.append(f"  分片 {index}/{count} {stats['host']}: 处理 {stats['processed']} 张，"
+                     f"跳过 {stats['skipped']}，失败 {stats['errors']}，"
+                     f"{stats['elapsed']:.1f} 秒，{rate:.1f} 张/秒，CPU {stats['cpu']:.1f} 秒")
+    values = list(shards.values())
+    processed = sum(stats['processed'] for stats in values)
+    wall = max(stats['finished'] for stats in values) - min(stats['started'] for stats in values)
+    elapsed = [stats['elapsed'] for stats in values]
+    mean = sum(elapsed) / len(elapsed)
+    megabytes = sum(stats['bytes_in'] + stats['bytes_out'] for stats in values) / 1024 / 1024
+    rate = processed / wall if wall else 0.0
+    lines.insert(0, f"分片吞吐量: 共 {processed} 张，墙钟 {wall:.1f} 秒，{rate:.1f} 张/秒，"
+                    f"读写 {megabytes / wall if wall else 0.0:.1f} MB/秒，"
+                    f"CPU 合计 {sum(stats['cpu'] for stats in values):.1f} 秒，"
+                    f"最慢分片用时为平均的 {max(elapsed) / mean if mean else 1.0:.2f} 倍")
+    return '\n'.join(lines)
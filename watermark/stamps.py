@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""跨运行复用的水印图案缓存
+
+加载大型 CJK 字体（如 PingFang.ttc、simhei.ttf）要几百毫秒，每次运行还要重新绘制文字、裁剪、
+调整透明度或缩放水印图片。生成好的水印图案按内容寻址保存在磁盘上：键由文字、字体文件哈希、
+字号、颜色、透明度（或水印图片哈希、缩放比例）等计算，参数相同的下一次运行直接读取。
+缓存目录超过大小上限时删除最久未使用的文件。
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageFont
+
+from .output import atomic_output
+from .manifest import file_digest
+
+DEFAULT_MAX_MB = 64
+MEMORY_ENTRIES = 32
+INDEX_NAME = 'files.json'
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'watermark', 'stamps')
+
+
+# 同一进程中按 (路径, 字号) 复用已加载的字体；FreeType 字体对象不是线程安全的，绘制时需持有 font_lock
+_fonts = {}
+font_lock = threading.RLock()
+
+
+def load_font(path, size):
+    """加载 TrueType 字体，同一进程中只加载一次"""
+    key = (path, size)
+    with font_lock:
+        font = _fonts.get(key)
+        if font is None:
+            font = _fonts[key] = ImageFont.truetype(path, size=size)
+        return font
+
+
+class StampCache:
+    """磁盘上的水印图案缓存，加一层进程内的小缓存"""
+
+    def __init__(self, cache_dir=None, max_mb=DEFAULT_MAX_MB):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._digests = None  # 文件路径 -> [大小, 修改时间, 哈希]，避免每次运行都读完整个字体文件
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # 进程池的工作者各自从磁盘读取
+        state = self.__dict__.copy()
+        state['_memory'] = OrderedDict()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def digest(self, path):
+        """文件内容的哈希；大小和修改时间不变时使用上次记录的结果"""
+        with self._lock:
+            if self._digests is None:
+                try:
+                    with open(os.path.join(self.cache_dir, INDEX_NAME), encoding='utf-8') as f:
+                        self._digests = json.load(f)
+                except (OSError, ValueError):
+                    self._digests = {}
+            path = os.path.abspath(path)
+            st = os.stat(path)
+            record = self._digests.get(path)
+            if record and record[:2] == [st.st_size, st.st_mtime_ns]:
+                return record[2]
+            digest = file_digest(path)
+            self._digests[path] = [st.st_size, st.st_mtime_ns, digest]
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with atomic_output(os.path.join(self.cache_dir, INDEX_NAME)) as new_name:
+                    with open(new_name, 'w', encoding='utf-8') as f:
+                        json.dump(self._digests, f, ensure_ascii=False)
+            except OSError:
+                pass
+            return digest
+
+    def key(self, *params):
+        """由影响水印图案的参数计算缓存键"""
+        params = (Image.__version__,) + params
+        return hashlib.sha256(json.dumps(params, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.png')
+
+    def get(self, key):
+        """返回缓存的水印图案（RGBA），没有时返回 None"""
+        with self._lock:
+            stamp = self._memory.get(key)
+            if stamp is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return stamp.copy()
+        path = self._path(key)
+        try:
+            with Image.open(path) as im:
+                im.load()
+                stamp = im if im.mode == 'RGBA' else im.convert('RGBA')
+            os.utime(path)  # 修改时间作为最近使用时间，淘汰时参考
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        self._remember(key, stamp)
+        return stamp.copy()
+
+    def put(self, key, stamp):
+        self._remember(key, stamp.copy())
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with atomic_output(self._path(key)) as new_name:
+                stamp.save(new_name, format='PNG', compress_level=1)
+            self.evict()
+        except OSError:
+            # 缓存目录不可写时只是不缓存
+            pass
+
+    def _remember(self, key, stamp):
+        with self._lock:
+            self._memory[key] = stamp
+            self._memory.move_to_end(key)
+            while len(self._memory) > MEMORY_ENTRIES:
+                self._memory.popitem(last=False)
+
+    def evict(self):
+        """目录总大小超过上限时删除最久未使用的图案"""
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                # 以 . 开头的是其它进程正在写入的临时文件
+                if entry.name.endswith('.png') and not entry.name.startswith('.') and entry.is_file():
+                    st = entry.stat()
+                    entries.append((st.st_mtime_ns, st.st_size, entry.path))
+                    total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.png') or name == INDEX_NAME:
+                    os.remove(os.path.join(self.cache_dir, name))
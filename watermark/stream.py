@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""超大图片的分带流式处理
+
+按水平条带读取、添加水印并写出图片，整张图片不会同时出现在内存中。
+
+支持的输入:
+    - PNG: 8 位深度、非隔行扫描（灰度、RGB、调色板、灰度+透明、RGBA）、无旋转方向标记
+    - TIFF: 按条带存储(strip)、像素交错(PlanarConfiguration=1)、无旋转方向标记；
+      未压缩的TIFF可以在任意行切分，压缩的TIFF按条带边界切分
+支持的输出: PNG（无滤波 + zlib 压缩）和未压缩的 TIFF（每个条带一个 strip）
+
+内存上限:
+    峰值 RSS ≈ 解释器和 Pillow 本身 (约 30 MB)
+             + 条带行数 × 图片宽度 × BYTES_PER_PIXEL
+             + 一个压缩 TIFF 条带的解码数据（按条带切分时）
+    条带行数由 memory_bytes 决定: rows = memory_bytes // (宽度 × BYTES_PER_PIXEL)，至少 1 行。
+    例如 20000×20000 的 PNG 在默认 64 MB 预算下每次处理约 130 行，总 RSS 约 100 MB。
+    canvas 渲染模式下还要加上整张对角线画布（边长² × 4 字节），各条带从中裁剪水印层。
+"""
+
+import io
+import os
+import struct
+import zlib
+from PIL import Image, TiffImagePlugin, TiffTags
+
+from .layer import RENDER_BLOCK, composite_mode, render_canvas_layer, render_visible_layer
+
+# 每个像素在一个条带中同时存在的字节数估计：
+# 原始数据 + 解码后的条带 + RGBA 副本 + 水印层(RGBA) + 蒙版 + 输出转换 + 编码缓冲
+BYTES_PER_PIXEL = 24
+
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# 可能带有方向信息的 PNG 块：eXIf、以及文本块中的 Raw profile type exif 和 XMP
+PNG_METADATA_CHUNKS = (b'eXIf', b'tEXt', b'zTXt', b'iTXt')
+
+# 以 TIFF 条带为单位重新封装时需要保留的结构性标签
+TIFF_COPY_TAGS = (258, 259, 262, 266, 277, 284, 317, 320, 338, 339, 347, 529, 530, 532)
+
+
+def band_rows(width, memory_bytes=DEFAULT_MEMORY_BYTES):
+    return max(1, int(memory_bytes // (width * BYTES_PER_PIXEL)))
+
+
+def _png_chunk(chunk_type, data):
+    chunk = chunk_type + data
+    return struct.pack('>I', len(data)) + chunk + struct.pack('>I', zlib.crc32(chunk) & 0xffffffff)
+
+
+class PngStripReader:
+    """逐条带解码 PNG
+
+    IDAT 数据用 zlib 流式解压；每个条带的滤波行连同上一条带的最后一行
+    （无滤波）重新封装成一个小 PNG 交给 Pillow 解码，反滤波仍由 Pillow 的 C 代码完成。
+    带旋转方向的 PNG 不流式处理，交给整图处理时的 exif_transpose。
+    """
+
+    CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+    def __init__(self, path):
+        self.fp = open(path, 'rb')
+        if self.fp.read(8) != PNG_SIGNATURE:
+            self.fp.close()
+            raise ValueError("不是 PNG 文件")
+        self.ancillary = []
+        metadata = []
+        self._idat_left = 0
+        while True:
+            length, chunk_type = struct.unpack('>I4s', self.fp.read(8))
+            if chunk_type == b'IDAT':
+                self._idat_left = length
+                break
+            data = self.fp.read(length)
+            self.fp.read(4)
+            if chunk_type in PNG_METADATA_CHUNKS:
+                metadata.append(_png_chunk(chunk_type, data))
+            elif chunk_type == b'IHDR':
+                self.ihdr = data
+                (width, height, self.bit_depth, self.color_type,
+                 _, _, self.interlace) = struct.unpack('>IIBBBBB', data)
+                self.size = (width, height)
+            elif chunk_type in (b'PLTE', b'tRNS'):
+                self.ancillary.append(_png_chunk(chunk_type, data))
+            elif chunk_type == b'IEND':
+                raise ValueError("PNG 文件没有图像数据")
+        if self.bit_depth != 8 or self.interlace or self.color_type not in self.CHANNELS:
+            self.fp.close()
+            raise ValueError("流式模式只支持 8 位非隔行扫描的 PNG")
+        try:
+            metadata += self._trailing_metadata()
+            orientation = self._orientation(metadata)
+        except Exception:
+            self.fp.close()
+            raise ValueError("无法读取 PNG 的元数据")
+        if orientation != 1:
+            self.fp.close()
+            raise ValueError("流式模式不支持带旋转方向标记的 PNG")
+        self.stride = self.size[0] * self.CHANNELS[self.color_type]
+        self._zlib = zlib.decompressobj()
+        self._pending = bytearray()
+        self._last_row = None
+        self.y = 0
+
+    def _trailing_metadata(self):
+        """图像数据之后的元数据块（eXIf 也可以位于 IDAT 之后），只读取块头，跳过图像数据"""
+        start = self.fp.tell()
+        chunks = []
+        self.fp.seek(self._idat_left + 4, io.SEEK_CUR)
+        while True:
+            header = self.fp.read(8)
+            if len(header) < 8:
+                break
+            length, chunk_type = struct.unpack('>I4s', header)
+            if chunk_type == b'IEND':
+                break
+            if chunk_type in PNG_METADATA_CHUNKS:
+                chunks.append(_png_chunk(chunk_type, self.fp.read(length)))
+                self.fp.seek(4, io.SEEK_CUR)
+            else:
+                self.fp.seek(length + 4, io.SEEK_CUR)
+        self.fp.seek(start)
+        return chunks
+
+    def _orientation(self, metadata):
+        """用元数据块和一个像素封装成小 PNG，由 Pillow 按与 exif_transpose 相同的规则取得方向"""
+        if not metadata:
+            return 1
+        ihdr = struct.pack('>IIBBBBB', 1, 1, 8, self.color_type, 0, 0, 0)
+        row = bytes(1 + self.CHANNELS[self.color_type])
+        data = (PNG_SIGNATURE + _png_chunk(b'IHDR', ihdr) + b''.join(self.ancillary) +
+                b''.join(metadata) + _png_chunk(b'IDAT', zlib.compress(row)) +
+                _png_chunk(b'IEND', b''))
+        with Image.open(io.BytesIO(data)) as im:
+            im.load()
+            return im.getexif().get(274, 1)
+
+    def _feed(self, need):
+        while len(self._pending) < need:
+            if self._zlib.unconsumed_tail:
+                data = self._zlib.unconsumed_tail
+            elif self._idat_left:
+                data = self.fp.read(min(self._idat_left, 1 << 16))
+                self._idat_left -= len(data)
+                if not self._idat_left:
+                    self.fp.read(4)
+                    length, chunk_type = struct.unpack('>I4s', self.fp.read(8))
+                    if chunk_type == b'IDAT':
+                        self._idat_left = length
+            else:
+                raise ValueError("PNG 图像数据不完整")
+            self._pending += self._zlib.decompress(data, need - len(self._pending))
+
+    def read(self, rows):
+        rows = min(rows, self.size[1] - self.y)
+        need = rows * (self.stride + 1)
+        self._feed(need)
+        filtered = bytes(self._pending[:need])
+        del self._pending[:need]
+
+        # 上一行作为无滤波的上下文行，保证 Up/Average/Paeth 滤波能正确还原
+        if self._last_row is not None:
+            filtered = b'\x00' + self._last_row + filtered
+            height = rows + 1
+        else:
+            height = rows
+        ihdr = struct.pack('>IIBBBBB', self.size[0], height, 8, self.color_type, 0, 0, 0)
+        data = (PNG_SIGNATURE + _png_chunk(b'IHDR', ihdr) + b''.join(self.ancillary) +
+                _png_chunk(b'IDAT', zlib.compress(filtered, 0)) + _png_chunk(b'IEND', b''))
+        band = Image.open(io.BytesIO(data))
+        band.load()
+        if height != rows:
+            band = band.crop((0, 1, self.size[0], height))
+        self._last_row = band.crop((0, rows - 1, self.size[0], rows)).tobytes()
+        self.y += rows
+        return band
+
+    def close(self):
+        self.fp.close()
+
+
+class TiffStripReader:
+    """逐条带解码按 strip 存储的 TIFF，每个条带重新封装成一个小 TIFF 交给 Pillow 解码"""
+
+    def __init__(self, path):
+        # 直接使用插件类读取文件头，避免 Image.open 对超大图片的像素数限制
+        im = TiffImagePlugin.TiffImageFile(path)
+        tags = im.tag_v2
+        if 322 in tags or tags.get(284, 1) != 1 or tags.get(274, 1) != 1:
+            raise ValueError("流式模式只支持按条带存储、像素交错、无方向标记的 TIFF")
+        self.size = im.size
+        self.tags = tags
+        self.compressed = tags.get(259, 1) != 1
+        self.offsets = tags[273]
+        self.counts = tags[279]
+        self.rows_per_strip = min(tags.get(278, self.size[1]), self.size[1])
+        if not self.compressed:
+            self.row_bytes = self.counts[0] // self.rows_per_strip
+        im.close()
+        self.fp = open(path, 'rb')
+        self.y = 0
+
+    def align(self, rows):
+        """压缩的 TIFF 只能在条带边界切分"""
+        if not self.compressed:
+            return rows
+        return max(1, rows // self.rows_per_strip) * self.rows_per_strip
+
+    def _read_raw(self, rows):
+        data = []
+        y, end = self.y, self.y + rows
+        while y < end:
+            strip = y // self.rows_per_strip
+            start = y - strip * self.rows_per_strip
+            take = min(end - y, self.rows_per_strip - start)
+            self.fp.seek(self.offsets[strip] + start * self.row_bytes)
+            data.append(self.fp.read(take * self.row_bytes))
+            y += take
+        return [b''.join(data)], rows
+
+    def _read_strips(self, rows):
+        first = self.y // self.rows_per_strip
+        last = (self.y + rows - 1) // self.rows_per_strip
+        data = []
+        for strip in range(first, last + 1):
+            self.fp.seek(self.offsets[strip])
+            data.append(self.fp.read(self.counts[strip]))
+        return data, self.rows_per_strip
+
+    def read(self, rows):
+        rows = min(self.align(rows), self.size[1] - self.y)
+        if self.compressed:
+            strips, rows_per_strip = self._read_strips(rows)
+        else:
+            strips, rows_per_strip = self._read_raw(rows)
+
+        ifd = TiffImagePlugin.ImageFileDirectory_v2(prefix=b'II')
+        for tag in TIFF_COPY_TAGS:
+            if tag in self.tags:
+                ifd[tag] = self.tags[tag]
+                ifd.tagtype[tag] = self.tags.tagtype[tag]
+        ifd[256] = self.size[0]
+        ifd[257] = rows
+        ifd[278] = rows_per_strip
+        # tobytes 会把 StripOffsets 自动加上 IFD 末尾的位置，这里只需给出相对偏移
+        ifd.tagtype[273] = ifd.tagtype[279] = TiffTags.LONG
+        ifd[279] = tuple(len(strip) for strip in strips)
+        offsets, offset = [], 0
+        for strip in strips:
+            offsets.append(offset)
+            offset += len(strip)
+        ifd[273] = tuple(offsets)
+        data = b'II*\x00' + struct.pack('<I', 8) + ifd.tobytes(8) + b''.join(strips)
+
+        band = Image.open(io.BytesIO(data))
+        band.load()
+        self.y += rows
+        return band
+
+    def close(self):
+        self.fp.close()
+
+
+class PngStripWriter:
+    """逐条带写出 PNG（每行使用 None 滤波，IDAT 随压缩进度输出）"""
+
+    COLOR_TYPES = {'L': (0, 1), 'RGB': (2, 3), 'LA': (4, 2), 'RGBA': (6, 4)}
+
+    def __init__(self, path, size, mode, compress_level=6):
+        if mode not in self.COLOR_TYPES:
+            raise ValueError(f"流式 PNG 输出不支持 {mode} 模式")
+        color_type, channels = self.COLOR_TYPES[mode]
+        self.stride = size[0] * channels
+        self.fp = open(path, 'wb')
+        self.fp.write(PNG_SIGNATURE)
+        self.fp.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', size[0], size[1], 8,
+                                                       color_type, 0, 0, 0)))
+        self._zlib = zlib.compressobj(compress_level)
+
+    def write(self, band):
+        raw = band.tobytes()
+        rows = b''.join(b'\x00' + raw[i:i + self.stride] for i in range(0, len(raw), self.stride))
+        data = self._zlib.compress(rows)
+        if data:
+            self.fp.write(_png_chunk(b'IDAT', data))
+
+    def close(self):
+        self.fp.write(_png_chunk(b'IDAT', self._zlib.flush()))
+        self.fp.write(_png_chunk(b'IEND', b''))
+        self.fp.close()
+
+
+class TiffStripWriter:
+    """逐条带写出未压缩的 TIFF，每个条带一个 strip
+
+    输出大小事先已知，IFD 和各 strip 的偏移直接写在文件开头。
+    """
+
+    PHOTOMETRIC = {'L': (1, 1), 'LA': (1, 2), 'RGB': (2, 3), 'RGBA': (2, 4)}
+
+    def __init__(self, path, size, mode, rows_per_strip):
+        if mode not in self.PHOTOMETRIC:
+            raise ValueError(f"流式 TIFF 输出不支持 {mode} 模式")
+        photometric, channels = self.PHOTOMETRIC[mode]
+        width, height = size
+        rows_per_strip = min(rows_per_strip, height)
+        counts, offsets, offset = [], [], 0
+        for y in range(0, height, rows_per_strip):
+            offsets.append(offset)
+            counts.append(min(rows_per_strip, height - y) * width * channels)
+            offset += counts[-1]
+        if offset + len(counts) * 8 + 256 > 0xffffffff:
+            raise ValueError("流式 TIFF 输出超过 4 GB")
+
+        ifd = TiffImagePlugin.ImageFileDirectory_v2(prefix=b'II')
+        ifd[256] = width
+        ifd[257] = height
+        ifd[258] = (8,) * channels
+        ifd[259] = 1
+        ifd[262] = photometric
+        ifd[277] = channels
+        ifd[278] = rows_per_strip
+        ifd[284] = 1
+        if mode in ('LA', 'RGBA'):
+            ifd[338] = 2  # 非预乘 alpha
+        # tobytes 会把 StripOffsets 自动加上 IFD 末尾的位置，这里只需给出相对偏移
+        ifd.tagtype[273] = ifd.tagtype[279] = TiffTags.LONG
+        ifd[273] = tuple(offsets)
+        ifd[279] = tuple(counts)
+
+        self.fp = open(path, 'wb')
+        self.fp.write(b'II*\x00' + struct.pack('<I', 8) + ifd.tobytes(8))
+
+    def write(self, band):
+        self.fp.write(band.tobytes())
+
+    def close(self):
+        self.fp.close()
+
+
+READERS = {'.png': PngStripReader, '.tif': TiffStripReader, '.tiff': TiffStripReader}
+
+
+def open_reader(path):
+    """返回条带读取器；不支持流式处理的文件返回 None"""
+    reader_class = READERS.get(os.path.splitext(path)[1].lower())
+    if reader_class is None:
+        return None
+    try:
+        return reader_class(path)
+    except (ValueError, KeyError, OSError, struct.error):
+        return None
+
+
+def watermark_stream(reader, out_path, mark, space, angle, memory_bytes=DEFAULT_MEMORY_BYTES,
+                     compress_level=6, render_mode='visible'):
+    """按条带为 reader 中的图片添加水印并写到 out_path，render_mode 与 WatermarkRenderer 相同"""
+    width, height = reader.size
+    rows = band_rows(width, memory_bytes)
+    if rows >= RENDER_BLOCK:
+        # 条带与水印层的分块对齐，每块只计算一次
+        rows -= rows % RENDER_BLOCK
+    if hasattr(reader, 'align'):
+        rows = reader.align(rows)
+
+    ext = os.path.splitext(out_path)[1].lower()
+    band = reader.read(rows)
+    # 与整图处理保持一致：PNG 输出 RGBA，TIFF 输出 RGB
+    mode = composite_mode(band, ext)
+    try:
+        if ext == '.png':
+            writer = PngStripWriter(out_path, reader.size, mode, compress_level)
+        else:
+            writer = TiffStripWriter(out_path, reader.size, mode, rows)
+    except Exception:
+        reader.close()
+        raise
+
+    canvas = None
+    y0 = 0
+    try:
+        if render_mode == 'canvas':
+            canvas = render_canvas_layer(mark, space, angle, reader.size)
+            left = -int((width - canvas.size[0]) / 2)
+            top = -int((height - canvas.size[1]) / 2)
+        while band is not None:
+            y1 = y0 + band.size[1]
+            if band.mode != mode:
+                band = band.convert(mode)
+            if canvas is not None:
+                layer = canvas.crop((left, top + y0, left + width, top + y1))
+            else:
+                layer = render_visible_layer(mark, space, angle, reader.size, (0, y0, width, y1))
+            band.paste(layer.convert(mode) if mode != 'RGBA' else layer, (0, 0),
+                       mask=layer.getchannel('A'))
+            del layer
+            writer.write(band)
+            y0 = y1
+            band = reader.read(rows) if y0 < height else None
+    finally:
+        writer.close()
+        reader.close()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""按文件、按阶段记录处理耗时和内存变化
+
+关闭时渲染器使用一个空的上下文管理器，热路径上只多一次属性判断。
+内存按阶段前后的进程 RSS 变化统计（Pillow 的像素内存不经过 tracemalloc），
+多线程并行时各线程的内存变化会互相叠加，只有串行或进程池方式下才准确。
+"""
+
+import os
+import csv
+import json
+import math
+import time
+import threading
+from contextlib import nullcontext
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+NO_TIMING = nullcontext()
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss_bytes():
+    """当前进程的常驻内存，无法获取时返回 None"""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return None
+
+
+def percentile(values, p):
+    """最近秩法的百分位数，values 为空时返回 None"""
+    values = sorted(values)
+    if not values:
+        return None
+    index = max(0, math.ceil(p / 100 * len(values)) - 1)
+    return values[index]
+
+
+class _Stage:
+    __slots__ = ('timer', 'path', 'name', 'start', 'rss')
+
+    def __init__(self, timer, path, name):
+        self.timer = timer
+        self.path = path
+        self.name = name
+
+    def __enter__(self):
+        self.rss = rss_bytes() if self.timer.track_memory else None
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        allocated = rss_bytes() - self.rss if self.rss is not None else 0
+        self.timer.add(self.path, self.name, elapsed, allocated)
+        return False
+
+
+class StageTimer:
+    """各阶段耗时统计，可跨进程合并"""
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory and rss_bytes() is not None
+        self.files = {}  # 路径 -> {阶段: [次数, 秒, 字节]}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # 传给工作进程时不带已有记录
+        state = self.__dict__.copy()
+        state['files'] = {}
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def stage(self, path, name):
+        return _Stage(self, path, name)
+
+    def add(self, path, name, seconds, allocated=0):
+        with self._lock:
+            stages = self.files.setdefault(path, {})
+            entry = stages.setdefault(name, [0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] += allocated
+
+    def pop(self, path):
+        """取出一个文件的记录（工作进程把记录交回主进程）"""
+        with self._lock:
+            return self.files.pop(path, None)
+
+    def merge(self, path, stages):
+        for name, (count, seconds, allocated) in stages.items():
+            with self._lock:
+                entry = self.files.setdefault(path, {}).setdefault(name, [0, 0.0, 0])
+                entry[0] += count
+                entry[1] += seconds
+                entry[2] += allocated
+
+    def totals(self):
+        """按阶段汇总: {阶段: {'files', 'total_ms', 'avg_ms', 'max_ms', 'bytes'}}"""
+        totals = {}
+        with self._lock:
+            for stages in self.files.values():
+                for name, (count, seconds, allocated) in stages.items():
+                    total = totals.setdefault(name, {'files': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                                     'bytes': 0})
+                    total['files'] += 1
+                    total['total_ms'] += seconds * 1000
+                    total['max_ms'] = max(total['max_ms'], seconds * 1000)
+                    total['bytes'] += allocated
+        for total in totals.values():
+            total['avg_ms'] = total['total_ms'] / total['files']
+        return totals
+
+    def report(self):
+        """汇总结果，按总耗时从高到低，每个阶段一行"""
+        totals = self.totals()
+        grand = sum(t['total_ms'] for t in totals.values()) or 1
+        lines = [f"各阶段耗时（共 {len(self.files)} 个文件）:"]
+        for name, t in sorted(totals.items(), key=lambda item: -item[1]['total_ms']):
+            line = (f"  {name}: 合计 {t['total_ms']:.0f}ms ({t['total_ms'] / grand * 100:.0f}%), "
+                    f"平均 {t['avg_ms']:.1f}ms, 最长 {t['max_ms']:.0f}ms")
+            if self.track_memory:
+                line += f", 内存 {t['bytes'] / t['files'] / 1024 / 1024:+.1f} MB/张"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def export(self, path):
+        """导出为 CSV（每个文件每个阶段一行）或 JSON，按扩展名决定"""
+        with self._lock:
+            files = {p: {n: list(v) for n, v in stages.items()} for p, stages in self.files.items()}
+        if os.path.splitext(path)[1].lower() == '.json':
+            data = {
+                'totals': self.totals(),
+                'files': {p: {n: {'count': c, 'ms': s * 1000, 'bytes': b}
+                              for n, (c, s, b) in stages.items()}
+                          for p, stages in files.items()},
+            }
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        else:
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['file', 'stage', 'count', 'ms', 'bytes'])
+                for p, stages in files.items():
+                    for n, (c, s, b) in stages.items():
+                        writer.writerow([p, n, c, f"{s * 1000:.3f}", b])
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""监视文件夹：新放入的图片写入完成后立即加水印
+
+Linux 上用 inotify 接收文件变化（通过 ctypes 调用，无需额外依赖），其它系统或 inotify 不可用时轮询：
+每次只重新扫描修改时间变化的文件夹，另外定期完整扫描一次，发现原地改写的文件。
+文件的大小和修改时间在 settle 秒内不再变化（inotify 下收到写入关闭事件后只需很短的时间）才开始处理，
+不会处理写了一半的文件。工作者常驻，水印和水印层缓存一直有效。
+"""
+
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .scan import IMAGE_EXTENSIONS, _match
+from .batch import _init_process_worker, _init_worker, _process_in_worker, warm_pool, worker_barrier
+from .timing import percentile
+
+# inotify 事件
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+_EVENT = struct.Struct('iIII')
+
+# 收到写入关闭事件后再等待的时间
+CLOSED_SETTLE = 0.05
+
+
+class Inotify:
+    """最小的 inotify 封装；不可用时构造函数抛出 OSError"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify 不可用')
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 失败')
+        self._dirs = {}  # watch descriptor -> 文件夹
+
+    def add(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK)
+        if wd >= 0:
+            self._dirs[wd] = path
+
+    def read(self, timeout):
+        """等待最多 timeout 秒，返回 [(文件夹, 名称, 事件)]；队列溢出时名称为 None"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, None, mask))
+                continue
+            directory = self._dirs.get(wd)
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            if directory is not None:
+                events.append((directory, os.fsdecode(name), mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FolderWatcher:
+    """产出写入已完成的新图片或被改写的图片"""
+
+    def __init__(self, root, recursive=True, include=None, exclude=None, skip_dirs=(),
+                 settle=0.3, poll_interval=0.25, full_scan_interval=30, use_inotify=True):
+        self.root = root
+        self.recursive = recursive
+        self.include = include
+        self.exclude = exclude
+        self.skip_dirs = {os.path.realpath(path) for path in skip_dirs if path}
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.full_scan_interval = full_scan_interval
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+            except OSError:
+                self.inotify = None
+        self.mode = 'inotify' if self.inotify else '轮询'
+        self._pending = {}  # 路径 -> [大小, 修改时间, 稳定开始时间, 是否已关闭]
+        self._dirs = {}  # 轮询: 文件夹 -> 修改时间
+        self._known = {}  # 轮询: 文件 -> (大小, 修改时间)
+        self._last_full_scan = 0.0
+
+    @property
+    def waiting(self):
+        """正在等待写入完成的文件数"""
+        return len(self._pending)
+
+    def start(self):
+        """登记现有的文件夹和文件；现有文件同样作为候选（由调用方按处理记录跳过）"""
+        self._scan_tree(self.root)
+        self._last_full_scan = time.monotonic()
+
+    def _relative(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def _wanted_dir(self, path):
+        if os.path.realpath(path) in self.skip_dirs:
+            return False
+        return path == self.root or not (self.exclude and _match(self._relative(path), self.exclude))
+
+    def _wanted_file(self, path):
+        if not path.lower().endswith(IMAGE_EXTENSIONS):
+            return False
+        rel_path = self._relative(path)
+        if rel_path.startswith('..'):
+            return False
+        if self.exclude and _match(rel_path, self.exclude):
+            return False
+        return not self.include or _match(rel_path, self.include)
+
+    def _scan_tree(self, top):
+        """登记 top 下的文件夹（inotify 监视或记录修改时间），文件作为候选"""
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            if not self._wanted_dir(directory):
+                continue
+            if self.inotify:
+                # 先监视再列出，列出期间新建的文件也不会漏掉
+                self.inotify.add(directory)
+            try:
+                st = os.stat(directory)
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            self._dirs[directory] = st.st_mtime_ns
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        if self.recursive:
+                            stack.append(entry.path)
+                    else:
+                        self._candidate(entry.path)
+                except OSError:
+                    continue
+
+    def _candidate(self, path, closed=False):
+        if not self._wanted_file(path):
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._pending.pop(path, None)
+            return
+        state = (st.st_size, st.st_mtime_ns)
+        if not self.inotify:
+            # 轮询时只关心大小或修改时间变化过的文件
+            if self._known.get(path) == state and path not in self._pending:
+                return
+            self._known[path] = state
+        entry = self._pending.get(path)
+        if entry is None or (entry[0], entry[1]) != state:
+            self._pending[path] = [st.st_size, st.st_mtime_ns, time.monotonic(), closed]
+        elif closed:
+            entry[3] = True
+
+    def _poll_dirs(self):
+        now = time.monotonic()
+        if now - self._last_full_scan >= self.full_scan_interval:
+            self._last_full_scan = now
+            self._scan_tree(self.root)
+            return
+        for directory, mtime in list(self._dirs.items()):
+            if directory not in self._dirs:
+                continue  # 已随上级文件夹一起删除
+            try:
+                st = os.stat(directory)
+                if st.st_mtime_ns == mtime:
+                    continue
+                entries = list(os.scandir(directory))
+            except OSError:
+                # 文件夹在扫描期间被删除或无法访问
+                self._forget_dir(directory)
+                continue
+            self._dirs[directory] = st.st_mtime_ns
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if is_dir:
+                    if self.recursive and entry.path not in self._dirs:
+                        self._scan_tree(entry.path)
+                else:
+                    self._candidate(entry.path)
+
+    def _forget_dir(self, directory):
+        """不再轮询已消失的文件夹及其子文件夹，重新出现时由完整扫描或上级文件夹的变化登记"""
+        prefix = os.path.join(directory, '')
+        for path in [path for path in self._dirs if path == directory or path.startswith(prefix)]:
+            del self._dirs[path]
+        for path in [path for path in self._known if path.startswith(prefix)]:
+            del self._known[path]
+
+    def _handle_events(self, timeout):
+        for directory, name, mask in self.inotify.read(timeout):
+            if name is None:
+                # 事件队列溢出，完整扫描一次
+                self._scan_tree(self.root)
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and self.recursive:
+                    self._scan_tree(path)
+                continue
+            self._candidate(path, closed=bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO)))
+
+    def poll(self, timeout):
+        """等待最多 timeout 秒，返回写入已完成的文件 [(路径, 最后修改时间)]"""
+        if self.inotify:
+            self._handle_events(timeout if not self._pending else min(timeout, CLOSED_SETTLE))
+        else:
+            time.sleep(min(timeout, self.poll_interval))
+            self._poll_dirs()
+
+        ready = []
+        now = time.monotonic()
+        for path, entry in list(self._pending.items()):
+            size, mtime, since, closed = entry
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self._pending[path]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime):
+                self._pending[path] = [st.st_size, st.st_mtime_ns, now, False]
+                continue
+            if now - since >= (min(self.settle, CLOSED_SETTLE) if closed else self.settle):
+                del self._pending[path]
+                ready.append((path, st.st_mtime))
+        return ready
+
+    def close(self):
+        if self.inotify:
+            self.inotify.close()
+
+
+class WatchDaemon:
+    """常驻工作者池处理监视到的图片，定期输出排队数量和端到端延迟"""
+
+    def __init__(self, renderer, watcher, manifest, workers=1, backend='process', log=print,
+                 status_interval=10, window=1000):
+        self.renderer = renderer
+        self.watcher = watcher
+        self.manifest = manifest
+        self.workers = max(1, workers)
+        self.backend = backend
+        self.log = log
+        self.status_interval = status_interval
+        self.running = {}  # future -> (路径, 最后修改时间, 提交时间)
+        self.queued = deque()  # 等待空闲工作者的 (路径, 最后修改时间)
+        self._waiting = set()  # 排队或处理中的路径
+        self._changed = {}  # 处理中又被改写的路径 -> 最后修改时间，处理完成后再处理一次
+        self.latencies = deque(maxlen=window)  # 文件最后写入到输出完成，毫秒
+        self.processed = 0
+        self.errors = 0
+        self.started = time.time()
+        self._stopped = False
+        self._pool = None
+
+    def stop(self):
+        self._stopped = True
+
+    def start(self):
+        ready = worker_barrier(self.backend, self.workers)
+        if self.backend == 'process':
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             initializer=_init_process_worker,
+                                             initargs=(self.renderer, ready))
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                            initargs=(self.renderer, ready))
+        warm_pool(self._pool, self.workers, ready)
+        self.watcher.start()
+
+    def run(self):
+        """运行到 stop() 或 KeyboardInterrupt"""
+        self.start()
+        self.log(f"正在监视 {self.watcher.root}（{self.watcher.mode}，{self.workers} 个工作者）")
+        last_status = time.monotonic()
+        activity = False
+        try:
+            while not self._stopped:
+                for path, mtime in self.watcher.poll(0.2 if not self.running else 0.05):
+                    self._enqueue(path, mtime)
+                self._submit()
+                activity |= self._collect()
+                if activity and time.monotonic() - last_status >= self.status_interval:
+                    self.log(self.status())
+                    last_status = time.monotonic()
+                    activity = False
+        finally:
+            for future in self.running:
+                future.cancel()
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self.watcher.close()
+
+    def _enqueue(self, path, mtime):
+        if path in self._waiting:
+            # 已在排队的会读到最新的内容；正在处理的可能读到了改写前的内容
+            if any(path == job[0] for job in self.running.values()):
+                self._changed[path] = mtime
+            return
+        if self.manifest.outputs_current(path, self.renderer.output_paths(path)):
+            return
+        self._waiting.add(path)
+        self.queued.append((path, mtime))
+
+    def _submit(self):
+        # 只把工作者数量两倍的任务交给进程池，其余在这里排队，排队数量准确可见
+        while self.queued and len(self.running) < self.workers * 2:
+            path, mtime = self.queued.popleft()
+            future = self._pool.submit(_process_in_worker, path)
+            self.running[future] = (path, mtime, time.time())
+
+    def _collect(self):
+        done = [future for future in self.running if future.done()]
+        for future in done:
+            path, mtime, _ = self.running.pop(future)
+            try:
+                (ok, message), timings, _ = future.result()
+            except Exception as e:
+                ok, message, timings = self.renderer.error_result(path, e) + (None,)
+            if timings:
+                self.renderer.timer.merge(path, timings)
+            self.processed += 1
+            self._waiting.discard(path)
+            if path in self._changed:
+                self._waiting.add(path)
+                self.queued.append((path, self._changed.pop(path)))
+            if ok:
+                if self._unchanged(path, mtime):
+                    # 处理期间被改写的文件不记录，之后还会再处理
+                    self.manifest.record(path, self.renderer.output_path(path))
+                if mtime >= self.started:
+                    # 启动前就存在的文件不计入延迟
+                    self.latencies.append((time.time() - mtime) * 1000)
+            else:
+                self.errors += 1
+            self.log(message)
+        return bool(done)
+
+    def _unchanged(self, path, mtime):
+        try:
+            return os.stat(path).st_mtime == mtime
+        except OSError:
+            return False
+
+    def status(self):
+        latencies = list(self.latencies)
+        text = (f"队列: 等待写入完成 {self.watcher.waiting}, 排队 {len(self.queued)}, "
+                f"处理中 {len(self.running)} | 已处理 {self.processed} 张，失败 {self.errors} 张")
+        if latencies:
+            text += (f" | 端到端延迟 p50 {percentile(latencies, 50):.0f}ms, "
+                     f"p90 {percentile(latencies, 90):.0f}ms, 最大 {max(latencies):.0f}ms")
+        return text